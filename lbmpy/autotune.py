@@ -0,0 +1,270 @@
+"""
+Auto-tuning of optimization parameters
+======================================
+
+The fastest combination of vectorization, common subexpression elimination, field layout and number of OpenMP
+threads depends on the method, the domain size and the machine. :func:`autotune` sets up a lid driven cavity for
+every candidate optimization, like the benchmarks in ``lbmpy_tests/benchmark``, times it with ``benchmark_run`` and
+returns the fastest optimization dict. Kernels are created through the kernel cache, so repeated tuning runs do not
+compile again.
+
+The winner is stored in a :class:`TuningStore`, a JSON file with one section per machine. Later calls with the same
+parameters on the same machine return the stored optimization immediately, so production runs can simply use
+
+>>> from lbmpy.lbstep import LatticeBoltzmannStep
+>>> domain_size, method_parameters = (64, 64), {'stencil': 'D2Q9', 'method': 'srt', 'relaxation_rate': 1.8}
+>>> optimization = autotune(domain_size, **method_parameters)  # doctest: +SKIP
+>>> step = LatticeBoltzmannStep(domain_size, optimization=optimization, **method_parameters)  # doctest: +SKIP
+
+The default store is located in the user cache directory, or in the file given by the environment variable
+``LBMPY_TUNING_STORE``.
+"""
+import hashlib
+import json
+import os
+import platform
+import tempfile
+import warnings
+
+import numpy as np
+
+from lbmpy.creationfunctions import update_with_default_parameters
+from lbmpy.kernel_cache import parameter_hash
+from lbmpy.scenarios import create_lid_driven_cavity
+from pystencils.cache import memorycache
+
+__all__ = ['autotune', 'default_candidates', 'optimization_options_cpu', 'machine_fingerprint', 'TuningStore',
+           'get_default_tuning_store']
+
+STORE_FORMAT_VERSION = 2
+
+
+def optimization_options_cpu(all_vectorization_options=False, all_cse_options=False, cores=(1,), with_split=False,
+                             instruction_set='avx'):
+    """Generator of different CPU optimization options.
+
+    Args:
+        all_vectorization_options: if true, explore all different vectorization possibilities (x6 more options)
+        all_cse_options: if true, explore all cse options
+        cores: sequence of core numbers
+        with_split: if true, yield configurations with and without split, otherwise only without split
+        instruction_set: 'sse', 'avx' or 'avx2', or None to generate only options without vectorization
+    """
+
+    if instruction_set is None:
+        vectorization_options = [False]
+    elif all_vectorization_options:
+        vectorization_options = [
+            {'instruction_set': instruction_set,
+             'assume_aligned': assume_aligned,
+             'nontemporal': nontemporal,
+             'assume_inner_stride_one': True,
+             'assume_sufficient_line_padding': lp}
+            for assume_aligned in (False, True)
+            for nontemporal in ((False, True) if assume_aligned else (False,))
+            for lp in (False, True)
+        ]
+        vectorization_options.append(False)
+    else:
+        vectorization_options = [{'instruction_set': instruction_set, 'assume_aligned': True,
+                                  'nontemporal': True, 'assume_inner_stride_one': True}]
+
+    if all_cse_options:
+        cse_options = [
+            {'cse_pdfs': cse_pdfs, 'cse_global': cse_global}
+            for cse_pdfs in (False, True) for cse_global in (False, True)
+        ]
+    else:
+        cse_options = [{'cse_pdfs': False, 'cse_global': True}]
+
+    for vectorization_option in vectorization_options:
+        for cse_option in cse_options:
+            for split in (False, True) if with_split else (False,):
+                for openmp in cores:
+                    for field_layout in ('fzyx', 'zyxf'):
+                        if field_layout == 'zyxf' and vectorization_option is not False:
+                            continue
+                        opt_option = cse_option.copy()
+                        opt_option['vectorization'] = vectorization_option
+                        opt_option['split'] = split
+                        opt_option['openmp'] = openmp
+                        opt_option['field_layout'] = field_layout
+                        yield opt_option
+
+
+def autotune(domain_size, candidates=None, store=True, retune=False, time_steps=20, repetitions=3,
+             kernel_cache=True, **method_parameters):
+    """Returns the optimization dict for which kernels of the given method run fastest on this machine.
+
+    Args:
+        domain_size: domain size of the scenario, the timings depend on whether the pdfs fit into caches
+        candidates: sequence of optimization dicts to choose from. By default all vectorization options with the
+                    best supported instruction set, and all field layouts, each with one and all cores.
+        store: :class:`TuningStore`, True for the default store, or False to neither look up nor store results
+        retune: run the timings even if the store has a result for these parameters
+        time_steps: time steps per timing, the best of the repetitions is taken
+        repetitions: number of timings per candidate
+        kernel_cache: passed on as ``kernel_cache`` optimization parameter, see :mod:`lbmpy.kernel_cache`
+        method_parameters: method parameters, passed on to :func:`lbmpy.scenarios.create_lid_driven_cavity`
+
+    Returns:
+        optimization dict, without the kernel cache
+    """
+    if candidates is None:
+        candidates = list(default_candidates())
+    if store is True:
+        store = get_default_tuning_store()
+    key = _tuning_key(domain_size, candidates, method_parameters) if store else None
+
+    if key is not None and not retune:
+        entry = store.get(key)
+        if entry is not None:
+            return entry['optimization']
+
+    timings = []
+    for optimization in candidates:
+        try:
+            step = create_lid_driven_cavity(domain_size, optimization=dict(optimization, kernel_cache=kernel_cache),
+                                            **method_parameters)
+            mlups = max(step.benchmark_run(time_steps) for _ in range(repetitions))
+        except Exception as e:  # e.g. vectorization not possible for this kernel, or compiler errors
+            warnings.warn("Skipping optimization {}: {}".format(optimization, e))
+            continue
+        if not np.isfinite(step.data_handling.max(step.velocity_data_name)):
+            warnings.warn("Skipping optimization {}: simulation got unstable".format(optimization))
+            continue
+        timings.append((mlups, optimization))
+
+    if not timings:
+        raise ValueError("None of the candidate optimizations could be run")
+    mlups, best = max(timings, key=lambda t: t[0])
+    if key is not None:
+        store.set(key, {'optimization': best, 'mlups': mlups, 'domain_size': list(domain_size),
+                        'timings': [{'optimization': o, 'mlups': m} for m, o in timings]})
+    return best
+
+
+def default_candidates():
+    """Candidates of :func:`autotune`: all vectorization options and layouts, each with one and all cores."""
+    from pystencils.backends.simd_instruction_sets import get_supported_instruction_sets
+
+    instruction_sets = get_supported_instruction_sets()
+    cores = sorted({1, os.cpu_count() or 1})
+    return optimization_options_cpu(all_vectorization_options=True, cores=cores,
+                                    instruction_set=instruction_sets[-1] if instruction_sets else None)
+
+
+def machine_fingerprint():
+    """Hash identifying the CPU model, core count and compiler configuration of this machine.
+
+    The host name is not part of the fingerprint, such that all nodes of a cluster with the same hardware share
+    their tuning results. It is stored in the description of the machine only.
+    """
+    from pystencils.cpu.cpujit import get_compiler_config
+    description = {'cpu': _cpu_model(), 'cpu_count': os.cpu_count(),
+                   'compiler': {k: str(v) for k, v in get_compiler_config().items()}}
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class TuningStore:
+    """JSON file with tuning results, grouped by :func:`machine_fingerprint`.
+
+    Args:
+        path: file name of the store, created with the first result
+        fingerprint: machine the results belong to, by default the current machine
+    """
+
+    def __init__(self, path, fingerprint=None):
+        self.path = os.path.abspath(path)
+        self.fingerprint = machine_fingerprint() if fingerprint is None else fingerprint
+
+    def get(self, key):
+        """Stored result dict for the key on this machine, or None."""
+        return self._read()['machines'].get(self.fingerprint, {}).get('results', {}).get(key)
+
+    def set(self, key, result):
+        content = self._read()
+        machine = content['machines'].setdefault(self.fingerprint, {'description': _machine_description(),
+                                                                    'results': {}})
+        machine['results'][key] = result
+        self._write(content)
+
+    def results(self):
+        """Dict mapping keys to the results stored for this machine."""
+        return dict(self._read()['machines'].get(self.fingerprint, {}).get('results', {}))
+
+    def clear(self):
+        """Removes all results of this machine."""
+        content = self._read()
+        content['machines'].pop(self.fingerprint, None)
+        self._write(content)
+
+    def __repr__(self):
+        return "TuningStore({!r})".format(self.path)
+
+    # ------------------------------ Implementation Details ------------------------------------------------------------
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                content = json.load(f)
+        except (OSError, ValueError):
+            content = None
+        if not content or content.get('format_version') != STORE_FORMAT_VERSION:
+            content = {'format_version': STORE_FORMAT_VERSION, 'machines': {}}
+        return content
+
+    def _write(self, content):
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        # write to temporary file first, such that readers never see a partially written store
+        fd, tmp_file = tempfile.mkstemp(prefix='.tmp_', dir=directory)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(content, f, indent=2, sort_keys=True)
+        os.replace(tmp_file, self.path)
+
+
+_default_tuning_store = None
+
+
+def get_default_tuning_store():
+    """Returns the process-wide default tuning store, located at LBMPY_TUNING_STORE if this env variable is set"""
+    global _default_tuning_store
+    if _default_tuning_store is None:
+        if 'LBMPY_TUNING_STORE' in os.environ:
+            path = os.environ['LBMPY_TUNING_STORE']
+        else:
+            from appdirs import user_cache_dir
+            path = os.path.join(user_cache_dir('lbmpy'), 'tuning.json')
+        _default_tuning_store = TuningStore(path)
+    return _default_tuning_store
+
+
+# -------------------------------------------- Helper Functions --------------------------------------------------------
+
+
+def _tuning_key(domain_size, candidates, method_parameters):
+    """Key of a tuning result in the store, or None if the method parameters can not be hashed reliably."""
+    # scenario parameters like lid_velocity are passed on unchanged
+    params, _ = update_with_default_parameters(dict(method_parameters), {}, fail_on_unknown_parameter=False)
+    # the lbmpy sources are not hashed, such that results survive lbmpy updates - bump the format version instead
+    description = {'domain_size': tuple(domain_size), 'candidates': list(candidates),
+                   'format_version': STORE_FORMAT_VERSION}
+    return parameter_hash(params, description, environment=False)
+
+
+def _machine_description():
+    """Human readable description of this machine, stored along with the tuning results."""
+    return {'node': platform.node(), 'machine': platform.machine(), 'processor': platform.processor(),
+            'cpu_count': os.cpu_count(), 'cpu': _cpu_model()}
+
+
+@memorycache(maxsize=1)
+def _cpu_model():
+    """CPU brand string, or the processor reported by the platform module if py-cpuinfo is not installed."""
+    try:
+        from cpuinfo import get_cpu_info
+    except ImportError:
+        return platform.processor() or platform.machine()
+    info = get_cpu_info()  # slow, runs a subprocess
+    return info.get('brand_raw', info.get('brand', ''))
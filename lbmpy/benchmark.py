@@ -0,0 +1,583 @@
+"""
+Benchmark sweeps and result stores
+==================================
+
+The performance benchmarks run lid driven cavities for combinations of method parameters (:func:`method_options`)
+and CPU optimization options (:func:`lbmpy.autotune.optimization_options_cpu`) and record the reached MLUPS together
+with a description of the environment. Results are kept in a :class:`ResultStore`:
+
+    - :class:`JsonLinesResultStore`: one JSON document per line, for files ending in ``.jsonl`` or ``.json``
+    - :class:`SqliteResultStore`: single file SQLite database, for files ending in ``.db``, ``.sqlite`` or ``.sqlite3``
+    - :class:`DatabaseResultStore`: mongodb or blitzdb database of :mod:`pystencils.runhelper`,
+      for ``mongo://`` connection strings
+
+The first two need no database server and no additional packages, :func:`open_result_store` picks the store from
+the identifier. Every stored document is a dict with the keys 'params', 'result' and 'env', like the documents of
+the pystencils database:
+
+>>> from tempfile import TemporaryDirectory
+>>> with TemporaryDirectory() as tmp_dir:
+...     store = open_result_store(tmp_dir + '/results.jsonl')
+...     store.save({'stencil': 'D2Q9', 'method': 'trt'}, {'mlups_median': 40.0}, env={'lbmpy_version': '0.3.2'})
+...     store.save({'stencil': 'D2Q9', 'method': 'trt'}, {'mlups_median': 30.0}, env={'lbmpy_version': '0.3.3'})
+...     regressions = compare_results(store.filter_env({'lbmpy_version': '0.3.2'}),
+...                                   store.filter_env({'lbmpy_version': '0.3.3'}), threshold=0.1)
+>>> [(r['params']['method'], r['ratio']) for r in regressions]
+[('trt', 0.75)]
+
+The sweep and the comparison can also be run from the command line, e.g. on build nodes without network access::
+
+    python -m lbmpy.benchmark run results.db --domain-size 128 128 128 --with-mrt --cores 1 4
+    python -m lbmpy.benchmark compare baseline.db results.db --threshold 0.05
+
+``compare`` exits with status 1 if a configuration got slower by more than the threshold.
+
+:func:`run_phase_field_benchmark` measures a multi-phase :class:`lbmpy.phasefield.phasefieldstep.PhaseFieldStep`,
+e.g. to compare storing the pressure tensor with computing the force directly from the order parameters::
+
+    for store_pressure_tensor in (True, False):
+        params = {'domain_size': (128, 128), 'num_phases': 4, 'store_pressure_tensor': store_pressure_tensor}
+        store.save(dict(params, scenario='phase_field'), run_phase_field_benchmark(**params), env)
+"""
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import sys
+import time
+from contextlib import closing
+from statistics import median
+
+import numpy as np
+import sympy as sp
+
+from lbmpy.autotune import _machine_description, machine_fingerprint, optimization_options_cpu
+from lbmpy.scenarios import create_lid_driven_cavity
+
+__all__ = ['method_options', 'benchmark_scenarios', 'run_benchmark', 'run_phase_field_benchmark',
+           'get_environment', 'ResultStore',
+           'JsonLinesResultStore', 'SqliteResultStore', 'DatabaseResultStore', 'open_result_store',
+           'compare_results', 'main']
+
+
+def parameter_filter(parameters):
+    """Returns false for parameter combinations which are invalid or not implemented yet."""
+    is_entropic_kbc = parameters['method'].startswith('trt-kbc-') and parameters.get("entropic", False)
+    if is_entropic_kbc and parameters['stencil'] == 'D3Q19':
+        return False
+    if is_entropic_kbc and not parameters['compressible']:
+        return False
+    return True
+
+
+def method_options(dim=2, with_srt=False, with_mrt=False,
+                   with_entropic=False, with_cumulant=False, with_smagorinsky=False, with_d3q27=True):
+    """Generator for different lbmpy method parameters
+
+    Args:
+        dim: 2D or 3D
+        with_srt: include single relaxation time models (by default only TRT are included)
+        with_mrt: include multi-relaxation time models
+        with_entropic: include entropic models
+        with_cumulant: include cumulant models
+        with_smagorinsky: include methods with Smagorinsky turbulence model
+        with_d3q27: include D3Q27 next to D3Q19 for 3D
+    """
+    relaxation_rates = tuple(np.linspace(1.1, 1.9, 27))
+    rr_free = "rr_free"
+    methods = [{'method': 'trt'}]
+    if with_mrt:
+        methods += [{'method': 'mrt'}, {'method': 'mrt_raw'}]
+
+    if with_srt:
+        methods += [{'method': 'srt'}]
+
+    if with_entropic:
+        methods += [{'entropic': True, 'method': 'mrt', 'relaxation_rates': [1.5, 1.5, rr_free, rr_free,
+                                                                             rr_free, rr_free]},
+                    {'entropic': True, 'method': 'mrt', 'relaxation_rates': [1.5, rr_free, rr_free, rr_free,
+                                                                             rr_free, rr_free]},
+                    {'entropic': True, 'method': 'trt-kbc-n1'},
+                    {'entropic': True, 'method': 'trt-kbc-n2'},
+                    {'entropic': True, 'method': 'trt-kbc-n3'},
+                    {'entropic': True, 'method': 'trt-kbc-n4'},
+                    {'method': 'entropic-srt'}]
+
+    if with_cumulant:
+        methods += [{'cumulant': True, 'method': 'srt'},
+                    {'cumulant': True, 'method': 'trt'},
+                    {'cumulant': True, 'method': 'mrt3'},
+                    {'cumulant': True, 'method': 'mrt_raw'}]
+
+    if with_smagorinsky:
+        methods += [{'smagorinsky': True, 'method': 'srt'},
+                    {'smagorinsky': True, 'method': 'mrt3'}]
+
+    stencils3d = ('D3Q19', 'D3Q27') if with_d3q27 else ("D3Q19",)
+    for stencil in ("D2Q9",) if dim == 2 else stencils3d:
+        for method in methods:
+            options = {'compressible': True, 'stencil': stencil, 'relaxation_rates': relaxation_rates}
+            options.update(method)
+            if parameter_filter(options):
+                yield options
+
+
+def benchmark_scenarios(domain_size, method_option_params={}, optimization_option_params={},
+                        fixed_loop_sizes=True, fixed_relaxation_rates=True):
+    """Generator of parameter dicts for :func:`run_benchmark`: all method options times all optimization options.
+
+    Args:
+        domain_size: domain size of the lid driven cavity, determines the dimension of the methods
+        method_option_params: keyword arguments of :func:`method_options`
+        optimization_option_params: keyword arguments of :func:`lbmpy.autotune.optimization_options_cpu`
+        fixed_loop_sizes: compile the domain size into the kernels
+        fixed_relaxation_rates: compile the relaxation rates into the kernels
+    """
+    method_option_params = dict(method_option_params, dim=len(domain_size))
+    for method_option in method_options(**method_option_params):
+        for optimization in optimization_options_cpu(**optimization_option_params):
+            result = method_option.copy()
+            result.update({
+                'domain_size': domain_size,
+                'optimization': optimization,
+                'fixed_loop_sizes': fixed_loop_sizes,
+                'fixed_relaxation_rates': fixed_relaxation_rates,
+            })
+            yield result
+
+
+def run_benchmark(domain_size, time_for_benchmark=2, repetitions=5, **kwargs):
+    """Runs a lid driven cavity and measures its performance.
+
+    Args:
+        domain_size: domain size of the cavity
+        time_for_benchmark: seconds per measurement, see :func:`lbmpy.lbstep.LatticeBoltzmannStep.benchmark`
+        repetitions: number of measurements
+        kwargs: parameters as generated by :func:`benchmark_scenarios`, passed on to
+                :func:`lbmpy.scenarios.create_lid_driven_cavity`
+
+    Returns:
+        dict with 'mlups_max', 'mlups_median', 'all_measurements' and 'stable', the MLUPS are None for unstable runs
+    """
+    if 'relaxation_rates' in kwargs:
+        kwargs['relaxation_rates'] = [sp.sympify(e) for e in kwargs['relaxation_rates']]
+
+    sc = create_lid_driven_cavity(domain_size, **kwargs)
+    mlups = [sc.benchmark(time_for_benchmark=time_for_benchmark) for _ in range(repetitions)]
+    if not np.isfinite(sc.data_handling.max(sc.velocity_data_name)):
+        return {'mlups_max': None, 'mlups_median': None, 'all_measurements': [], 'stable': False}
+    return {'mlups_max': max(mlups), 'mlups_median': median(mlups), 'all_measurements': mlups, 'stable': True}
+
+
+def run_phase_field_benchmark(domain_size, num_phases=3, time_for_benchmark=2, repetitions=5, **kwargs):
+    """Runs a drop between two layers of a multi-phase system and measures its performance.
+
+    Args:
+        domain_size: domain size, the layers are stacked along the last coordinate
+        num_phases: number of phases of :func:`lbmpy.phasefield.analytical.free_energy_functional_n_phases_penalty_term`
+        time_for_benchmark: seconds per measurement
+        repetitions: number of measurements
+        kwargs: passed on to :class:`lbmpy.phasefield.phasefieldstep.PhaseFieldStep`, e.g. 'store_pressure_tensor',
+                'fuse_kernels' or 'optimization'
+
+    Returns:
+        dict like :func:`run_benchmark`
+    """
+    from lbmpy.phasefield.analytical import free_energy_functional_n_phases_penalty_term
+    from lbmpy.phasefield.phasefieldstep import PhaseFieldStep
+
+    c = sp.symbols("c_:%d" % (num_phases,))
+    free_energy = free_energy_functional_n_phases_penalty_term(c, 1, [0.01] * num_phases)
+    kwargs.setdefault('hydro_dynamic_relaxation_rate', 1.8)
+    sc = PhaseFieldStep(free_energy, c, domain_size=domain_size, **kwargs)
+    phases = np.eye(num_phases)
+    layers = (slice(None),) * (len(domain_size) - 1)
+    sc.set_concentration(layers + (slice(None, 0.5),), phases[0])
+    sc.set_concentration(layers + (slice(0.5, None),), phases[1])
+    sc.set_concentration((slice(0.4, 0.6),) * len(domain_size), phases[-1])
+    sc.set_pdf_fields_from_macroscopic_values()
+
+    sc.run(1)  # compiles the kernels
+    start = time.perf_counter()
+    sc.run(1)
+    time_steps = max(1, int(time_for_benchmark / (time.perf_counter() - start)))
+    number_of_cells = int(np.prod(domain_size))
+    mlups = []
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        sc.run(time_steps)
+        mlups.append(number_of_cells * time_steps / (time.perf_counter() - start) * 1e-6)
+    if not np.isfinite(sc.data_handling.max(sc.phi_field_name)):
+        return {'mlups_max': None, 'mlups_median': None, 'all_measurements': [], 'stable': False}
+    return {'mlups_max': max(mlups), 'mlups_median': median(mlups), 'all_measurements': mlups, 'stable': True}
+
+
+def get_environment(version_label=None):
+    """Description of the environment stored with each benchmark result.
+
+    Args:
+        version_label: stored as 'lbmpy_version', by default the version of the installed lbmpy package or the
+                       git commit of the lbmpy sources
+    """
+    import pystencils
+    from pystencils.cpu.cpujit import get_compiler_config
+
+    return {
+        'timestamp': time.time(),
+        'hostname': socket.gethostname(),
+        'machine': _machine_description(),
+        'machine_fingerprint': machine_fingerprint(),
+        'cpuCompilerConfig': {k: str(v) for k, v in get_compiler_config().items()},
+        'lbmpy_version': version_label if version_label is not None else _lbmpy_version(),
+        'pystencils_version': pystencils.__version__,
+        'numpy_version': np.__version__,
+        'sympy_version': sp.__version__,
+        'python_version': sys.version.split()[0],
+    }
+
+
+class ResultStore:
+    """Interface of benchmark result stores.
+
+    Subclasses implement :meth:`save_document` and :meth:`documents`, all queries are based on these two.
+    """
+
+    def save(self, params, result, env=None, **kwargs):
+        """Stores a benchmark result.
+
+        Args:
+            params: dict of benchmark parameters
+            result: dict of results
+            env: environment description, by default :func:`get_environment`
+            kwargs: the stored document is updated with the keyword arguments
+        """
+        document = {'params': params, 'result': result, 'env': env if env is not None else get_environment()}
+        document.update(kwargs)
+        # round trip through JSON, such that stored and loaded documents are identical
+        self.save_document(json.loads(json.dumps(document, default=_to_json)))
+
+    def save_document(self, document):
+        raise NotImplementedError()
+
+    def documents(self):
+        """Iterator over all stored documents, dicts with keys 'params', 'result' and 'env'."""
+        raise NotImplementedError()
+
+    def filter_params(self, parameter_query):
+        """Documents whose parameters contain all items of the query dict."""
+        return self._filter('params', parameter_query)
+
+    def filter_env(self, env_query):
+        """Documents whose environment contains all items of the query dict, e.g. {'lbmpy_version': '0.3.3'}."""
+        return self._filter('env', env_query)
+
+    def was_already_simulated(self, parameters):
+        """Checks if there is at least one result for exactly these parameters."""
+        key = _params_key(parameters)
+        return any(_params_key(d['params']) == key for d in self.documents())
+
+    def to_pandas(self, parameter_query, remove_prefix=True):
+        """Documents matching the parameter query as pandas data frame, like ``Database.to_pandas`` of pystencils.
+
+        Environment columns are left out. If ``remove_prefix`` is True, the 'params.' and 'result.' prefixes of the
+        column names are removed.
+        """
+        from pandas import json_normalize
+        documents = [{k: v for k, v in d.items() if k != 'env'} for d in self.filter_params(parameter_query)]
+        if not documents:
+            return None
+        df = json_normalize(documents)
+        if remove_prefix:
+            df.columns = [c[c.index('.') + 1:] if '.' in c else c for c in df.columns]
+        return df
+
+    def _filter(self, section, query):
+        query = json.loads(json.dumps(query, default=_to_json))
+        return [d for d in self.documents()
+                if all(k in d.get(section, {}) and d[section][k] == v for k, v in query.items())]
+
+
+class JsonLinesResultStore(ResultStore):
+    """Appends one JSON document per result to a text file.
+
+    Args:
+        path: file name, the file and its directory are created with the first result
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+
+    def save_document(self, document):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(document, sort_keys=True) + "\n")
+
+    def documents(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def __repr__(self):
+        return "JsonLinesResultStore({!r})".format(self.path)
+
+
+class SqliteResultStore(ResultStore):
+    """Stores results in a SQLite database file, one row per result with JSON encoded columns.
+
+    Args:
+        path: file name of the database, created if it does not exist
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._connect() as connection, connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS results (id INTEGER PRIMARY KEY, params_key TEXT, "
+                               "params TEXT, result TEXT, env TEXT, extra TEXT)")
+            connection.execute("CREATE INDEX IF NOT EXISTS results_params_key ON results (params_key)")
+
+    def save_document(self, document):
+        document = dict(document)
+        row = [_params_key(document['params'])]
+        row += [json.dumps(document.pop(c), sort_keys=True) for c in ('params', 'result', 'env')]
+        row.append(json.dumps(document, sort_keys=True))
+        with self._connect() as connection, connection:
+            connection.execute("INSERT INTO results (params_key, params, result, env, extra) VALUES (?, ?, ?, ?, ?)",
+                               row)
+
+    def documents(self):
+        with self._connect() as connection:
+            rows = connection.execute("SELECT params, result, env, extra FROM results ORDER BY id").fetchall()
+        for params, result, env, extra in rows:
+            document = json.loads(extra)
+            document.update(params=json.loads(params), result=json.loads(result), env=json.loads(env))
+            yield document
+
+    def was_already_simulated(self, parameters):
+        with self._connect() as connection:
+            row = connection.execute("SELECT 1 FROM results WHERE params_key = ? LIMIT 1",
+                                     (_params_key(parameters),)).fetchone()
+        return row is not None
+
+    def __repr__(self):
+        return "SqliteResultStore({!r})".format(self.path)
+
+    def _connect(self):
+        # the connection context manager only commits, closing() closes the file as well
+        return closing(sqlite3.connect(self.path))
+
+
+class DatabaseResultStore(ResultStore):
+    """Adapter for :class:`pystencils.runhelper.Database`, i.e. mongodb or blitzdb.
+
+    Args:
+        connection: database identifier as accepted by the pystencils database, e.g. "mongo://lbmpy_bench"
+    """
+
+    def __init__(self, connection):
+        from pystencils.runhelper.db import Database
+        self.connection = connection
+        self.db = Database(connection)
+
+    def save_document(self, document):
+        document = dict(document)
+        params, result, env = (document.pop(c) for c in ('params', 'result', 'env'))
+        self.db.save(params, result, env, **document)
+
+    def documents(self):
+        for e in self.db.filter({}):
+            yield {k: v for k, v in e.attributes.items() if k != 'pk'}
+
+    def to_pandas(self, parameter_query, remove_prefix=True):
+        return self.db.to_pandas(parameter_query, remove_prefix=remove_prefix)
+
+    def __repr__(self):
+        return "DatabaseResultStore({!r})".format(self.connection)
+
+
+def open_result_store(identifier):
+    """Returns the result store for a file name or connection string.
+
+    Args:
+        identifier: 'mongo://' connection string or blitzdb directory for a :class:`DatabaseResultStore`,
+                    file names ending in '.db', '.sqlite' or '.sqlite3' for a :class:`SqliteResultStore`,
+                    other file names for a :class:`JsonLinesResultStore`
+    """
+    if identifier.startswith('mongo://') or os.path.isdir(identifier):
+        return DatabaseResultStore(identifier)
+    if identifier.endswith(('.db', '.sqlite', '.sqlite3')):
+        return SqliteResultStore(identifier)
+    return JsonLinesResultStore(identifier)
+
+
+def compare_results(baseline, current, threshold=0.05, metric='mlups_median'):
+    """Finds configurations that got slower.
+
+    Results are matched by their parameters, of multiple results for the same parameters the fastest one is used.
+    Configurations without a positive baseline value, e.g. of failed or aborted runs, are skipped.
+
+    Args:
+        baseline: documents of the reference run, e.g. ``store.filter_env({'lbmpy_version': '0.3.2'})``
+        current: documents to check
+        threshold: relative slowdown that counts as regression, 0.05 reports everything more than 5% slower
+        metric: result entry that is compared, larger values are better
+
+    Returns:
+        list of dicts with 'params', 'baseline', 'current' and 'ratio' (current / baseline), slowest first
+    """
+    baseline, current = _best_results(baseline, metric), _best_results(current, metric)
+    regressions = []
+    for key, (params, current_value) in current.items():
+        if key not in baseline or baseline[key][1] <= 0:
+            continue
+        baseline_value = baseline[key][1]
+        ratio = current_value / baseline_value
+        if ratio < 1 - threshold:
+            regressions.append({'params': params, 'baseline': baseline_value, 'current': current_value,
+                                'ratio': ratio})
+    return sorted(regressions, key=lambda r: r['ratio'])
+
+
+def main(argv=None):
+    """Command line interface, see ``python -m lbmpy.benchmark --help``."""
+    parser = argparse.ArgumentParser(prog='python -m lbmpy.benchmark', description=__doc__.strip().split('\n')[0])
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    run_parser = subparsers.add_parser('run', help="run the method x optimization options sweep")
+    run_parser.add_argument('store', help="result file (.jsonl, .db) or mongo:// connection string")
+    run_parser.add_argument('--domain-size', type=int, nargs='+', action='append', required=True,
+                            help="domain size, can be given multiple times")
+    for option in ('srt', 'mrt', 'entropic', 'cumulant', 'smagorinsky'):
+        run_parser.add_argument('--with-' + option, action='store_true', help="include {} methods".format(option))
+    run_parser.add_argument('--no-d3q27', action='store_true', help="only D3Q19 for 3D domains")
+    run_parser.add_argument('--all-vectorization-options', action='store_true')
+    run_parser.add_argument('--all-cse-options', action='store_true')
+    run_parser.add_argument('--with-split', action='store_true')
+    run_parser.add_argument('--instruction-set', default='auto',
+                            help="'auto' for the best supported one, or 'none' to run without vectorization")
+    run_parser.add_argument('--cores', type=int, nargs='+', default=[1])
+    run_parser.add_argument('--time', type=float, default=2, help="seconds per measurement")
+    run_parser.add_argument('--repetitions', type=int, default=5)
+    run_parser.add_argument('--version-label', help="stored as lbmpy_version, defaults to the installed version")
+    run_parser.add_argument('--skip-existing', action='store_true',
+                            help="skip configurations that already have a result in the store")
+    run_parser.add_argument('--dry-run', action='store_true', help="only list the configurations")
+
+    compare_parser = subparsers.add_parser('compare', help="report configurations that got slower")
+    compare_parser.add_argument('baseline', help="store with the reference results")
+    compare_parser.add_argument('current', nargs='?', help="store with the new results, defaults to baseline store")
+    compare_parser.add_argument('--baseline-version', help="use only baseline results of this lbmpy version")
+    compare_parser.add_argument('--current-version', help="use only current results of this lbmpy version")
+    compare_parser.add_argument('--threshold', type=float, default=0.05)
+    compare_parser.add_argument('--metric', default='mlups_median')
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        return _run_command(args)
+    return _compare_command(args)
+
+
+# -------------------------------------------- Helper Functions --------------------------------------------------------
+
+
+def _run_command(args):
+    instruction_set = args.instruction_set
+    if instruction_set == 'auto':
+        from pystencils.backends.simd_instruction_sets import get_supported_instruction_sets
+        supported = get_supported_instruction_sets()
+        instruction_set = supported[-1] if supported else None
+    elif instruction_set == 'none':
+        instruction_set = None
+
+    method_params = {'with_srt': args.with_srt, 'with_mrt': args.with_mrt, 'with_entropic': args.with_entropic,
+                     'with_cumulant': args.with_cumulant, 'with_smagorinsky': args.with_smagorinsky,
+                     'with_d3q27': not args.no_d3q27}
+    optimization_params = {'all_vectorization_options': args.all_vectorization_options,
+                           'all_cse_options': args.all_cse_options, 'cores': args.cores,
+                           'with_split': args.with_split, 'instruction_set': instruction_set}
+
+    store = open_result_store(args.store)
+    env = None if args.dry_run else get_environment(args.version_label)
+    for domain_size in args.domain_size:
+        for params in benchmark_scenarios(tuple(domain_size), method_params, optimization_params):
+            if args.skip_existing and store.was_already_simulated(params):
+                continue
+            print(_short_description(params), end='', flush=True)
+            if args.dry_run:
+                print()
+                continue
+            result = run_benchmark(time_for_benchmark=args.time, repetitions=args.repetitions, **params)
+            store.save(params, result, env)
+            if result['stable']:
+                print("  {:.1f} MLUPS".format(result['mlups_median']), flush=True)
+            else:
+                print("  got unstable", flush=True)
+    return 0
+
+
+def _compare_command(args):
+    baseline_store = open_result_store(args.baseline)
+    current_store = open_result_store(args.current) if args.current else baseline_store
+
+    def select(store, version):
+        return store.filter_env({'lbmpy_version': version}) if version else list(store.documents())
+
+    regressions = compare_results(select(baseline_store, args.baseline_version),
+                                  select(current_store, args.current_version), args.threshold, args.metric)
+    for r in regressions:
+        description = _short_description(r['params'])
+        print("{:6.1%}  {:8.1f} -> {:8.1f}  {}".format(r['ratio'] - 1, r['baseline'], r['current'], description))
+    print("{} regression(s) beyond {:.0%}".format(len(regressions), args.threshold))
+    return 1 if regressions else 0
+
+
+def _short_description(params):
+    params = {k: v for k, v in params.items() if k != 'relaxation_rates'}
+    return json.dumps(params, sort_keys=True, default=_to_json)
+
+
+def _best_results(documents, metric):
+    """Dict mapping parameter keys to (params, best value of the metric), unstable results are left out."""
+    result = {}
+    for d in documents:
+        value = d['result'].get(metric)
+        if value is None:
+            continue
+        key = _params_key(d['params'])
+        if key not in result or value > result[key][1]:
+            result[key] = (d['params'], value)
+    return result
+
+
+def _params_key(params):
+    return json.dumps(json.loads(json.dumps(params, default=_to_json)), sort_keys=True)
+
+
+def _to_json(obj):
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return str(obj)
+
+
+def _lbmpy_version():
+    try:
+        import pkg_resources
+        return pkg_resources.get_distribution('lbmpy').version
+    except Exception:
+        pass
+    import subprocess
+    lbmpy_dir = os.path.dirname(os.path.abspath(__file__))
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=lbmpy_dir, stderr=subprocess.DEVNULL,
+                                       universal_newlines=True).strip()[:10]
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,31 +1,157 @@
 import numpy as np
 import sympy as sp
 
-from pystencils import Assignment, TypedSymbol, create_indexed_kernel
+from lbmpy.fieldaccess import get_in_place_accessors
+from lbmpy.parallel_compilation import KernelFuture
+from pystencils import Assignment, Field, TypedSymbol, create_indexed_kernel
 from pystencils.backends.cbackend import CustomCodeNode
 from pystencils.boundaries import BoundaryHandling
-from pystencils.boundaries.boundaryhandling import BoundaryOffsetInfo
+from pystencils.boundaries.boundaryhandling import BoundaryDataSetter, BoundaryOffsetInfo
+from pystencils.boundaries.createindexlist import (
+    create_boundary_index_array, numpy_data_type_for_boundary_object)
+from pystencils.data_types import create_type
+from pystencils.kernelparameters import FieldPointerSymbol
+from pystencils.slicing import normalize_slice
 from pystencils.stencil import inverse_direction
 
 
 class LatticeBoltzmannBoundaryHandling(BoundaryHandling):
 
     def __init__(self, lb_method, data_handling, pdf_field_name, name="boundary_handling", flag_interface=None,
-                 target='cpu', openmp=True):
+                 target='cpu', openmp=True, streaming_pattern='pull', links_in_ghost_layers=False):
+        """
+        Args:
+            streaming_pattern: 'pull', or 'aa' / 'esotwist' for a single pdf field updated in-place. For in-place
+                               patterns one kernel per time step parity is generated for each boundary, both working
+                               on the same index list. Pass the parity of the next time step when calling the
+                               boundary handling.
+            links_in_ghost_layers: also handle links of domain cells in the ghost layers, except the outermost one,
+                                   for kernels that update ghost layers. Before the index lists are created, the
+                                   flags are synchronized over periodic borders.
+        """
         self.lb_method = lb_method
+        self._links_in_ghost_layers = links_in_ghost_layers
+        self._in_place_accessors = get_in_place_accessors(streaming_pattern) if streaming_pattern != 'pull' else None
+        self._in_place_kernels = {}
+        self.profiler = None
         super(LatticeBoltzmannBoundaryHandling, self).__init__(data_handling, pdf_field_name, lb_method.stencil,
                                                                name, flag_interface, target, openmp)
 
+    def __call__(self, parity=0, **kwargs):
+        self._select_parity(parity)
+        if self.profiler is None:
+            super(LatticeBoltzmannBoundaryHandling, self).__call__(**kwargs)
+        else:
+            for boundary_obj, kernel, arguments in self._kernel_calls(**kwargs):
+                self._timed(boundary_obj, kernel, arguments)(**arguments)
+
+    def add_fixed_steps(self, fixed_loop, parity=0, **kwargs):
+        self._select_parity(parity)
+        if self.profiler is None:
+            super(LatticeBoltzmannBoundaryHandling, self).add_fixed_steps(fixed_loop, **kwargs)
+        else:
+            for boundary_obj, kernel, arguments in self._kernel_calls(**kwargs):
+                fixed_loop.add_call(self._timed(boundary_obj, getattr(kernel, 'kernel', kernel), arguments), arguments)
+
+    def set_boundary(self, boundary_obj, slice_obj=None, mask_callback=None,
+                     ghost_layers=True, inner_ghost_layers=True, replace=True, force_flag_value=None):
+        """Sets boundary using either a rectangular slice, a boolean mask or a combination of both.
+
+        See :meth:`pystencils.boundaries.BoundaryHandling.set_boundary`. With ``ghost_layers=True`` slices select
+        the same cells as for a data handling with a single ghost layer, also if it has more ghost layers: walls at
+        the domain border, e.g. ``slice_from_direction('N', dim)``, are placed in the ghost layer next to the inner
+        cells. Slices including this ghost layer extend over the outer ghost layers behind it, such that no domain
+        cells are left behind walls in the ghost layers.
+        """
+        dh = self._data_handling
+        if ghost_layers is True and slice_obj is not None and dh.default_ghost_layers > 1:
+            slice_obj = _slice_with_additional_ghost_layers(slice_obj, dh.shape, dh.default_ghost_layers)
+        return super(LatticeBoltzmannBoundaryHandling, self).set_boundary(boundary_obj, slice_obj, mask_callback,
+                                                                          ghost_layers, inner_ghost_layers, replace,
+                                                                          force_flag_value)
+
+    def warmup(self):
+        """Compiles the kernels of all boundaries, which are otherwise compiled when first called.
+
+        Returns:
+            number of kernels compiled by this call
+        """
+        kernels = [info.kernel for info in self._boundary_object_to_boundary_info.values()]
+        kernels += [k for parity_kernels in self._in_place_kernels.values() for k in parity_kernels]
+        pending = {id(k): k for k in kernels if not k.done}
+        for kernel in pending.values():
+            kernel.result()
+        return len(pending)
+
     def force_on_boundary(self, boundary_obj):
         from lbmpy.boundaries import NoSlip
+        if self._in_place_accessors:
+            raise NotImplementedError("Forces on boundaries are not implemented for in-place streaming patterns")
         if isinstance(boundary_obj, NoSlip):
             return self._force_on_no_slip(boundary_obj)
         else:
             self.__call__()
             return self._force_on_boundary(boundary_obj)
 
+    def calls_per_slab(self, axis, slabs, **kwargs):
+        """Boundary kernel calls restricted to slabs of cells, for time steps that are executed slab by slab.
+
+        The index lists are sorted by the coordinate along the axis, so each call works on a contiguous part of them.
+        The boundary values of a link are only read by its domain cell, so the calls of a slab can be made right
+        before its cells are updated.
+
+        Args:
+            axis: spatial axis the slabs are stacked along
+            slabs: sequence of (start, stop) array indices along the axis, including ghost layers
+            kwargs: kernel parameters
+
+        Returns:
+            list with a list of (kernel, arguments) tuples for each slab. The pdf array has to be passed in addition
+            when calling the kernel, under the name of the pdf field.
+        """
+        if self._dirty:
+            self.prepare()
+
+        coordinate = ('x', 'y', 'z')[axis]
+        result = [[] for _ in slabs]
+        for b in self._data_handling.iterate(gpu=self._target in self._data_handling._GPU_LIKE_TARGETS):
+            for b_obj, idx_arr in b[self._index_array_name].boundary_object_to_index_list.items():
+                idx_arr[...] = idx_arr[np.argsort(idx_arr[coordinate], kind='stable')]
+                kernel = self._boundary_object_to_boundary_info[b_obj].kernel
+                arguments = kwargs.copy()
+                arguments.update({p.fields[0].name: b[p.fields[0].name] for p in kernel.parameters
+                                  if isinstance(p.symbol, FieldPointerSymbol)
+                                  and p.fields[0].name not in (self._field_name, 'indexField')})
+                for slab_calls, (start, stop) in zip(result, slabs):
+                    begin, end = np.searchsorted(idx_arr[coordinate], (start, stop))
+                    if end > begin:
+                        slab_calls.append((kernel, dict(arguments, indexField=idx_arr[begin:end])))
+        return result
+
     # ------------------------------ Implementation Details ------------------------------------------------------------
 
+    def _kernel_calls(self, **kwargs):
+        """(boundary object, kernel, arguments) of all boundary kernel calls, like ``add_fixed_steps``."""
+        if self._dirty:
+            self.prepare()
+
+        for b in self._data_handling.iterate(gpu=self._target in self._data_handling._GPU_LIKE_TARGETS):
+            for b_obj, idx_arr in b[self._index_array_name].boundary_object_to_index_list.items():
+                kernel = self._boundary_object_to_boundary_info[b_obj].kernel
+                arguments = kwargs.copy()
+                arguments[self._field_name] = b[self._field_name]
+                arguments['indexField'] = idx_arr
+                arguments.update({p.fields[0].name: b[p.fields[0].name] for p in kernel.parameters
+                                  if isinstance(p.symbol, FieldPointerSymbol) and p.fields[0].name not in arguments})
+                yield b_obj, kernel, arguments
+
+    def _timed(self, boundary_obj, kernel, arguments):
+        """Kernel recording its calls in the profiler, each link reads and writes one pdf and its index entry."""
+        idx_arr = arguments['indexField']
+        pdf_size = self._data_handling.fields[self._field_name].dtype.numpy_dtype.itemsize
+        return self.profiler.timed("boundary " + boundary_obj.name, kernel, 'boundary',
+                                   bytes_per_call=len(idx_arr) * (2 * pdf_size + idx_arr.itemsize))
+
     def _force_on_no_slip(self, boundary_obj):
         dh = self._data_handling
         ff_ghost_layers = dh.ghost_layers_of_field(self.flag_interface.flag_field_name)
@@ -72,9 +198,59 @@ class LatticeBoltzmannBoundaryHandling(BoundaryHandling):
 
         return dh.reduce_float_sequence(list(result), 'sum')
 
-    def _create_boundary_kernel(self, symbolic_field, symbolic_index_field, boundary_obj):
+    def _create_index_fields(self):
+        if not self._links_in_ghost_layers:
+            return super(LatticeBoltzmannBoundaryHandling, self)._create_index_fields()
+
+        dh = self._data_handling
+        flag_field_name = self.flag_interface.flag_field_name
+        dh.synchronization_function([flag_field_name], target='cpu')()
+        ff_ghost_layers = dh.ghost_layers_of_field(flag_field_name)
+        for b in dh.iterate(ghost_layers=ff_ghost_layers):
+            flag_arr = b[flag_field_name]
+            pdf_arr = b[self._field_name]
+            index_array_bd = b[self._index_array_name]
+            index_array_bd.clear()
+            for b_info in self._boundary_object_to_boundary_info.values():
+                boundary_obj = b_info.boundary_object
+                # only the outermost layer is skipped, its neighbors are outside of the arrays
+                idx_arr = create_boundary_index_array(flag_arr, self.stencil, b_info.flag,
+                                                      self.flag_interface.domain_flag, boundary_obj, 1,
+                                                      boundary_obj.inner_or_boundary, boundary_obj.single_link)
+                if idx_arr.size == 0:
+                    continue
+
+                boundary_data_setter = BoundaryDataSetter(idx_arr, b.offset, self.stencil, ff_ghost_layers, pdf_arr)
+                index_array_bd.boundary_object_to_index_list[boundary_obj] = idx_arr
+                index_array_bd.boundary_object_to_data_setter[boundary_obj] = boundary_data_setter
+                self._boundary_data_initialization(boundary_obj, boundary_data_setter)
+
+    def _add_boundary(self, boundary_obj, flag=None):
+        # like the base class, but the kernels are compiled when they are first called
+        if boundary_obj not in self._boundary_object_to_boundary_info:
+            sym_index_field = Field.create_generic('indexField', spatial_dimensions=1,
+                                                   dtype=numpy_data_type_for_boundary_object(boundary_obj, self.dim))
+            kernels = tuple(_compiled_on_first_use(self._create_boundary_kernel(
+                self._data_handling.fields[self._field_name], sym_index_field, boundary_obj, parity=parity))
+                for parity in ((0, 1) if self._in_place_accessors else (0,)))
+            if flag is None:
+                flag = self.flag_interface.reserve_next_flag()
+            self._boundary_object_to_boundary_info[boundary_obj] = self.BoundaryInfo(boundary_obj, flag=flag,
+                                                                                     kernel=kernels[0])
+            if self._in_place_accessors:
+                self._in_place_kernels[boundary_obj] = kernels
+        return self._boundary_object_to_boundary_info[boundary_obj].flag
+
+    def _select_parity(self, parity):
+        """Sets the kernels of the given time step parity in the boundary infos, the index lists stay the same."""
+        for boundary_obj, kernels in self._in_place_kernels.items():
+            self._boundary_object_to_boundary_info[boundary_obj].kernel = kernels[parity]
+
+    def _create_boundary_kernel(self, symbolic_field, symbolic_index_field, boundary_obj, parity=0):
+        accessor = self._in_place_accessors[parity] if self._in_place_accessors else None
         return create_lattice_boltzmann_boundary_kernel(symbolic_field, symbolic_index_field, self.lb_method,
-                                                        boundary_obj, target=self._target, openmp=self._openmp)
+                                                        boundary_obj, target=self._target, openmp=self._openmp,
+                                                        in_place_accessor=accessor)
 
 
 class LbmWeightInfo(CustomCodeNode):
@@ -96,12 +272,125 @@ class LbmWeightInfo(CustomCodeNode):
         super(LbmWeightInfo, self).__init__(code, symbols_read=set(), symbols_defined={w_sym})
 
 
+class InPlaceStorageInfo(CustomCodeNode):
+    """Lookup tables for the storage position of pdfs in in-place streaming patterns.
+
+    Boundaries are formulated for the pull pattern, where the post-collision pdf of a cell moving in direction d is
+    stored at index d of the cell itself. Before an in-place time step this pdf is found where the accessor of the
+    time step reads it, i.e. in the neighbor cell in direction d at the read position for direction d.
+    """
+
+    # --------------------------- Functions to be used by boundaries --------------------------
+
+    @staticmethod
+    def offset_of_direction(dir_idx, dim):
+        return tuple([sp.IndexedBase(symbol, shape=(1,))[dir_idx]
+                      for symbol in InPlaceStorageInfo._offset_symbols(dim)])
+
+    @staticmethod
+    def index_of_direction(dir_idx):
+        return sp.IndexedBase(InPlaceStorageInfo.INDEX_SYMBOL, shape=(1,))[dir_idx]
+
+    # ---------------------------------- Internal ---------------------------------------------
+
+    def __init__(self, accessor, stencil):
+        dim = len(stencil[0])
+        positions = in_place_storage_positions(accessor, stencil)
+        offset_sym = InPlaceStorageInfo._offset_symbols(dim)
+        code = "\n"
+        for i in range(dim):
+            offset_str = ", ".join([str(offsets[i]) for offsets, _ in positions])
+            code += "const int64_t %s [] = { %s };\n" % (offset_sym[i].name, offset_str)
+        index_str = ", ".join([str(index) for _, index in positions])
+        code += "const int %s [] = { %s };\n" % (self.INDEX_SYMBOL.name, index_str)
+        super(InPlaceStorageInfo, self).__init__(code, symbols_read=set(),
+                                                 symbols_defined=set(offset_sym + [self.INDEX_SYMBOL]))
+
+    @staticmethod
+    def _offset_symbols(dim):
+        return [TypedSymbol(f"in_place_c{d}", create_type(np.int64)) for d in ['x', 'y', 'z'][:dim]]
+
+    INDEX_SYMBOL = TypedSymbol("in_place_index", "int")
+
+
+def in_place_storage_positions(accessor, stencil):
+    """Offset and index where the pull pattern pdf of each direction of a cell is stored before a time step with
+    the given in-place accessor.
+
+    >>> from lbmpy.fieldaccess import AAOddTimeStepAccessor
+    >>> in_place_storage_positions(AAOddTimeStepAccessor(), ((0, 0), (0, 1), (0, -1)))
+    [((0, 0), 0), ((0, 0), 2), ((0, 0), 1)]
+    """
+    pdf_field = Field.create_generic('pdfs', spatial_dimensions=len(stencil[0]), index_dimensions=1)
+    return [(tuple(int(d_i + o_i) for d_i, o_i in zip(direction, read_access.offsets)), int(read_access.index[0]))
+            for direction, read_access in zip(stencil, accessor.read(pdf_field, stencil))]
+
+
+def in_place_boundary_assignments(assignments, pdf_field, accessor, stencil):
+    """Moves all accesses to pdf_field in the pull pattern boundary assignments to the storage positions before a
+    time step with the given in-place accessor, see :class:`InPlaceStorageInfo`."""
+    positions = in_place_storage_positions(accessor, stencil)
+    dim = len(stencil[0])
+
+    def storage_position(access):
+        direction = access.index[0]
+        if isinstance(direction, (int, sp.Integer)):
+            offsets, index = positions[int(direction)]
+        else:
+            offsets = InPlaceStorageInfo.offset_of_direction(direction, dim)
+            index = InPlaceStorageInfo.index_of_direction(direction)
+        return pdf_field[tuple(o + s for o, s in zip(access.offsets, offsets))](index)
+
+    substitutions = {}
+    for assignment in assignments:
+        for access in assignment.atoms(Field.Access):
+            if access.field == pdf_field:
+                substitutions[access] = storage_position(access)
+    return [Assignment(a.lhs.xreplace(substitutions), a.rhs.xreplace(substitutions)) for a in assignments]
+
+
 def create_lattice_boltzmann_boundary_kernel(pdf_field, index_field, lb_method, boundary_functor,
-                                             target='cpu', openmp=True):
+                                             target='cpu', openmp=True, in_place_accessor=None):
+    """Creates the kernel of a boundary, running over its index list.
+
+    Args:
+        in_place_accessor: for in-place streaming patterns, the accessor of the time step following the boundary
+                           kernel, otherwise None. The boundary assignments are generated for the pull pattern and
+                           then moved to the storage positions of this accessor.
+    """
     elements = [BoundaryOffsetInfo(lb_method.stencil), LbmWeightInfo(lb_method)]
     index_arr_dtype = index_field.dtype.numpy_dtype
     dir_symbol = TypedSymbol("dir", index_arr_dtype.fields['dir'][0])
     elements += [Assignment(dir_symbol, index_field[0]('dir'))]
-    elements += boundary_functor(pdf_field=pdf_field, direction_symbol=dir_symbol,
-                                 lb_method=lb_method, index_field=index_field)
+    boundary_assignments = boundary_functor(pdf_field=pdf_field, direction_symbol=dir_symbol,
+                                            lb_method=lb_method, index_field=index_field)
+    if in_place_accessor is not None:
+        elements.insert(2, InPlaceStorageInfo(in_place_accessor, lb_method.stencil))
+        boundary_assignments = in_place_boundary_assignments(boundary_assignments, pdf_field, in_place_accessor,
+                                                             lb_method.stencil)
+    elements += boundary_assignments
     return create_indexed_kernel(elements, [index_field], target=target, cpu_openmp=openmp)
+
+
+def _compiled_on_first_use(ast):
+    return KernelFuture(None, lambda _: ast.compile())
+
+
+def _slice_with_additional_ghost_layers(slice_obj, domain_size, ghost_layers):
+    """Converts a slice of a domain with a single ghost layer to a slice of the same cells with more ghost layers,
+    cells in the ghost layer are extended over the additional ghost layers."""
+    sizes = [s + 2 for s in domain_size]
+    shift = ghost_layers - 1
+    result = []
+    for s, size in zip(normalize_slice(slice_obj, sizes), sizes):
+        if isinstance(s, slice):
+            start = 0 if s.start == 0 else s.start + shift
+            stop = size + 2 * shift if s.stop == size else s.stop + shift
+            result.append(slice(start, stop, s.step))
+        elif s == 0:
+            result.append(slice(0, 1 + shift))
+        elif s == size - 1:
+            result.append(slice(s + shift, size + 2 * shift))
+        else:
+            result.append(s + shift)
+    return tuple(result)
@@ -132,6 +132,11 @@ Other:
   specifying the number of threads. If True is specified OpenMP chooses the number of threads
 - ``double_precision=True``:  by default simulations run with double precision floating point numbers, by setting this
   parameter to False, single precision is used, which is much faster, especially on GPUs
+- ``iteration_slice=None``: update only a rectangular part of the domain, given as tuple of slices into the pdf array
+  including ghost layers, e.g. ``make_slice[2:-2, 2:-2]``. By default all cells except the ghost layer are updated.
+- ``kernel_cache=False``: only applicable for cpu simulations. ``True`` to store compiled kernels in a persistent disk
+  cache and load them from there when the same kernel is requested again, e.g. by another process. Alternatively an
+  instance of :class:`lbmpy.kernel_cache.KernelCache` can be passed. See :mod:`lbmpy.kernel_cache` for details.
 
 
 
@@ -181,6 +186,7 @@ from lbmpy.fieldaccess import (
     EsoTwistEvenTimeStepAccessor, EsoTwistOddTimeStepAccessor, PdfFieldAccessor,
     PeriodicTwoFieldsAccessor, StreamPullTwoFieldsAccessor, StreamPushTwoFieldsAccessor)
 from lbmpy.fluctuatinglb import add_fluctuations_to_collision_rule
+from lbmpy.kernel_cache import get_default_kernel_cache, parameter_hash
 from lbmpy.methods import (create_mrt_orthogonal, create_mrt_raw, create_srt, create_trt, create_trt_kbc)
 from lbmpy.methods.creationfunctions import create_generic_mrt
 from lbmpy.methods.cumulantbased import CumulantBasedLbMethod
@@ -203,6 +209,14 @@ from pystencils.stencil import have_same_entries
 def create_lb_function(ast=None, optimization={}, **kwargs):
     """Creates a Python function for the LB method"""
     params, opt_params = update_with_default_parameters(kwargs, optimization)
+    kernel_cache = opt_params.pop('kernel_cache')
+
+    if ast is None and kernel_cache and opt_params['target'] == 'cpu':
+        key = parameter_hash(params, opt_params)
+        if key is not None:
+            if kernel_cache is True:
+                kernel_cache = get_default_kernel_cache()
+            return kernel_cache.get_or_create(key, lambda: create_lb_ast(**params, optimization=opt_params))
 
     if ast is None:
         params['optimization'] = opt_params
@@ -228,7 +242,8 @@ def create_lb_ast(update_rule=None, optimization={}, **kwargs):
     res = create_kernel(update_rule, target=opt_params['target'], data_type=collate_types(field_types),
                         cpu_openmp=opt_params['openmp'], cpu_vectorize_info=opt_params['vectorization'],
                         gpu_indexing=opt_params['gpu_indexing'], gpu_indexing_params=opt_params['gpu_indexing_params'],
-                        ghost_layers=1)
+                        iteration_slice=opt_params['iteration_slice'],
+                        ghost_layers=1 if opt_params['iteration_slice'] is None else None)
 
     res.method = update_rule.method
     res.update_rule = update_rule
@@ -572,6 +587,9 @@ def update_with_default_parameters(params, opt_params=None, fail_on_unknown_para
         'vectorization': None,
 
         'builtin_periodicity': (False, False, False),
+        'iteration_slice': None,
+
+        'kernel_cache': False,
     }
     if 'relaxation_rate' in params:
         if 'relaxation_rates' not in params:
@@ -11,7 +11,7 @@ __all__ = ['PdfFieldAccessor', 'CollideOnlyInplaceAccessor', 'StreamPullTwoField
            'AAEvenTimeStepAccessor', 'AAOddTimeStepAccessor',
            'PeriodicTwoFieldsAccessor', 'StreamPushTwoFieldsAccessor',
            'EsoTwistEvenTimeStepAccessor', 'EsoTwistOddTimeStepAccessor',
-           'visualize_pdf_field_accessor', 'visualize_field_mapping']
+           'get_in_place_accessors', 'visualize_pdf_field_accessor', 'visualize_field_mapping']
 
 
 class PdfFieldAccessor:
@@ -199,6 +199,23 @@ class EsoTwistEvenTimeStepAccessor(PdfFieldAccessor):
         return result
 
 
+def get_in_place_accessors(streaming_pattern):
+    """Returns the accessors of the even and odd time steps of the in-place streaming pattern 'aa' or 'esotwist'.
+
+    Even and odd time steps alternate on a single pdf field, starting with the even step. The pdfs an accessor reads
+    are the ones the accessor of the other parity has written.
+    """
+    in_place_accessors = {
+        'aa': (AAEvenTimeStepAccessor(), AAOddTimeStepAccessor()),
+        'esotwist': (EsoTwistEvenTimeStepAccessor(), EsoTwistOddTimeStepAccessor()),
+    }
+    try:
+        return in_place_accessors[streaming_pattern]
+    except KeyError:
+        raise ValueError("Unknown in-place streaming pattern '{}', use one of {}".format(
+            streaming_pattern, tuple(in_place_accessors.keys())))
+
+
 # -------------------------------------------- Visualization -----------------------------------------------------------
 
 
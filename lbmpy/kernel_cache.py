@@ -0,0 +1,351 @@
+"""
+Persistent kernel cache
+=======================
+
+Creating a LB kernel consists of two expensive steps: the symbolic derivation of the update rule with sympy and the
+compilation of the generated C code. This module provides a content-addressed cache that stores the compiled
+shared object together with the pickled AST, method and update rule of a kernel. The cache key is a hash of the full,
+normalized method and optimization parameter set, so a second process asking for the same kernel loads it from disk
+instead of running through the creation pipeline again.
+
+The cache is activated with the ``kernel_cache`` optimization parameter of
+:func:`lbmpy.creationfunctions.create_lb_function`: pass ``True`` to use the default cache, or a :class:`KernelCache`
+instance.
+
+>>> import tempfile
+>>> from lbmpy.creationfunctions import create_lb_function
+>>> with tempfile.TemporaryDirectory() as tmp_dir:
+...     cache = KernelCache(tmp_dir, max_size='100 MB')
+...     first = create_lb_function(stencil='D2Q9', relaxation_rate=1.8, optimization={'kernel_cache': cache})
+...     second = create_lb_function(stencil='D2Q9', relaxation_rate=1.8, optimization={'kernel_cache': cache})
+...     cache.statistics['hits'], cache.statistics['misses']
+(1, 1)
+
+The default cache is located in the user cache directory, or in the directory given by the environment variable
+``LBMPY_KERNEL_CACHE_DIR``. Its size limit can be set with ``LBMPY_KERNEL_CACHE_SIZE`` (e.g. '2 GB').
+Least recently used entries are evicted when the limit is exceeded. Entries are written to a temporary directory and
+moved into place atomically, and creation of an entry is guarded by a file lock, such that several processes starting
+at the same time compile each kernel only once.
+
+Only kernels for the 'cpu' target that are fully described by parameters are cached. If a ``lb_method``,
+``collision_rule`` or ``update_rule`` object is passed, or some parameter can not be brought into a canonical form,
+the kernel is created as usual without touching the cache.
+"""
+import hashlib
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import types
+from contextlib import contextmanager
+
+import numpy as np
+import sympy as sp
+
+from lbmpy.max_domain_size_info import convert_memory_size
+from pystencils.cache import memorycache
+from pystencils.field import Field
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+__all__ = ['KernelCache', 'get_default_kernel_cache', 'parameter_hash']
+
+CACHE_FORMAT_VERSION = 1
+
+_META_FILE = 'meta.pickle'
+
+# parameters that do not influence the generated kernel
+_IGNORED_PARAMETERS = ('kernel_cache', 'ast')
+
+# parameters that are objects from previous pipeline stages - these can not be hashed reliably
+_PIPELINE_OBJECT_PARAMETERS = ('lb_method', 'collision_rule', 'update_rule')
+
+
+class UncacheableParameter(Exception):
+    pass
+
+
+class KernelCache:
+    """Disk cache for compiled LB kernels with LRU eviction.
+
+    Args:
+        cache_dir: directory where entries are stored, created if it does not exist
+        max_size: size limit of the cache, either in bytes or as string like '500 MB'. When a new entry pushes the
+                  cache above this limit, least recently used entries are removed.
+    """
+
+    def __init__(self, cache_dir, max_size='1 GB'):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_size = int(convert_memory_size(max_size))
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @property
+    def statistics(self):
+        """Dictionary with hit, miss and eviction counts of this process and current number and size of entries."""
+        entries = self._entries()
+        return {'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'entries': len(entries),
+                'size': sum(size for _, _, size in entries)}
+
+    def get_or_create(self, key, create_ast):
+        """Returns compiled kernel for the given key, calling create_ast only if the key is not in the cache.
+
+        Args:
+            key: cache key as returned by :func:`parameter_hash`
+            create_ast: callable without arguments, returning a 'cpu' kernel AST with attached method and update rule
+
+        Returns:
+            compiled kernel with attributes method, update_rule and ast, as returned by ``create_lb_function``
+        """
+        result = self._load(key)
+        if result is not None:
+            self._hits += 1
+            return result
+
+        with self._lock(key):
+            # another process might have created the entry while we were waiting for the lock
+            result = self._load(key)
+            if result is not None:
+                self._hits += 1
+                return result
+            self._misses += 1
+            ast = create_ast()
+            self._store(key, ast)
+
+        self._evict()
+        result = self._load(key)
+        assert result is not None
+        return result
+
+    def clear(self):
+        """Removes all entries from the cache."""
+        for entry_dir, _, _ in self._entries():
+            self._remove_entry(entry_dir)
+
+    def __contains__(self, key):
+        return os.path.exists(os.path.join(self.cache_dir, key, _META_FILE))
+
+    def __repr__(self):
+        return "KernelCache({!r}, max_size={})".format(self.cache_dir, self.max_size)
+
+    # ------------------------------ Implementation Details ------------------------------------------------------------
+
+    def _load(self, key):
+        from pystencils.cpu.cpujit import load_kernel_from_file
+        from pystencils.kernel_wrapper import KernelWrapper
+
+        entry_dir = os.path.join(self.cache_dir, key)
+        meta_file = os.path.join(entry_dir, _META_FILE)
+        try:
+            with open(meta_file, 'rb') as f:
+                meta = pickle.load(f)
+            kernel = load_kernel_from_file(meta['module_name'], meta['ast'].function_name,
+                                           os.path.join(entry_dir, meta['library']))
+            os.utime(meta_file)  # mark as recently used
+        except (OSError, EOFError, ImportError, pickle.UnpicklingError):
+            return None
+
+        ast = meta['ast']
+        ast.method = meta['method']
+        ast.update_rule = meta['update_rule']
+        result = KernelWrapper(kernel, ast.get_parameters(), ast)
+        result.method = ast.method
+        result.update_rule = ast.update_rule
+        return result
+
+    def _store(self, key, ast):
+        from pystencils.cpu.cpujit import ExtensionModuleCode, compile_module, get_compiler_config
+
+        compiler_config = get_compiler_config()
+        function_prefix = '__declspec(dllexport)' if compiler_config['os'].lower() == 'windows' else ''
+        code = ExtensionModuleCode()
+        code.add_function(ast, ast.function_name)
+        code.create_code_string(compiler_config['restrict_qualifier'], function_prefix)
+        module_name = code.get_hash_of_code()
+
+        compile_flags = []
+        if ast.instruction_set and 'compile_flags' in ast.instruction_set:
+            compile_flags = ast.instruction_set['compile_flags']
+
+        tmp_dir = tempfile.mkdtemp(prefix='.tmp_', dir=self.cache_dir)
+        try:
+            lib_file = compile_module(code, module_name, tmp_dir, compile_flags=compile_flags)
+            for file_name in os.listdir(tmp_dir):
+                if file_name.endswith(('.o', '.obj')):
+                    os.remove(os.path.join(tmp_dir, file_name))
+            meta = {'format_version': CACHE_FORMAT_VERSION,
+                    'module_name': module_name,
+                    'library': os.path.basename(lib_file),
+                    'ast': ast,
+                    'method': ast.method,
+                    'update_rule': ast.update_rule}
+            with open(os.path.join(tmp_dir, _META_FILE), 'wb') as f:
+                pickle.dump(meta, f)
+            os.rename(tmp_dir, os.path.join(self.cache_dir, key))
+        except OSError:
+            # target exists - entry was created concurrently by a process without lock support
+            pass
+        finally:
+            if os.path.exists(tmp_dir):
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _entries(self):
+        """List of (entry directory, last access time, size in bytes) tuples"""
+        result = []
+        for name in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, name)
+            meta_file = os.path.join(entry_dir, _META_FILE)
+            if name.startswith('.') or not os.path.isdir(entry_dir):
+                continue
+            try:
+                last_access = os.path.getmtime(meta_file)
+                size = sum(os.path.getsize(os.path.join(entry_dir, f)) for f in os.listdir(entry_dir))
+            except OSError:
+                continue
+            result.append((entry_dir, last_access, size))
+        return result
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda e: e[1])
+        total_size = sum(size for _, _, size in entries)
+        # the most recently used entry is never evicted, even if it alone exceeds the limit
+        for entry_dir, _, size in entries[:-1]:
+            if total_size <= self.max_size:
+                break
+            self._remove_entry(entry_dir)
+            total_size -= size
+            self._evictions += 1
+
+    def _remove_entry(self, entry_dir):
+        # rename first, such that other processes never see a partially removed entry
+        tmp_dir = tempfile.mkdtemp(prefix='.del_', dir=self.cache_dir)
+        try:
+            os.rename(entry_dir, os.path.join(tmp_dir, 'entry'))
+        except OSError:
+            pass
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    @contextmanager
+    def _lock(self, key):
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.cache_dir, '.' + key + '.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+_default_kernel_cache = None
+
+
+def get_default_kernel_cache():
+    """Returns the process-wide default kernel cache, configured by LBMPY_KERNEL_CACHE_DIR/_SIZE env variables"""
+    global _default_kernel_cache
+    if _default_kernel_cache is None:
+        if 'LBMPY_KERNEL_CACHE_DIR' in os.environ:
+            cache_dir = os.environ['LBMPY_KERNEL_CACHE_DIR']
+        else:
+            from appdirs import user_cache_dir
+            cache_dir = os.path.join(user_cache_dir('lbmpy'), 'kernels')
+        max_size = os.environ.get('LBMPY_KERNEL_CACHE_SIZE', '1 GB')
+        _default_kernel_cache = KernelCache(cache_dir, max_size)
+    return _default_kernel_cache
+
+
+def parameter_hash(params, opt_params, environment=True):
+    """Hash of normalized method and optimization parameters, or None if the parameters can not be hashed reliably.
+
+    Both dictionaries are expected to be normalized by
+    :func:`lbmpy.creationfunctions.update_with_default_parameters`. If ``environment`` is True, the hash additionally
+    covers the lbmpy sources, the pystencils version and the compiler configuration, since all of them influence the
+    compiled kernel.
+    """
+    if any(params.get(name, None) is not None for name in _PIPELINE_OBJECT_PARAMETERS):
+        return None
+
+    try:
+        description = _canonical({'params': {k: v for k, v in params.items() if k not in _IGNORED_PARAMETERS},
+                                  'optimization': {k: v for k, v in opt_params.items()
+                                                   if k not in _IGNORED_PARAMETERS}})
+    except UncacheableParameter:
+        return None
+
+    hash_obj = hashlib.sha256()
+    hash_obj.update(description.encode())
+    if environment:
+        hash_obj.update(_environment_description().encode())
+    return hash_obj.hexdigest()
+
+
+# -------------------------------------------- Helper Functions --------------------------------------------------------
+
+
+def _canonical(obj, depth=0):
+    """String representation that is identical for equal parameters across processes."""
+    if depth > 16:
+        raise UncacheableParameter()
+
+    if obj is None or isinstance(obj, (bool, int, float, complex, str, bytes, np.number, np.bool_)):
+        return repr(obj)
+    elif isinstance(obj, Field):
+        return "Field{!r}".format(obj.hashable_contents())
+    elif isinstance(obj, sp.MatrixBase):
+        return "Matrix({}, {}, {})".format(obj.rows, obj.cols, _canonical(list(obj), depth + 1))
+    elif isinstance(obj, sp.Basic):
+        # srepr contains only the names of field accesses, not the fields themselves
+        accesses = sorted("{}: Field{!r}".format(a.name, a.field.hashable_contents()) for a in obj.atoms(Field.Access))
+        return "{}({}, [{}])".format(type(obj).__name__, sp.srepr(obj), ", ".join(accesses))
+    elif isinstance(obj, np.ndarray):
+        return "ndarray({}, {}, {})".format(obj.shape, obj.dtype, hashlib.sha256(obj.tobytes()).hexdigest())
+    elif isinstance(obj, np.dtype):
+        return "dtype({})".format(obj.descr)
+    elif isinstance(obj, (list, tuple)):
+        return "{}[{}]".format(type(obj).__name__, ", ".join(_canonical(e, depth + 1) for e in obj))
+    elif isinstance(obj, slice):
+        return "slice({})".format(", ".join(_canonical(e, depth + 1) for e in (obj.start, obj.stop, obj.step)))
+    elif isinstance(obj, (set, frozenset)):
+        return "set[{}]".format(", ".join(sorted(_canonical(e, depth + 1) for e in obj)))
+    elif isinstance(obj, dict) or hasattr(obj, 'items'):
+        items = sorted((_canonical(k, depth + 1), _canonical(v, depth + 1)) for k, v in obj.items())
+        return "dict{{{}}}".format(", ".join("{}: {}".format(k, v) for k, v in items))
+    elif isinstance(obj, (type, types.FunctionType, types.BuiltinFunctionType)):
+        if '<locals>' in obj.__qualname__ or '<lambda>' in obj.__qualname__:
+            raise UncacheableParameter()
+        return "{}.{}".format(obj.__module__, obj.__qualname__)
+    elif hasattr(obj, '__dict__'):
+        # e.g. force models, accessors or simplification strategies
+        return "{}.{}{}".format(type(obj).__module__, type(obj).__qualname__, _canonical(vars(obj), depth + 1))
+    raise UncacheableParameter()
+
+
+@memorycache(maxsize=1)
+def _environment_description():
+    import pystencils
+    from pystencils.cpu.cpujit import get_compiler_config
+
+    return "{}|{}|{}|{}|{}".format(CACHE_FORMAT_VERSION, sys.version, pystencils.__version__,
+                                   sorted(get_compiler_config().items()), _lbmpy_source_hash())
+
+
+@memorycache(maxsize=1)
+def _lbmpy_source_hash():
+    lbmpy_dir = os.path.dirname(os.path.abspath(__file__))
+    source_hash = hashlib.sha256()
+    for root, _, files in sorted(os.walk(lbmpy_dir)):
+        for file_name in sorted(files):
+            if file_name.endswith(('.py', '.pyx')):
+                with open(os.path.join(root, file_name), 'rb') as f:
+                    source_hash.update(f.read())
+    return source_hash.hexdigest()
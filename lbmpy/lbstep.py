@@ -1,19 +1,29 @@
+import time
+from itertools import product
 from types import MappingProxyType
 
 import numpy as np
 
 from lbmpy.boundaries.boundaryhandling import LatticeBoltzmannBoundaryHandling
 from lbmpy.creationfunctions import (
-    create_lb_function, switch_to_symbolic_relaxation_rates_for_omega_adapting_methods,
+    create_lb_collision_rule, create_lb_function, switch_to_symbolic_relaxation_rates_for_omega_adapting_methods,
     update_with_default_parameters)
+from lbmpy.fieldaccess import get_in_place_accessors
 from lbmpy.macroscopic_value_kernels import (
     create_advanced_velocity_setter_collision_rule, pdf_initialization_assignments)
+from lbmpy.parallel_compilation import KernelCreationPool, KernelFuture
+from lbmpy.performance_model import KernelPerformanceModel
+from lbmpy.profiling import Profiler
 from lbmpy.simplificationfactory import create_simplification_strategy
 from lbmpy.stencils import get_stencil
-from pystencils import create_data_handling, create_kernel, make_slice
-from pystencils.slicing import SlicedGetter
+from pystencils import Field, create_data_handling, create_kernel, make_slice
+from pystencils.datahandling import SerialDataHandling
+from pystencils.slicing import SlicedGetter, get_periodic_boundary_src_dst_slices, normalize_slice
 from pystencils.timeloop import TimeLoop
 
+# temporal blocking chooses slabs such that the pdfs of all slabs of a wave fit into a cache of this size
+WAVEFRONT_CACHE_SIZE = 2 ** 20
+
 
 class LatticeBoltzmannStep:
 
@@ -23,7 +33,54 @@ class LatticeBoltzmannStep:
                  compute_velocity_in_every_step=False, compute_density_in_every_step=False,
                  velocity_input_array_name=None, time_step_order='stream_collide', flag_interface=None,
                  alignment_if_vectorized=64, fixed_loop_sizes=True, fixed_relaxation_rates=True,
-                 timeloop_creation_function=TimeLoop, **method_parameters):
+                 timeloop_creation_function=TimeLoop, streaming_pattern='pull', overlap_communication=False,
+                 ghost_layers=1, temporal_blocking=None, compile_processes=1, lazy_macroscopic_values=False,
+                 **method_parameters):
+        """
+        Args:
+            streaming_pattern: 'pull' for a stream-pull kernel with two pdf arrays, or 'aa' / 'esotwist' for
+                               in-place streaming on a single pdf array, alternating between an even and an odd
+                               time step kernel. In-place streaming halves the pdf memory and saves the write
+                               allocate traffic of the second array, but is only available on the CPU for serial
+                               data handlings.
+            overlap_communication: split the stream-collide kernel into one kernel for the interior cells, which do
+                                   not read ghost layers, and kernels for the frame of cells next to the ghost
+                                   layers. The interior is updated while the ghost layer exchange is running, the
+                                   frame after it is finished. Ghost layers are exchanged asynchronously only by the
+                                   parallel (waLBerla) data handling, for serial data handlings the results are the
+                                   same as without overlap.
+            ghost_layers: number of ghost layers k of the created data handling, if a data handling is passed its
+                          default number of ghost layers is used. With k > 1 ghost layers are exchanged only every
+                          k time steps: after the exchange the kernel updates all but the outermost ghost layer,
+                          each following time step one layer less, until only the inner cells are updated. This
+                          trades additional computation for fewer, larger messages. Boundaries are placed like
+                          with a single ghost layer, see
+                          :meth:`lbmpy.boundaries.boundaryhandling.LatticeBoltzmannBoundaryHandling.set_boundary`.
+                          Kernels reading a velocity input array and collide-stream kernels can not update ghost
+                          layers, because the macroscopic values they read are known in the inner cells only. They
+                          update the inner cells, and the ghost layers are exchanged every time step. The additional
+                          ghost layers are then only used by other fields of the data handling, e.g. by finite
+                          difference kernels with a wider stencil.
+            temporal_blocking: number of time steps T, or tuple (T, slab size), to run as a wavefront: the domain
+                               is cut into slabs along the non-periodic direction with the largest memory stride,
+                               and while time step t updates a slab, time step t + 1 updates the slab before it.
+                               The pdfs of a slab are updated T times while they are in cache, instead of once per
+                               sweep over the whole domain. Without a slab size, slabs are as thick as fit T times
+                               into a typical L2 cache. Only for serial CPU data handlings and kernels that do not
+                               write macroscopic values.
+            compile_processes: number of worker processes creating the lattice Boltzmann kernels and the macroscopic
+                               value getter and setter in parallel, or a
+                               :class:`lbmpy.parallel_compilation.KernelCreationPool` shared with other steps.
+            lazy_macroscopic_values: do not compute density and velocity of all cells after a run, but only the ones
+                                     requested by :meth:`velocity_slice` and :meth:`density_slice`, when they are
+                                     requested. The density and velocity arrays of the data handling are outdated
+                                     after a run, until :meth:`update_macroscopic_values` is called. Values written
+                                     into them by the kernel in every step are up to date.
+
+        Kernels are compiled when they are first used, e.g. in the first time step, or all at once by :meth:`warmup`.
+        Constructing a step only derives the method and sets the pdfs to the equilibrium at rest, so inspecting the
+        method of a step does not need a compiler.
+        """
 
         self._timeloop_creation_function = timeloop_creation_function
 
@@ -33,14 +90,38 @@ class LatticeBoltzmannStep:
                 raise ValueError("When passing a data_handling, the domain_size parameter can not be specified")
 
         target = optimization.get('target', 'cpu')
+        in_place = streaming_pattern != 'pull'
+        if in_place:
+            if time_step_order != 'stream_collide' or lbm_kernel is not None:
+                raise ValueError("In-place streaming patterns can not be combined with time_step_order "
+                                 "'{}' or a given lbm_kernel".format(time_step_order))
+            if compute_velocity_in_every_step or compute_density_in_every_step:
+                raise ValueError("In-place streaming patterns do not compute macroscopic values in every step")
+            if target != 'cpu' or (data_handling is not None and not isinstance(data_handling, SerialDataHandling)):
+                raise NotImplementedError("In-place streaming is only implemented for serial CPU data handlings")
+        if overlap_communication and (in_place or time_step_order != 'stream_collide' or lbm_kernel is not None):
+            raise ValueError("Overlapping communication is only possible for generated stream-pull-collide kernels")
         if data_handling is None:
             if domain_size is None:
                 raise ValueError("Specify either domain_size or data_handling")
             data_handling = create_data_handling(domain_size,
-                                                 default_ghost_layers=1,
+                                                 default_ghost_layers=ghost_layers,
                                                  periodicity=periodicity,
                                                  default_target=target,
                                                  parallel=False)
+        ghost_layers = data_handling.default_ghost_layers
+        if ghost_layers > 1 and (in_place or overlap_communication or lbm_kernel is not None):
+            raise ValueError("Multiple ghost layers are only supported for generated kernels "
+                             "without in-place streaming or overlapping communication")
+        updates_ghost_layers = (ghost_layers > 1 and time_step_order == 'stream_collide'
+                                and velocity_input_array_name is None)
+        if temporal_blocking is not None:
+            if (in_place or overlap_communication or ghost_layers > 1 or time_step_order != 'stream_collide'
+                    or lbm_kernel is not None or target != 'cpu' or not isinstance(data_handling, SerialDataHandling)):
+                raise ValueError("Temporal blocking is only supported for generated stream-pull-collide kernels with "
+                                 "a single ghost layer on serial CPU data handlings")
+            if compute_velocity_in_every_step or compute_density_in_every_step or velocity_input_array_name:
+                raise ValueError("Temporal blocking is not possible for kernels reading or writing macroscopic values")
 
         if 'stencil' not in method_parameters:
             method_parameters['stencil'] = 'D2Q9' if data_handling.dim == 2 else 'D3Q27'
@@ -73,8 +154,9 @@ class LatticeBoltzmannStep:
 
         self._data_handling.add_array(self._pdf_arr_name, values_per_cell=q, gpu=self._gpu, layout=layout,
                                       latex_name='src', dtype=field_dtype, alignment=alignment)
-        self._data_handling.add_array(self._tmp_arr_name, values_per_cell=q, gpu=self._gpu, cpu=not self._gpu,
-                                      layout=layout, latex_name='dst', dtype=field_dtype, alignment=alignment)
+        if not in_place:
+            self._data_handling.add_array(self._tmp_arr_name, values_per_cell=q, gpu=self._gpu, cpu=not self._gpu,
+                                          layout=layout, latex_name='dst', dtype=field_dtype, alignment=alignment)
 
         if velocity_data_name is None:
             self._data_handling.add_array(self.velocity_data_name, values_per_cell=self._data_handling.dim,
@@ -101,6 +183,13 @@ class LatticeBoltzmannStep:
         self.kernel_params = kernel_params.copy()
 
         # --- Kernel creation ---
+        self._frame_kernels = []
+        self._sub_step_kernels = []
+        self._wavefront_kernels = None
+        pool = compile_processes
+        if not isinstance(pool, KernelCreationPool):
+            pool = KernelCreationPool(compile_processes)
+        submit = pool.submit_lb_function
         if lbm_kernel is None:
             switch_to_symbolic_relaxation_rates_for_omega_adapting_methods(method_parameters, self.kernel_params,
                                                                            force=not fixed_relaxation_rates)
@@ -108,44 +197,101 @@ class LatticeBoltzmannStep:
                 optimization['symbolic_field'] = data_handling.fields[self._pdf_arr_name]
             method_parameters['field_name'] = self._pdf_arr_name
             method_parameters['temporary_field_name'] = self._tmp_arr_name
-            if time_step_order == 'stream_collide':
-                self._lbmKernels = [create_lb_function(optimization=optimization,
-                                                       **method_parameters)]
+            if method_parameters['collision_rule'] is not None:
+                self.method = method_parameters['collision_rule'].method
+            elif method_parameters['lb_method'] is not None:
+                self.method = method_parameters['lb_method']
+            else:
+                # the collision rule is taken from the disk cache of pystencils if it was derived before. Kernels
+                # created in this process reuse it, worker processes derive it again. It can not be hashed for the
+                # kernel cache, so kernels from the kernel cache are looked up without it.
+                collision_rule = create_lb_collision_rule(optimization=optimization, **method_parameters)
+                self.method = collision_rule.method
+                in_process = pool.processes == 1 or optimization['target'] != 'cpu'
+                if in_process and not optimization['kernel_cache']:
+                    method_parameters['collision_rule'] = collision_rule
+            if ghost_layers > 1 and not updates_ghost_layers:
+                optimization['iteration_slice'] = (slice(ghost_layers, -ghost_layers),) * data_handling.dim
+            if in_place:
+                self._lbmKernels = [submit(optimization=optimization, kernel_type=streaming_pattern + '_' + parity,
+                                           **method_parameters)
+                                    for parity in ('even', 'odd')]
+            elif updates_ghost_layers:
+                # one kernel per time step between ghost layer exchanges, each updating one ghost layer less
+                self._sub_step_kernels = [
+                    submit(optimization=dict(optimization, iteration_slice=(slice(i, -i),) * self.dim),
+                           **method_parameters)
+                    for i in range(1, ghost_layers + 1)]
+                self._lbmKernels = [self._sub_step_kernels[-1]]
+            elif overlap_communication:
+                ghost_layers = data_handling.ghost_layers_of_field(self._pdf_arr_name)
+                interior, frame = _interior_and_frame_slices(data_handling.dim, ghost_layers)
+                self._lbmKernels = [submit(optimization=dict(optimization, iteration_slice=interior),
+                                           **method_parameters)]
+                self._frame_kernels = [submit(optimization=dict(optimization, iteration_slice=s), **method_parameters)
+                                       for s in frame]
+            elif time_step_order == 'stream_collide':
+                self._lbmKernels = [submit(optimization=optimization, **method_parameters)]
             elif time_step_order == 'collide_stream':
-                self._lbmKernels = [create_lb_function(optimization=optimization,
-                                                       kernel_type='collide_only',
-                                                       **method_parameters),
-                                    create_lb_function(optimization=optimization,
-                                                       kernel_type='stream_pull_only',
-                                                       ** method_parameters)]
-
+                self._lbmKernels = [submit(optimization=optimization, kernel_type='collide_only', **method_parameters),
+                                    submit(optimization=optimization, kernel_type='stream_pull_only',
+                                           **method_parameters)]
+            if temporal_blocking is not None:
+                if method_parameters['omega_output_field']:
+                    raise ValueError("Temporal blocking is not possible for kernels writing relaxation rates")
+                self._wavefront_kernels = self._create_wavefront_kernels(temporal_blocking, optimization,
+                                                                         method_parameters, submit)
         else:
             assert self._data_handling.dim == lbm_kernel.method.dim, \
                 "Error: %dD Kernel for %d dimensional domain" % (lbm_kernel.method.dim, self._data_handling.dim)
             self._lbmKernels = [lbm_kernel]
+            self.method = lbm_kernel.method
 
-        self.method = self._lbmKernels[0].method
-        self.ast = self._lbmKernels[0].ast
+        # -- Macroscopic Value Kernels
+        # one getter and setter per parity, the current pdfs are where the kernel of the next time step reads them
+        accessors = get_in_place_accessors(streaming_pattern) if in_place else (None,)
+        self._getterKernels, self._setterKernels = zip(*[self._submit_macroscopic_getter_and_setter(pool, a)
+                                                         for a in accessors])
+        # getters running over views of the arrays, for the cells of a slice
+        self._lazy_macroscopic_values = lazy_macroscopic_values
+        self._macroscopic_values_outdated = False
+        if lazy_macroscopic_values:
+            self._slice_getters = [self._submit_slice_getter(pool, a) for a in accessors]
+        if pool is not compile_processes:
+            pool.shutdown(wait=False)
 
         # -- Boundary Handling  & Synchronization ---
         stencil_name = method_parameters['stencil']
-        self._sync_src = data_handling.synchronization_function([self._pdf_arr_name], stencil_name, target,
-                                                                stencil_restricted=True)
-        self._sync_tmp = data_handling.synchronization_function([self._tmp_arr_name], stencil_name, target,
-                                                                stencil_restricted=True)
+        self._parity = 0  # of the next time step, for in-place streaming patterns
+        self._sub_step = 0  # index of the next time step since the last ghost layer exchange
+        if in_place:
+            # in-place kernels read ghost layer entries of all directions, and write into ghost layers
+            self._sync_src = data_handling.synchronization_function([self._pdf_arr_name], stencil_name, target,
+                                                                    stencil_restricted=False)
+            pdf_field = data_handling.fields[self._pdf_arr_name]
+            self._in_place_accessors = get_in_place_accessors(streaming_pattern)
+            self._kernel_write_back = [self._ghost_layer_write_back(a.write(pdf_field, self.method.stencil))
+                                       for a in self._in_place_accessors]
+        else:
+            # with multiple ghost layers, all pdfs of the ghost layers are updated and have to be exchanged
+            stencil_restricted = not updates_ghost_layers
+            self._in_place_accessors = None
+            self._sync_src = data_handling.synchronization_function([self._pdf_arr_name], stencil_name, target,
+                                                                    stencil_restricted=stencil_restricted)
+            self._sync_tmp = data_handling.synchronization_function([self._tmp_arr_name], stencil_name, target,
+                                                                    stencil_restricted=stencil_restricted)
 
         self._boundary_handling = LatticeBoltzmannBoundaryHandling(self.method, self._data_handling, self._pdf_arr_name,
                                                                    name=name + "_boundary_handling",
                                                                    flag_interface=flag_interface,
-                                                                   target=target, openmp=optimization['openmp'])
-
-        # -- Macroscopic Value Kernels
-        self._getterKernel, self._setterKernel = self._compile_macroscopic_setter_and_getter()
+                                                                   target=target, openmp=optimization['openmp'],
+                                                                   streaming_pattern=streaming_pattern,
+                                                                   links_in_ghost_layers=updates_ghost_layers)
 
         self._data_handling.fill(self.density_data_name, 1.0, value_idx=self.density_data_index,
                                  ghost_layers=True, inner_ghost_layers=True)
         self._data_handling.fill(self.velocity_data_name, 0.0, ghost_layers=True, inner_ghost_layers=True)
-        self.set_pdf_fields_from_macroscopic_values()
+        self._set_pdfs_to_rest_state()
 
         # -- VTK output
         self._vtk_writer = None
@@ -154,11 +300,21 @@ class LatticeBoltzmannStep:
         self._velocity_init_kernel = None
         self._velocity_init_vel_backup = None
 
+        # -- Profiling
+        self._profiler = None
+        self._kernel_profile = {}
+        self._untimed_functions = {}
+
     @property
     def boundary_handling(self):
         """Boundary handling instance of the scenario. Use this to change the boundary setup"""
         return self._boundary_handling
 
+    @property
+    def ast(self):
+        """AST of the (first) lattice Boltzmann kernel."""
+        return self._lbmKernels[0].ast
+
     @property
     def data_handling(self):
         return self._data_handling
@@ -193,6 +349,8 @@ class LatticeBoltzmannStep:
     def _get_slice(self, data_name, slice_obj, masked):
         if slice_obj is None:
             slice_obj = make_slice[:, :] if self.dim == 2 else make_slice[:, :, 0.5]
+        if self._macroscopic_values_outdated:
+            self._compute_macroscopic_values(slice_obj[:self.dim])
 
         result = self._data_handling.gather_array(data_name, slice_obj)
 
@@ -230,45 +388,125 @@ class LatticeBoltzmannStep:
             if self._data_handling.is_on_gpu(self.density_data_name):
                 self._data_handling.to_gpu(self.density_data_name)
 
+    def update_macroscopic_values(self):
+        """Computes density and velocity of all cells, if they are outdated (see ``lazy_macroscopic_values``)."""
+        if self._macroscopic_values_outdated:
+            self._data_handling.run_kernel(self._getterKernels[self._parity], **self.kernel_params)
+            self._macroscopic_values_outdated = False
+
     def set_pdf_fields_from_macroscopic_values(self):
-        self._data_handling.run_kernel(self._setterKernel, **self.kernel_params)
+        self._macroscopic_values_outdated = False  # the arrays define the pdfs
+        self._data_handling.run_kernel(self._setterKernels[self._parity], **self.kernel_params)
+        self._sub_step = 0  # ghost layers have to be exchanged again
+        if self._in_place_accessors:
+            pdf_field = self._data_handling.fields[self._pdf_arr_name]
+            accessor = self._in_place_accessors[self._parity]
+            self._ghost_layer_write_back(accessor.read(pdf_field, self.method.stencil))()
+            self._sync_src()
 
     def time_step(self):
-        if len(self._lbmKernels) == 2:  # collide stream
-            self._data_handling.run_kernel(self._lbmKernels[0], **self.kernel_params)
+        if self._in_place_accessors:
+            # in-place kernels read streamed pdfs, so boundaries act right after the kernel of the previous step
+            self._run_kernel(self._lbmKernels[self._parity])
+            self._kernel_write_back[self._parity]()
+            self._parity = 1 - self._parity
             self._sync_src()
+            self._boundary_handling(parity=self._parity, **self.kernel_params)
+            return
+
+        if self._sub_step_kernels:  # stream collide, ghost layers are exchanged every few steps
+            if self._sub_step == 0:
+                self._sync_src()
             self._boundary_handling(**self.kernel_params)
-            self._data_handling.run_kernel(self._lbmKernels[1], **self.kernel_params)
+            self._run_kernel(self._sub_step_kernels[self._sub_step])
+            self._sub_step = (self._sub_step + 1) % len(self._sub_step_kernels)
+        elif len(self._lbmKernels) == 2:  # collide stream
+            self._run_kernel(self._lbmKernels[0])
+            self._sync_src()
+            self._boundary_handling(**self.kernel_params)
+            self._run_kernel(self._lbmKernels[1])
+        elif self._frame_kernels:  # stream collide, interior while communicating
+            start_communication, wait_for_communication = _communication_phases(self._sync_src)
+            start_communication()
+            self._boundary_handling(**self.kernel_params)
+            self._run_kernel(self._lbmKernels[0])
+            if wait_for_communication:
+                wait_for_communication()
+                self._boundary_handling(**self.kernel_params)  # restores boundary values in the ghost layers
+            for kernel in self._frame_kernels:
+                self._run_kernel(kernel)
         else:  # stream collide
             self._sync_src()
             self._boundary_handling(**self.kernel_params)
-            self._data_handling.run_kernel(self._lbmKernels[0], **self.kernel_params)
+            self._run_kernel(self._lbmKernels[0])
 
-        self._data_handling.swap(self._pdf_arr_name, self._tmp_arr_name, self._gpu)
+        self._swap()
 
     def get_time_loop(self):
         self.pre_run()  # make sure GPU arrays are allocated
 
-        fixed_loop = self._timeloop_creation_function(steps=2)
+        # the fixed steps have to return to the current pdf array and to the current step between exchanges
+        if self._wavefront_kernels is not None:
+            fixed_steps = self._wavefront_time_steps
+        elif self._sub_step_kernels:
+            fixed_steps = int(np.lcm(2, len(self._sub_step_kernels)))
+        else:
+            fixed_steps = 2
+        fixed_loop = self._timeloop_creation_function(steps=fixed_steps)
         fixed_loop.add_pre_run_function(self.pre_run)
         fixed_loop.add_post_run_function(self.post_run)
         fixed_loop.add_single_step_function(self.time_step)
 
-        for t in range(2):
-            if len(self._lbmKernels) == 2:  # collide stream
+        if self._wavefront_kernels is not None:
+            fixed_loop.add_call(self._timed_wavefront_sweep(self._create_wavefront_sweep()), {})
+            return fixed_loop
+
+        if self._in_place_accessors:
+            for t in range(2):
+                parity = (self._parity + t) % 2
+                kernel_args = self._data_handling.get_kernel_kwargs(self._lbmKernels[parity], **self.kernel_params)
+                fixed_loop.add_call(self._timed_kernel(self._lbmKernels[parity]), kernel_args)
+                fixed_loop.add_call(self._kernel_write_back[parity], {})
+                fixed_loop.add_call(self._sync_src, {})
+                self._boundary_handling.add_fixed_steps(fixed_loop, parity=1 - parity, **self.kernel_params)
+            return fixed_loop
+
+        for t in range(fixed_steps):
+            if self._sub_step_kernels:  # stream collide, ghost layers are exchanged every few steps
+                sub_step = (self._sub_step + t) % len(self._sub_step_kernels)
+                if sub_step == 0:
+                    fixed_loop.add_call(self._sync_src if t % 2 == 0 else self._sync_tmp, {})
+                self._boundary_handling.add_fixed_steps(fixed_loop, **self.kernel_params)
+                kernel = self._sub_step_kernels[sub_step]
+                fixed_loop.add_call(self._timed_kernel(kernel),
+                                    self._data_handling.get_kernel_kwargs(kernel, **self.kernel_params))
+            elif len(self._lbmKernels) == 2:  # collide stream
                 collide_args = self._data_handling.get_kernel_kwargs(self._lbmKernels[0], **self.kernel_params)
-                fixed_loop.add_call(self._lbmKernels[0], collide_args)
+                fixed_loop.add_call(self._timed_kernel(self._lbmKernels[0]), collide_args)
 
                 fixed_loop.add_call(self._sync_src if t == 0 else self._sync_tmp, {})
                 self._boundary_handling.add_fixed_steps(fixed_loop, **self.kernel_params)
 
                 stream_args = self._data_handling.get_kernel_kwargs(self._lbmKernels[1], **self.kernel_params)
-                fixed_loop.add_call(self._lbmKernels[1], stream_args)
+                fixed_loop.add_call(self._timed_kernel(self._lbmKernels[1]), stream_args)
+            elif self._frame_kernels:  # stream collide, interior while communicating
+                start_communication, wait_for_communication = _communication_phases(
+                    self._sync_src if t == 0 else self._sync_tmp)
+                fixed_loop.add_call(start_communication, {})
+                self._boundary_handling.add_fixed_steps(fixed_loop, **self.kernel_params)
+                interior_args = self._data_handling.get_kernel_kwargs(self._lbmKernels[0], **self.kernel_params)
+                fixed_loop.add_call(self._timed_kernel(self._lbmKernels[0]), interior_args)
+                if wait_for_communication:
+                    fixed_loop.add_call(wait_for_communication, {})
+                    self._boundary_handling.add_fixed_steps(fixed_loop, **self.kernel_params)
+                for kernel in self._frame_kernels:
+                    fixed_loop.add_call(self._timed_kernel(kernel),
+                                        self._data_handling.get_kernel_kwargs(kernel, **self.kernel_params))
             else:  # stream collide
                 fixed_loop.add_call(self._sync_src if t == 0 else self._sync_tmp, {})
                 self._boundary_handling.add_fixed_steps(fixed_loop, **self.kernel_params)
                 stream_collide_args = self._data_handling.get_kernel_kwargs(self._lbmKernels[0], **self.kernel_params)
-                fixed_loop.add_call(self._lbmKernels[0], stream_collide_args)
+                fixed_loop.add_call(self._timed_kernel(self._lbmKernels[0]), stream_collide_args)
 
             self._data_handling.swap(self._pdf_arr_name, self._tmp_arr_name, self._gpu)
         return fixed_loop
@@ -276,7 +514,10 @@ class LatticeBoltzmannStep:
     def post_run(self):
         if self._gpu:
             self._data_handling.to_cpu(self._pdf_arr_name)
-        self._data_handling.run_kernel(self._getterKernel, **self.kernel_params)
+        if self._lazy_macroscopic_values:
+            self._macroscopic_values_outdated = True
+        else:
+            self._data_handling.run_kernel(self._getterKernels[self._parity], **self.kernel_params)
 
     def run(self, time_steps):
         time_loop = self.get_time_loop()
@@ -302,15 +543,96 @@ class LatticeBoltzmannStep:
 
     def benchmark(self, time_for_benchmark=5, init_time_steps=2, number_of_time_steps_for_estimation='auto'):
         time_loop = self.get_time_loop()
+        if number_of_time_steps_for_estimation == 'auto' and (self._in_place_accessors or self._sub_step_kernels):
+            # the automatic estimation starts with a single time step, after which the fixed steps of the time loop
+            # would run out of phase
+            number_of_time_steps_for_estimation = time_loop.fixed_steps
         duration_of_time_step = time_loop.benchmark(time_for_benchmark, init_time_steps,
                                                     number_of_time_steps_for_estimation)
         mlups = self.number_of_cells / duration_of_time_step * 1e-6
         self.time_steps_run += time_loop.time_steps_run
         return mlups
 
+    def warmup(self):
+        """Compiles all kernels of the step and its boundaries, which are otherwise compiled when first used.
+
+        Returns:
+            number of kernels compiled by this call
+        """
+        kernels = self._lbmKernels + self._frame_kernels + self._sub_step_kernels
+        kernels += list(self._getterKernels) + list(self._setterKernels)
+        if self._lazy_macroscopic_values:
+            kernels += [kernel for kernel, _ in self._slice_getters]
+        if self._wavefront_kernels is not None:
+            kernels += list(self._wavefront_kernels.values())
+        pending = {id(k): k for k in kernels if isinstance(k, KernelFuture) and not k.done}
+        for kernel in pending.values():
+            kernel.result()
+        return len(pending) + self._boundary_handling.warmup()
+
     def write_vtk(self):
+        self.update_macroscopic_values()
         self.vtk_writer(self.time_steps_run)
 
+    @property
+    def profiler(self):
+        """:class:`lbmpy.profiling.Profiler` of the time steps run since :meth:`enable_profiling`, or None"""
+        return self._profiler
+
+    def enable_profiling(self, trace=True):
+        """Records wall time, calls and estimated memory traffic of each phase of the following time steps.
+
+        The ghost layer synchronization, each boundary condition, each kernel and the swap of the pdf arrays are
+        separate phases. Memory traffic of kernels is estimated with :class:`lbmpy.performance_model.
+        KernelPerformanceModel`, the synchronization reads and writes every pdf of the ghost layers. With temporal
+        blocking, the wavefront sweep including its boundary kernels and synchronization is a single phase.
+        Without profiling the kernels are called directly, so disabled profiling costs nothing.
+
+        Args:
+            trace: record every call for :meth:`lbmpy.profiling.Profiler.to_chrome_trace`
+
+        Returns:
+            the new profiler, also available as :attr:`profiler`
+        """
+        self.disable_profiling()
+        dh = self._data_handling
+        profiler = Profiler(self.number_of_cells, trace)
+        ghost_layers = dh.ghost_layers_of_field(self._pdf_arr_name)
+        pdf_field = dh.fields[self._pdf_arr_name]
+        ghost_cells = int(np.prod([s + 2 * ghost_layers for s in dh.shape])) - self.number_of_cells
+        sync_bytes = 2 * ghost_cells * pdf_field.index_shape[0] * pdf_field.dtype.numpy_dtype.itemsize
+
+        self._untimed_functions = {name: getattr(self, name) for name in ('_sync_src', '_sync_tmp')
+                                   if hasattr(self, name)}
+        for name, sync in self._untimed_functions.items():
+            timed_sync = profiler.timed('ghost layer sync', sync, 'sync', bytes_per_call=sync_bytes)
+            if hasattr(sync, 'startCommunication') and hasattr(sync, 'wait'):
+                timed_sync.startCommunication = profiler.timed('ghost layer sync', sync.startCommunication, 'sync',
+                                                               bytes_per_call=sync_bytes)
+                timed_sync.wait = profiler.timed('ghost layer sync wait', sync.wait, 'sync')
+            setattr(self, name, timed_sync)
+        if self._in_place_accessors:
+            self._untimed_functions['_kernel_write_back'] = self._kernel_write_back
+            self._kernel_write_back = [profiler.timed('ghost layer write back', f, 'sync')
+                                       for f in self._kernel_write_back]
+
+        self._kernel_profile = {}
+        for kernel, name, cells in self._profiled_kernels():
+            bytes_per_call = KernelPerformanceModel(kernel).bytes_per_lattice_update * cells
+            self._kernel_profile[id(kernel)] = (name, cells, bytes_per_call)
+        self._boundary_handling.profiler = profiler
+        self._profiler = profiler
+        return profiler
+
+    def disable_profiling(self):
+        """Stops recording, time loops created afterwards call the kernels directly again."""
+        for name, function in self._untimed_functions.items():
+            setattr(self, name, function)
+        self._untimed_functions = {}
+        self._kernel_profile = {}
+        self._boundary_handling.profiler = None
+        self._profiler = None
+
     def run_iterative_initialization(self, velocity_relaxation_rate=1.0, convergence_threshold=1e-5, max_steps=5000,
                                      check_residuum_after=100):
         """Runs Advanced initialization of velocity field through iteration procedure.
@@ -333,6 +655,8 @@ class LatticeBoltzmannStep:
         Returns:
             tuple (residuum, steps_run) if successful or raises ValueError if not converged
         """
+        if self._in_place_accessors:
+            raise NotImplementedError("Iterative initialization is not implemented for in-place streaming patterns")
         dh = self.data_handling
         gpu = self._gpu
 
@@ -381,13 +705,14 @@ class LatticeBoltzmannStep:
                 self._data_handling.run_kernel(self._velocity_init_kernel, **self.kernel_params)
                 self._data_handling.swap(self._pdf_arr_name, self._tmp_arr_name, gpu=gpu)
             self._data_handling.all_to_cpu()
-            self._data_handling.run_kernel(self._getterKernel, **self.kernel_params)
+            self._data_handling.run_kernel(self._getterKernels[0], **self.kernel_params)
             global_residuum = compute_residuum()
             print("Initialization iteration {}, residuum {}".format(steps_run, global_residuum))
             if np.isnan(global_residuum) or global_residuum < convergence_threshold:
                 break
 
         assert global_residuum is not None
+        self._sub_step = 0
         converged = global_residuum < convergence_threshold
         if not converged:
             restore_velocity_backup()
@@ -396,20 +721,275 @@ class LatticeBoltzmannStep:
 
         return global_residuum, steps_run
 
-    def _compile_macroscopic_setter_and_getter(self):
-        lb_method = self.method
-        cqc = lb_method.conserved_quantity_computation
+    def _run_kernel(self, kernel):
+        if self._profiler is None:
+            self._data_handling.run_kernel(kernel, **self.kernel_params)
+        else:
+            name, cells, bytes_per_call = self._kernel_profile[id(kernel)]
+            start = time.perf_counter()
+            self._data_handling.run_kernel(kernel, **self.kernel_params)
+            self._profiler.record(name, start, time.perf_counter() - start, 'kernel', cells, bytes_per_call)
+
+    def _swap(self):
+        if self._profiler is None:
+            self._data_handling.swap(self._pdf_arr_name, self._tmp_arr_name, self._gpu)
+        else:
+            start = time.perf_counter()
+            self._data_handling.swap(self._pdf_arr_name, self._tmp_arr_name, self._gpu)
+            self._profiler.record('swap', start, time.perf_counter() - start, 'swap')
+
+    def _timed_kernel(self, kernel):
+        """The kernel function for a time loop, recording its calls if profiling is enabled."""
+        if self._profiler is None:
+            return kernel
+        name, cells, bytes_per_call = self._kernel_profile[id(kernel)]
+        return self._profiler.timed(name, getattr(kernel, 'kernel', kernel), 'kernel', cells, bytes_per_call)
+
+    def _timed_wavefront_sweep(self, sweep):
+        if self._profiler is None:
+            return sweep
+        cells = self.number_of_cells * self._wavefront_time_steps
+        model = KernelPerformanceModel(next(iter(self._wavefront_kernels.values())))
+        return self._profiler.timed('wavefront sweep', sweep, 'kernel', cells, model.bytes_per_lattice_update * cells)
+
+    def _profiled_kernels(self):
+        """(kernel, phase name, number of updated cells) of all lattice Boltzmann kernels."""
+        dh = self._data_handling
+        ghost_layers = dh.ghost_layers_of_field(self._pdf_arr_name)
+        shape = [s + 2 * ghost_layers for s in dh.shape]
+
+        def cells(slices):
+            return int(np.prod([len(range(*s.indices(n))) for s, n in zip(slices, shape)]))
+
+        if self._in_place_accessors:
+            return [(k, 'stream_collide ' + parity, self.number_of_cells)
+                    for k, parity in zip(self._lbmKernels, ('even', 'odd'))]
+        elif self._sub_step_kernels:
+            return [(k, 'stream_collide sub step {}'.format(i), cells((slice(i + 1, -i - 1),) * self.dim))
+                    for i, k in enumerate(self._sub_step_kernels)]
+        elif len(self._lbmKernels) == 2:
+            return [(self._lbmKernels[0], 'collide', self.number_of_cells),
+                    (self._lbmKernels[1], 'stream', self.number_of_cells)]
+        elif self._frame_kernels:
+            interior, frame = _interior_and_frame_slices(self.dim, ghost_layers)
+            return [(self._lbmKernels[0], 'stream_collide interior', cells(interior))] + \
+                [(k, 'stream_collide frame', cells(s)) for k, s in zip(self._frame_kernels, frame)]
+        return [(self._lbmKernels[0], 'stream_collide', self.number_of_cells)]
+
+    def _set_pdfs_to_rest_state(self):
+        """Sets the pdfs to the equilibrium of density 1 and velocity 0, without compiling the setter kernel.
+
+        The density and velocity arrays have to be filled accordingly. Methods whose equilibrium depends on other
+        fields, e.g. forces, are initialized by the setter kernel.
+        """
         pdf_field = self._data_handling.fields[self._pdf_arr_name]
-        rho_field = self._data_handling.fields[self.density_data_name]
-        rho_field = rho_field.center if self.density_data_index is None else rho_field(self.density_data_index)
-        vel_field = self._data_handling.fields[self.velocity_data_name]
-
-        getter_eqs = cqc.output_equations_from_pdfs(pdf_field.center_vector,
-                                                    {'density': rho_field, 'velocity': vel_field})
-        getter_kernel = create_kernel(getter_eqs, target='cpu', cpu_openmp=self._optimization['openmp']).compile()
-
-        setter_eqs = pdf_initialization_assignments(lb_method, rho_field,
-                                                    vel_field.center_vector, pdf_field.center_vector)
-        setter_eqs = create_simplification_strategy(lb_method)(setter_eqs)
-        setter_kernel = create_kernel(setter_eqs, target='cpu', cpu_openmp=self._optimization['openmp']).compile()
-        return getter_kernel, setter_kernel
+        accessor = self._in_place_accessors[self._parity] if self._in_place_accessors else None
+        pdfs = pdf_field.center_vector if accessor is None else accessor.read(pdf_field, self.method.stencil)
+        setter_eqs = pdf_initialization_assignments(self.method, 1, [0] * self.dim, pdfs)
+        setter_eqs = setter_eqs.new_without_subexpressions().main_assignments
+        if any(not eq.rhs.is_Number for eq in setter_eqs):
+            self.set_pdf_fields_from_macroscopic_values()
+            return
+        # the values are the same in every cell, the ghost layers included, so the accessed cell does not matter
+        for eq in setter_eqs:
+            self._data_handling.fill(self._pdf_arr_name, float(eq.rhs), value_idx=eq.lhs.index[0],
+                                     ghost_layers=True, inner_ghost_layers=True)
+
+    def _submit_slice_getter(self, pool, accessor=None):
+        fields = self._data_handling.fields
+        pdf_field = _generic_field(fields[self._pdf_arr_name])
+        reads_neighbors = accessor is not None and any(a.offsets != (0,) * self.dim
+                                                       for a in accessor.read(pdf_field, self.method.stencil))
+        halo = 1 if reads_neighbors else 0
+        kernel = pool.submit(_macroscopic_getter_ast, lb_method=self.method, pdf_field=pdf_field, accessor=accessor,
+                             rho_field=_generic_field(fields[self.density_data_name]),
+                             density_index=self.density_data_index,
+                             vel_field=_generic_field(fields[self.velocity_data_name]),
+                             openmp=self._optimization['openmp'], ghost_layers=halo)
+        return kernel, halo
+
+    def _compute_macroscopic_values(self, slice_obj):
+        """Runs the getter for the cells of the slice only, by calling a getter for generic fields with views."""
+        dh = self._data_handling
+        if not isinstance(dh, SerialDataHandling):
+            self.update_macroscopic_values()
+            return
+        kernel, halo = self._slice_getters[self._parity]
+        ghost_layers = dh.ghost_layers_of_field(self._pdf_arr_name)
+        view = []
+        for s, size in zip(normalize_slice(slice_obj, dh.shape), dh.shape):
+            start, stop = (s, s + 1) if isinstance(s, int) else (s.start, s.stop)
+            start, stop = max(start + ghost_layers, halo), min(stop + ghost_layers, size + 2 * ghost_layers - halo)
+            if stop <= start:
+                return
+            view.append(slice(start - halo, stop + halo))
+        view = tuple(view)
+        kernel(**{name: dh.cpu_arrays[name][view]
+                  for name in (self._pdf_arr_name, self.density_data_name, self.velocity_data_name)})
+
+    def _submit_macroscopic_getter_and_setter(self, pool, accessor=None):
+        fields = self._data_handling.fields
+        args = dict(lb_method=self.method, pdf_field=fields[self._pdf_arr_name], accessor=accessor,
+                    rho_field=fields[self.density_data_name], density_index=self.density_data_index,
+                    vel_field=fields[self.velocity_data_name], openmp=self._optimization['openmp'])
+        return pool.submit(_macroscopic_getter_ast, **args), pool.submit(_macroscopic_setter_ast, **args)
+
+    def _create_wavefront_kernels(self, temporal_blocking, optimization, method_parameters, submit):
+        """Chooses axis and thickness of the slabs for temporal blocking, and returns a dict with a kernel future for
+        each slab thickness, the kernels are called with views of the pdf arrays containing a slab and its neighbor
+        layers."""
+        dh = self._data_handling
+        time_steps, slab_size = temporal_blocking if isinstance(temporal_blocking, tuple) else (temporal_blocking, None)
+        if time_steps < 1:
+            raise ValueError("Temporal blocking needs at least one time step")
+        pdf_arr = dh.cpu_arrays[self._pdf_arr_name]
+        non_periodic = [d for d in range(dh.dim) if not dh.periodicity[d]]
+        if not non_periodic:
+            raise ValueError("Temporal blocking needs a non-periodic direction to move the wavefront along")
+        axis = max(non_periodic, key=lambda d: pdf_arr.strides[d])
+        if slab_size is None:
+            bytes_per_layer = pdf_arr.nbytes // pdf_arr.shape[axis]
+            slab_size = max(1, WAVEFRONT_CACHE_SIZE // (2 * (time_steps + 1) * bytes_per_layer))
+        self._wavefront_time_steps = time_steps
+        self._wavefront_axis = axis
+        self._wavefront_slab_size = slab_size
+
+        kernels = {}
+        for start, stop in _wavefront_slabs(dh.shape[axis], dh.ghost_layers_of_field(self._pdf_arr_name), slab_size):
+            if stop - start not in kernels:
+                view = (slice(None),) * axis + (slice(start - 1, stop + 1),)
+                symbolic_field = Field.create_from_numpy_array(self._pdf_arr_name, pdf_arr[view], index_dimensions=1)
+                kernels[stop - start] = submit(optimization=dict(optimization, symbolic_field=symbolic_field),
+                                               **method_parameters)
+        return kernels
+
+    def _create_wavefront_sweep(self):
+        """Returns a function that runs the fixed time steps of temporal blocking as a wavefront over slabs.
+
+        Time step t of slab k needs time step t - 1 of slab k + 1, and overwrites pdfs that time step t - 1 of slab
+        k + 1 reads. Therefore all time steps of a wave, from the first to the last, update one slab less far along.
+        Ghost layers in periodic directions are synchronized slab by slab, one slab ahead of the kernel, the boundary
+        kernels are called for the links of the updated slab.
+        """
+        dh = self._data_handling
+        axis, time_steps = self._wavefront_axis, self._wavefront_time_steps
+        ghost_layers = dh.ghost_layers_of_field(self._pdf_arr_name)
+        slabs = _wavefront_slabs(dh.shape[axis], ghost_layers, self._wavefront_slab_size)
+        boundary_calls = self._boundary_handling.calls_per_slab(axis, slabs, **self.kernel_params)
+
+        periodic_directions = [d for d in product(*[(-1, 0, 1)] * dh.dim)
+                               if any(d) and all(periodic or c == 0 for c, periodic in zip(d, dh.periodicity))]
+        periodic_copies = []
+        for start, stop in slabs:
+            copies = []
+            for src, dst in get_periodic_boundary_src_dst_slices(periodic_directions, ghost_layers):
+                src, dst = list(src), list(dst)
+                src[axis] = dst[axis] = slice(start, stop)
+                copies.append((tuple(src), tuple(dst)))
+            periodic_copies.append(copies)
+
+        kernels = [self._wavefront_kernels[stop - start] for start, stop in slabs]
+        kernel_params = self.kernel_params
+        pdf_name, tmp_name = self._pdf_arr_name, self._tmp_arr_name
+        views = [(slice(None),) * axis + (slice(start - 1, stop + 1),) for start, stop in slabs]
+
+        def sweep():
+            arrays = (dh.cpu_arrays[pdf_name], dh.cpu_arrays[tmp_name])
+            for wave in range(len(slabs) + time_steps - 1):
+                for t in range(max(0, wave - len(slabs) + 1), min(time_steps, wave + 1)):
+                    slab = wave - t
+                    src, dst = arrays if t % 2 == 0 else arrays[::-1]
+                    for synced_slab in range(0 if slab == 0 else slab + 1, min(slab + 2, len(slabs))):
+                        for src_slice, dst_slice in periodic_copies[synced_slab]:
+                            src[dst_slice] = src[src_slice]
+                    for boundary_kernel, arguments in boundary_calls[slab]:
+                        boundary_kernel(**arguments, **{pdf_name: src})
+                    kernels[slab](**kernel_params, **{pdf_name: src[views[slab]], tmp_name: dst[views[slab]]})
+            if time_steps % 2 == 1:
+                dh.swap(pdf_name, tmp_name)
+
+        return sweep
+
+    def _ghost_layer_write_back(self, accesses):
+        """Returns a function that moves the pdfs written to the given accesses of border cells from the ghost
+        layers to the periodic images of the ghost cells. Writes into ghost layers of non-periodic directions stay
+        where they are, boundaries read them from there."""
+        dh = self._data_handling
+        ghost_layers = dh.ghost_layers_of_field(self._pdf_arr_name)
+        assert ghost_layers == 1, "In-place streaming patterns are implemented for a single ghost layer only"
+        ghost_slices = {-1: slice(0, 1), 0: slice(1, -1), 1: slice(-1, None)}
+        image_slices = {-1: slice(-2, -1), 0: slice(1, -1), 1: slice(1, 2)}
+
+        copies = []
+        for access in accesses:
+            offsets = [int(o) for o in access.offsets]
+            # ghost regions reachable from inner cells with this offset
+            regions = product(*[(0, o) if o != 0 and periodic else (0,)
+                                for o, periodic in zip(offsets, dh.periodicity)])
+            for region in regions:
+                if any(region):
+                    copies.append((tuple(ghost_slices[r] for r in region) + access.index,
+                                   tuple(image_slices[r] for r in region) + access.index))
+
+        def write_back():
+            for b in dh.iterate(ghost_layers=True, inner_ghost_layers=True):
+                pdf_arr = b[self._pdf_arr_name]
+                for ghost, image in copies:
+                    pdf_arr[image] = pdf_arr[ghost]
+
+        return write_back
+
+
+def _macroscopic_fields(lb_method, pdf_field, accessor, rho_field, density_index, vel_field):
+    pdfs = pdf_field.center_vector if accessor is None else accessor.read(pdf_field, lb_method.stencil)
+    rho = rho_field.center if density_index is None else rho_field(density_index)
+    return pdfs, rho, vel_field
+
+
+def _macroscopic_getter_ast(lb_method, openmp, ghost_layers=None, **fields):
+    pdfs, rho, vel_field = _macroscopic_fields(lb_method, **fields)
+    cqc = lb_method.conserved_quantity_computation
+    getter_eqs = cqc.output_equations_from_pdfs(pdfs, {'density': rho, 'velocity': vel_field})
+    return create_kernel(getter_eqs, target='cpu', cpu_openmp=openmp, ghost_layers=ghost_layers)
+
+
+def _macroscopic_setter_ast(lb_method, openmp, **fields):
+    pdfs, rho, vel_field = _macroscopic_fields(lb_method, **fields)
+    setter_eqs = pdf_initialization_assignments(lb_method, rho, vel_field.center_vector, pdfs)
+    setter_eqs = create_simplification_strategy(lb_method)(setter_eqs)
+    return create_kernel(setter_eqs, target='cpu', cpu_openmp=openmp)
+
+
+def _generic_field(field):
+    """Field like the given one, whose kernels can be called with arrays of any size and strides."""
+    spatial_layout = tuple(d for d in field.layout if d < field.spatial_dimensions)
+    return Field.create_generic(field.name, field.spatial_dimensions, field.dtype.numpy_dtype, layout=spatial_layout,
+                                index_shape=field.index_shape)
+
+
+def _wavefront_slabs(inner_size, ghost_layers, slab_size):
+    """(start, stop) array indices of slabs of at most slab_size inner cells."""
+    return [(start, min(start + slab_size, inner_size + ghost_layers))
+            for start in range(ghost_layers, inner_size + ghost_layers, slab_size)]
+
+
+def _interior_and_frame_slices(dim, ghost_layers):
+    """Iteration slices of the cells whose neighbors are all inner cells, and of the remaining inner cells, split into
+    non-overlapping slabs along the borders."""
+    interior = tuple(slice(ghost_layers + 1, -ghost_layers - 1) for _ in range(dim))
+    frame = []
+    for d in range(dim):
+        for slab in (slice(ghost_layers, ghost_layers + 1), slice(-ghost_layers - 1, -ghost_layers)):
+            frame.append(interior[:d] + (slab,) + (slice(ghost_layers, -ghost_layers),) * (dim - d - 1))
+    return interior, frame
+
+
+def _communication_phases(sync):
+    """Splits a ghost layer synchronization into a start and a wait function.
+
+    The communication schemes of the parallel data handling exchange ghost layers asynchronously, all other
+    synchronizations are done completely in the start function, the wait function is None then.
+    """
+    if hasattr(sync, 'startCommunication') and hasattr(sync, 'wait'):
+        return sync.startCommunication, sync.wait
+    return sync, None
@@ -6,7 +6,8 @@ from lbmpy.cumulants import cumulant_as_function_of_raw_moments, raw_moment_as_f
 from lbmpy.methods.abstractlbmethod import AbstractLbMethod, LbmCollisionRule, RelaxationInfo
 from lbmpy.methods.conservedquantitycomputation import AbstractConservedQuantityComputation
 from lbmpy.moments import (
-    MOMENT_SYMBOLS, extract_monomials, moment_matrix, monomial_to_polynomial_transformation_matrix)
+    MOMENT_SYMBOLS, extract_monomials, moment_matrix, monomial_to_polynomial_transformation_matrix,
+    rational_matrix_inverse)
 from pystencils import Assignment
 from pystencils.sympyextensions import fast_subs, subs_additive
 
@@ -190,7 +191,7 @@ class CumulantBasedLbMethod(AbstractLbMethod):
         poly_values = mon_to_poly * sp.Matrix(monomial_cumulants)
         eq_values = sp.Matrix(self.cumulant_equilibrium_values)
         collided_poly_values = poly_values + relaxation_matrix * (eq_values - poly_values)  # collision
-        relaxed_monomial_cumulants = mon_to_poly.inv() * collided_poly_values
+        relaxed_monomial_cumulants = rational_matrix_inverse(mon_to_poly) * collided_poly_values
 
         if post_collision_subexpressions:
             symbols = [tuple_to_symbol(t, "post_c") for t in higher_order_indices]
@@ -201,7 +202,7 @@ class CumulantBasedLbMethod(AbstractLbMethod):
         # 5) Transform post-collision cumulant back to moments and from there to pdfs
         cumulant_dict = {idx: value for idx, value in zip(indices, relaxed_monomial_cumulants)}
         collided_moments = [raw_moment_as_function_of_cumulants(idx, cumulant_dict) for idx in indices]
-        result = moment_transformation_matrix.inv() * sp.Matrix(collided_moments)
+        result = rational_matrix_inverse(moment_transformation_matrix) * sp.Matrix(collided_moments)
         main_assignments = [Assignment(sym, val) for sym, val in zip(self.post_collision_pdf_symbols, result)]
 
         # 6) Add forcing terms
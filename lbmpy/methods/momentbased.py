@@ -5,7 +5,7 @@ import sympy as sp
 from lbmpy.maxwellian_equilibrium import get_weights
 from lbmpy.methods.abstractlbmethod import AbstractLbMethod, LbmCollisionRule, RelaxationInfo
 from lbmpy.methods.conservedquantitycomputation import AbstractConservedQuantityComputation
-from lbmpy.moments import MOMENT_SYMBOLS, moment_matrix
+from lbmpy.moments import MOMENT_SYMBOLS, moment_matrix, rational_matrix_inverse
 from pystencils import Assignment
 from pystencils.sympyextensions import subs_additive
 
@@ -120,13 +120,13 @@ class MomentBasedLbMethod(AbstractLbMethod):
     def collision_matrix(self):
         pdfs_to_moments = self.moment_matrix
         d = self.relaxation_matrix
-        return pdfs_to_moments.inv() * d * pdfs_to_moments
+        return self._inverse_moment_matrix(pdfs_to_moments) * d * pdfs_to_moments
 
     @property
     def inverse_collision_matrix(self):
         pdfs_to_moments = self.moment_matrix
         inverse_relaxation_matrix = self.relaxation_matrix.inv()
-        return pdfs_to_moments.inv() * inverse_relaxation_matrix * pdfs_to_moments
+        return self._inverse_moment_matrix(pdfs_to_moments) * inverse_relaxation_matrix * pdfs_to_moments
 
     @property
     def moment_matrix(self):
@@ -204,7 +204,13 @@ class MomentBasedLbMethod(AbstractLbMethod):
         pdf_to_moment = self.moment_matrix
         m_eq = sp.Matrix(self.moment_equilibrium_values)
 
-        collision_rule = f + pdf_to_moment.inv() * d * (m_eq - pdf_to_moment * f)
+        # same as f + M^-1 * D * (m_eq - M * f), but without symbolic inversion and products with zero entries
+        moment_to_pdf = self._inverse_moment_matrix(pdf_to_moment)
+        if d.is_diagonal():
+            relaxed = [d[i, i] * e for i, e in enumerate(m_eq - _sparse_matrix_vector_product(pdf_to_moment, f))]
+        else:
+            relaxed = d * (m_eq - _sparse_matrix_vector_product(pdf_to_moment, f))
+        collision_rule = f + _sparse_matrix_vector_product(moment_to_pdf, relaxed)
         collision_eqs = [Assignment(lhs, rhs) for lhs, rhs in zip(self.post_collision_pdf_symbols, collision_rule)]
 
         if conserved_quantity_equations is None:
@@ -229,6 +235,13 @@ class MomentBasedLbMethod(AbstractLbMethod):
         return LbmCollisionRule(self, collision_eqs, all_subexpressions,
                                 simplification_hints)
 
+    def _inverse_moment_matrix(self, pdfs_to_moments):
+        try:
+            weights = get_weights(self.stencil, sp.Rational(1, 3))
+        except KeyError:
+            weights = None
+        return rational_matrix_inverse(pdfs_to_moments, weights)
+
     @staticmethod
     def _generate_relaxation_matrix(relaxation_matrix, keep_rr_symbolic):
         """
@@ -252,3 +265,9 @@ class MomentBasedLbMethod(AbstractLbMethod):
             return substitutions, sp.diag(*new_rr)
         else:
             return [], relaxation_matrix
+
+
+def _sparse_matrix_vector_product(matrix, vector):
+    """Matrix-vector product that skips zero matrix entries - gives the same expressions as sympy's matrix product."""
+    return sp.Matrix([sp.Add(*[matrix[i, j] * vector[j] for j in range(matrix.cols) if matrix[i, j] != 0])
+                      for i in range(matrix.rows)])
@@ -38,6 +38,7 @@ import itertools
 import math
 from collections import Counter, defaultdict
 from copy import copy
+from fractions import Fraction
 from typing import Iterable, List, Optional, Sequence, Tuple, TypeVar
 
 import sympy as sp
@@ -368,6 +369,29 @@ def moment_matrix(moments, stencil, shift_velocity=None):
     return sp.Matrix(len(moments), len(stencil), generator)
 
 
+def rational_matrix_inverse(matrix, weights=None):
+    r"""Exact inverse of a matrix with rational entries, e.g. a moment matrix.
+
+    Gives the same result as ``matrix.inv()``, but uses fraction-free elimination on Python integers instead of
+    sympy numbers, which is much faster for the matrices occurring in LB methods. Results are cached, since the same
+    moment matrices are inverted every time a collision rule is created. Matrices with symbolic entries are inverted
+    by sympy.
+
+    Args:
+        matrix: square sympy matrix
+        weights: optional sequence of weights, one per column. If the rows of the matrix are orthogonal w.r.t. the
+                 scalar product weighted by these weights, the inverse is computed directly as
+                 :math:`W M^T (M W M^T)^{-1}`, where :math:`M W M^T` is diagonal.
+
+    >>> rational_matrix_inverse(sp.Matrix([[1, 1], [1, -1]]))
+    Matrix([
+    [1/2,  1/2],
+    [1/2, -1/2]])
+    """
+    weights = tuple(weights) if weights is not None else None
+    return sp.Matrix(_rational_matrix_inverse(sp.ImmutableMatrix(matrix), weights))
+
+
 def gram_schmidt(moments, stencil, weights=None):
     r"""
     Computes orthogonal set of moments using the method by Gram-Schmidt
@@ -628,6 +652,66 @@ def moment_equality_table_by_stencil(name_to_stencil_dict, moments, truncate_ord
 
 # --------------------------------------- Internal Functions -----------------------------------------------------------
 
+@memorycache(maxsize=64)
+def _rational_matrix_inverse(matrix, weights):
+    if not matrix.is_square:
+        raise ValueError("Only square matrices can be inverted")
+    if not all(e.is_Rational for e in matrix) or (weights is not None and not all(w.is_Rational for w in weights)):
+        return matrix.inv()
+
+    n = matrix.rows
+
+    def to_sympy(rows):
+        return sp.ImmutableMatrix(n, n, lambda i, j: sp.Rational(rows[i][j].numerator, rows[i][j].denominator))
+
+    # scale rows to integers: M = S^-1 * A  =>  M^-1 = A^-1 * S
+    row_scaling = [_lcm_of_denominators(matrix.row(i)) for i in range(n)]
+    a = [[int(matrix[i, j] * row_scaling[i]) for j in range(n)] for i in range(n)]
+
+    if weights is not None and len(weights) == n:
+        weight_scaling = _lcm_of_denominators(weights)
+        w = [int(e * weight_scaling) for e in weights]
+        gram_diagonal = [sum(w_k * a_k * a_k for w_k, a_k in zip(w, row)) for row in a]
+        orthogonal = all(gram_diagonal) and all(sum(w_k * a_k * b_k for w_k, a_k, b_k in zip(w, a[i], a[j])) == 0
+                                                for i in range(n) for j in range(i + 1, n))
+        if orthogonal:
+            # A^-1 = W A^T (A W A^T)^-1
+            return to_sympy([[Fraction(w[i] * a[j][i] * row_scaling[j], gram_diagonal[j]) for j in range(n)]
+                             for i in range(n)])
+
+    # fraction-free Gauss-Jordan elimination on [A | S]
+    augmented = [row + [row_scaling[i] if i == j else 0 for j in range(n)] for i, row in enumerate(a)]
+    for col in range(n):
+        pivot = next((r for r in range(col, n) if augmented[r][col] != 0), None)
+        if pivot is None:
+            raise ValueError("Matrix det == 0; not invertible.")
+        augmented[col], augmented[pivot] = augmented[pivot], augmented[col]
+        pivot_row = augmented[col]
+        pivot_value = pivot_row[col]
+        for r in range(n):
+            factor = augmented[r][col]
+            if r != col and factor != 0:
+                new_row = [e * pivot_value - factor * p for e, p in zip(augmented[r], pivot_row)]
+                divisor = _gcd_of_sequence(new_row)
+                augmented[r] = [e // divisor for e in new_row]
+    return to_sympy([[Fraction(e, augmented[i][i]) for e in augmented[i][n:]] for i in range(n)])
+
+
+def _lcm_of_denominators(rationals):
+    result = 1
+    for e in rationals:
+        q = int(sp.Rational(e).q)
+        result = result * q // math.gcd(result, q)
+    return result
+
+
+def _gcd_of_sequence(sequence):
+    result = 0
+    for e in sequence:
+        result = math.gcd(result, e)
+    return result if result != 0 else 1
+
+
 def __unique(seq: Sequence[T]) -> List[T]:
     """Removes duplicates from a sequence in an order preserving way.
 
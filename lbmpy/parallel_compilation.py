@@ -0,0 +1,179 @@
+"""
+Parallel kernel creation
+========================
+
+Setting up a scenario creates several kernels, e.g. the lattice Boltzmann kernels, the macroscopic value getter and
+setter and the kernels of phase field models. Each one is derived symbolically with sympy and compiled with the C
+compiler, both single threaded. The kernels do not depend on each other, so a :class:`KernelCreationPool` creates
+them in worker processes:
+
+>>> from lbmpy.creationfunctions import create_lb_function
+>>> with KernelCreationPool(processes=2) as pool:
+...     futures = [pool.submit_lb_function(stencil='D2Q9', method=method, relaxation_rate=1.8)
+...                for method in ('srt', 'trt')]
+>>> kernels = [f.result() for f in futures]
+>>> [k.method.__class__.__name__ for k in kernels]
+['MomentBasedLbMethod', 'MomentBasedLbMethod']
+
+The workers compile the kernels into the object cache of pystencils, or into the kernel cache of lbmpy if it is
+enabled (see :mod:`lbmpy.kernel_cache`), and send back the kernel ASTs. The main process compiles these ASTs again,
+which only loads the shared libraries from the cache. If the object cache of pystencils is disabled, only the symbolic
+derivation runs in parallel.
+
+A :class:`KernelFuture` can be used in place of the kernel, the first call or attribute access waits for it. Jobs
+whose arguments can not be pickled, e.g. because they contain lambda functions, run in the main process at this
+point, as do all jobs of a pool with a single process. Kernels that are never used are then never created. GPU
+kernels are always compiled in the main process.
+"""
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+from lbmpy.creationfunctions import create_lb_function, update_with_default_parameters
+from lbmpy.kernel_cache import parameter_hash
+
+__all__ = ['KernelCreationPool', 'KernelFuture']
+
+
+class KernelCreationPool:
+    """Creates kernels in worker processes.
+
+    Args:
+        processes: number of worker processes, by default the number of cores. With a single process all kernels are
+                   created in the main process, as if no pool was used.
+    """
+
+    def __init__(self, processes=None):
+        self.processes = (os.cpu_count() or 1) if processes is None else processes
+        self._executor = None
+
+    def submit(self, function, **kwargs):
+        """Schedules ``function(**kwargs)``, which returns a kernel AST or a tuple of ASTs.
+
+        The function has to be importable in the worker processes, i.e. defined at module level.
+
+        Returns:
+            :class:`KernelFuture`, its result is the compiled kernel, or a tuple of compiled kernels
+        """
+        return self._submit(_create_asts, (function, kwargs), _compile, lambda: _compile(function(**kwargs)))
+
+    def submit_lb_function(self, **kwargs):
+        """Schedules :func:`lbmpy.creationfunctions.create_lb_function` with the given arguments.
+
+        Returns:
+            :class:`KernelFuture`, its result is the kernel as returned by ``create_lb_function``
+        """
+        def in_process():
+            return create_lb_function(**kwargs)
+
+        if kwargs.get('optimization', {}).get('target', 'cpu') != 'cpu':
+            # GPU kernels are compiled in the main process, which owns the device context
+            return KernelFuture(None, lambda _: in_process())
+        if _uses_kernel_cache(kwargs):
+            # the worker stores the kernel in the kernel cache, where the main process finds it
+            return self._submit(_create_lb_ast, (kwargs, False), lambda _: in_process(), in_process)
+        return self._submit(_create_lb_ast, (kwargs, True), lambda ast: create_lb_function(**dict(kwargs, ast=ast)),
+                            in_process)
+
+    def shutdown(self, wait=True):
+        """Stops the workers after the submitted jobs are finished, their results stay available.
+
+        Args:
+            wait: wait until the workers are finished, otherwise they finish the jobs in the background
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def __repr__(self):
+        return "KernelCreationPool(processes={})".format(self.processes)
+
+    # ------------------------------ Implementation Details ------------------------------------------------------------
+
+    def _submit(self, worker_function, args, finish, in_process):
+        if self.processes > 1:
+            try:
+                pickle.dumps(args)
+            except (pickle.PicklingError, AttributeError, TypeError):
+                pass
+            else:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(self.processes)
+                return KernelFuture(self._executor.submit(worker_function, *args), finish)
+        return KernelFuture(None, lambda _: in_process())
+
+
+class KernelFuture:
+    """Kernel created by a :class:`KernelCreationPool`, :meth:`result` waits until it is available.
+
+    Calls and attribute accesses are forwarded to the kernel, so the future can be used in place of it.
+    """
+
+    def __init__(self, future, finish):
+        self._future = future
+        self._finish = finish
+        self._result = None
+        self._done = False
+
+    def result(self):
+        if not self._done:
+            self._result = self._finish(self._future.result() if self._future is not None else None)
+            self._done = True
+            self._future = self._finish = None
+        return self._result
+
+    @property
+    def done(self):
+        """True if the kernel was requested already, i.e. it is compiled."""
+        return self._done
+
+    def __call__(self, *args, **kwargs):
+        return self.result()(*args, **kwargs)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.result(), name)
+
+    def __repr__(self):
+        return "KernelFuture({})".format(self._result if self._done else "pending")
+
+
+# -------------------------------------------- Helper Functions --------------------------------------------------------
+
+
+def _create_asts(function, kwargs):
+    result = function(**kwargs)
+    for ast in result if isinstance(result, tuple) else (result,):
+        if ast.backend == 'c':
+            ast.compile()  # stores the shared library in the object cache
+    return result
+
+
+def _create_lb_ast(kwargs, return_ast):
+    kernel = create_lb_function(**kwargs)
+    return kernel.ast if return_ast else None
+
+
+def _compile(asts):
+    if isinstance(asts, tuple):
+        return tuple(ast.compile() for ast in asts)
+    return asts.compile()
+
+
+def _uses_kernel_cache(kwargs):
+    """True if create_lb_function takes the kernel with these parameters from the kernel cache."""
+    kwargs = dict(kwargs)
+    optimization = dict(kwargs.pop('optimization', {}))
+    if kwargs.pop('ast', None) is not None:
+        return False
+    params, opt_params = update_with_default_parameters(kwargs, optimization)
+    if not opt_params['kernel_cache'] or opt_params['target'] != 'cpu':
+        return False
+    return parameter_hash(params, opt_params) is not None
@@ -0,0 +1,193 @@
+"""Roofline model for generated lattice Boltzmann kernels
+
+Loads, stores and floating point operations per lattice update are counted in the AST of a kernel created with
+:func:`lbmpy.creationfunctions.create_lb_function`. Together with the memory bandwidth of the machine, this gives the
+attainable performance of a memory bound kernel.
+
+Examples:
+
+    Model of a D3Q19 SRT kernel, every pdf is loaded once from the source and stored once to the destination array.
+    The store needs an additional load of the cache line (write allocate):
+
+    >>> from lbmpy.creationfunctions import create_lb_function
+    >>> kernel = create_lb_function(stencil='D3Q19', method='srt', relaxation_rate=1.8)
+    >>> model = KernelPerformanceModel(kernel)
+    >>> model.loads, model.stores, model.bytes_per_lattice_update
+    (19, 19, 456)
+    >>> round(model.predicted_mlups(bandwidth=20e9), 1)
+    43.9
+
+    Instead of configuring the bandwidth, it can be measured with :func:`measure_memory_bandwidth`.
+    A :class:`RooflineReport` compares the prediction to the measured performance of scenarios:
+
+    >>> from lbmpy.lbstep import LatticeBoltzmannStep
+    >>> step = LatticeBoltzmannStep((32, 32, 32), stencil='D3Q19', method='srt', relaxation_rate=1.8)  # doctest: +SKIP
+    >>> report = RooflineReport({'srt': step}, bandwidth=20e9, time_for_benchmark=0.1)  # doctest: +SKIP
+
+    (The output is not given here, since it depends on your machine. The example is skipped in doctests, since
+    it runs the benchmark, see ``test_roofline_report_d3q19`` instead.)
+
+The model covers the stream-collide kernel only, boundary kernels and ghost layer exchange are not included.
+"""
+import time
+
+import numpy as np
+
+from lbmpy.max_domain_size_info import convert_memory_size
+from pystencils.astnodes import LoopOverCoordinate, ResolvedFieldAccess, SympyAssignment
+from pystencils.sympyextensions import count_operations
+
+FLOATING_POINT_OPERATIONS = ('adds', 'muls', 'divs', 'sqrts', 'fast_sqrts', 'fast_inv_sqrts', 'fast_div')
+
+
+class KernelPerformanceModel:
+    """Memory traffic and floating point operations of one lattice update.
+
+    Args:
+        kernel: compiled kernel as returned by ``create_lb_function``, or its AST
+        write_allocate: count an additional load for stores to arrays that the kernel does not read. Stores to arrays
+                        that are read as well, e.g. by in-place streaming kernels, never need it.
+    """
+
+    def __init__(self, kernel, write_allocate=True):
+        ast = getattr(kernel, 'ast', kernel)
+        # vectorized kernels have a loop for the remainder, both are a complete cell update
+        loop_bodies = [loop.body for loop in ast.atoms(LoopOverCoordinate) if loop.is_innermost_loop] or [ast.body]
+
+        reads, writes, self.operations = set(), set(), {}
+        for body in loop_bodies:
+            assignments = body.atoms(SympyAssignment)
+            for a in assignments:
+                reads.update(_access_key(access) for access in a.rhs.atoms(ResolvedFieldAccess))
+                if isinstance(a.lhs, ResolvedFieldAccess):
+                    writes.add(_access_key(a.lhs))
+            operations = count_operations([a.rhs for a in assignments])
+            if sum(operations.values()) > sum(self.operations.values()):
+                self.operations = operations
+
+        fields = {f.name: f for f in ast.fields_accessed}
+        read_fields = {name for name, *_ in reads}
+
+        def size(access_keys):
+            return sum(fields[name].dtype.numpy_dtype.itemsize for name, *_ in access_keys)
+
+        self.loads = len(reads)
+        self.stores = len(writes)
+        self.bytes_loaded = size(reads)
+        self.bytes_stored = size(writes)
+        self.bytes_write_allocated = size(w for w in writes if w[0] not in read_fields) if write_allocate else 0
+
+    @property
+    def bytes_per_lattice_update(self):
+        return self.bytes_loaded + self.bytes_stored + self.bytes_write_allocated
+
+    @property
+    def flops(self):
+        """Floating point operations per lattice update, every operation counts as one."""
+        return sum(self.operations[op] for op in FLOATING_POINT_OPERATIONS)
+
+    @property
+    def arithmetic_intensity(self):
+        """Floating point operations per byte of memory traffic."""
+        return self.flops / self.bytes_per_lattice_update
+
+    def predicted_mlups(self, bandwidth, peak_flops=None):
+        """Attainable million lattice updates per second.
+
+        Args:
+            bandwidth: memory bandwidth in bytes per second
+            peak_flops: peak floating point operations per second, if None the kernel is assumed to be memory bound
+        """
+        lups = bandwidth / self.bytes_per_lattice_update
+        if peak_flops is not None and self.flops > 0:
+            lups = min(lups, peak_flops / self.flops)
+        return lups * 1e-6
+
+    def __str__(self):
+        return "{} loads, {} stores, {} B/LUP, {} FLOP/LUP".format(
+            self.loads, self.stores, self.bytes_per_lattice_update, self.flops)
+
+    def __repr__(self):
+        return self.__str__()
+
+
+def measure_memory_bandwidth(array_size='128 MB', repetitions=5, write_allocate=True):
+    """Memory bandwidth in bytes per second of copying a large array, similar to the STREAM copy benchmark.
+
+    The copy runs in a single thread, for kernels running with OpenMP the bandwidth of all cores should be configured.
+
+    Args:
+        array_size: size of the copied array, should be much larger than the last level cache, see
+                    :func:`lbmpy.max_domain_size_info.convert_memory_size`
+        repetitions: the fastest of these copies is taken
+        write_allocate: count the load of the destination array, as :class:`KernelPerformanceModel` does
+    """
+    src = np.ones(int(convert_memory_size(array_size)) // 8)
+    dst = np.empty_like(src)
+    np.copyto(dst, src)  # first touch
+    fastest = np.inf
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        np.copyto(dst, src)
+        fastest = min(fastest, time.perf_counter() - start)
+    return (3 if write_allocate else 2) * src.nbytes / fastest
+
+
+class RooflineReport:
+    """Compares the predicted performance of scenarios to ``LatticeBoltzmannStep.benchmark()``.
+
+    Args:
+        steps: dict mapping a name to a :class:`lbmpy.lbstep.LatticeBoltzmannStep`, the kernel of ``step.ast`` is
+               modelled. For the 'collide_stream' time step order, this is only the collide kernel.
+        bandwidth: memory bandwidth in bytes per second, measured with :func:`measure_memory_bandwidth` if None
+        peak_flops: peak floating point operations per second of the machine, optional
+        time_for_benchmark: seconds each scenario is benchmarked
+        write_allocate: see :class:`KernelPerformanceModel`
+    """
+
+    def __init__(self, steps, bandwidth=None, peak_flops=None, time_for_benchmark=2, write_allocate=True):
+        if bandwidth is None:
+            bandwidth = measure_memory_bandwidth(write_allocate=write_allocate)
+        self.bandwidth = bandwidth
+        self.peak_flops = peak_flops
+        self.rows = []
+        for name, step in steps.items():
+            model = KernelPerformanceModel(step.ast, write_allocate)
+            predicted = model.predicted_mlups(bandwidth, peak_flops)
+            measured = step.benchmark(time_for_benchmark)
+            self.rows.append({'Name': name, 'B/LUP': model.bytes_per_lattice_update, 'FLOP/LUP': model.flops,
+                              'Predicted': predicted, 'Measured': measured, 'Fraction': measured / predicted})
+
+    def off_roofline(self, threshold=0.7):
+        """Names of the scenarios reaching less than the given fraction of the predicted performance."""
+        return [row['Name'] for row in self.rows if row['Fraction'] < threshold]
+
+    def _build_table(self):
+        header = ['Name', 'B/LUP', 'FLOP/LUP', 'Predicted', 'Measured', 'Fraction']
+
+        def to_str(e):
+            if isinstance(e, float):
+                return format(e, ">10.2f")
+            return format(str(e), ">10")
+
+        return [[to_str(e) for e in header]] + [[to_str(row[e]) for e in header] for row in self.rows]
+
+    def _repr_html_(self):
+        import ipy_table
+        # noinspection PyProtectedMember
+        return ipy_table.make_table(self._build_table())._repr_html_()
+
+    def __str__(self):
+        header, *content = self._build_table()
+        lines = ['|'.join(header)]
+        lines.append('-' * len(lines[0]))
+        lines.extend('|'.join(row) for row in content)
+        lines.append("Predicted and measured in MLUPS, bandwidth {:.1f} GB/s".format(self.bandwidth * 1e-9))
+        return "\n".join(lines)
+
+    def __repr__(self):
+        return self.__str__()
+
+
+def _access_key(access):
+    return (access.field.name, tuple(access.offsets), tuple(access.idx_coordinate_values))
@@ -2,6 +2,7 @@ from collections import defaultdict
 
 import sympy as sp
 
+from lbmpy.phasefield.symbolic_cache import cached_map, symbolic_cache
 from pystencils.fd import Diff, expand_diff_full, expand_diff_linear, functional_derivative
 from pystencils.sympyextensions import multidimensional_sum as multi_sum
 from pystencils.sympyextensions import normalize_product, prod
@@ -227,16 +228,25 @@ def analytic_interface_profile(x, interface_width=interface_width_symbol):
     return (1 + sp.tanh(x / (2 * interface_width))) / 2
 
 
-def chemical_potentials_from_free_energy(free_energy, order_parameters=None):
-    """Computes chemical potentials as functional derivative of free energy."""
+def chemical_potentials_from_free_energy(free_energy, order_parameters=None, processes=1):
+    """Computes chemical potentials as functional derivative of free energy.
+
+    The derivatives are memoized per order parameter, see :mod:`lbmpy.phasefield.symbolic_cache`. With processes > 1
+    the derivatives that are not cached are computed in parallel worker processes.
+    """
     symbols = free_energy.atoms(sp.Symbol)
     if order_parameters is None:
         order_parameters = [s for s in symbols if s.name.startswith(order_parameter_symbol_name)]
         order_parameters.sort(key=lambda e: e.name)
         order_parameters = order_parameters[:-1]
-    constants = [s for s in symbols if s not in order_parameters]
-    return sp.Matrix([expand_diff_linear(functional_derivative(free_energy, op), constants=constants)
-                      for op in order_parameters])
+    constants = sorted((s for s in symbols if s not in order_parameters), key=sp.default_sort_key)
+    return sp.Matrix(cached_map(_chemical_potential, [(free_energy, op, constants) for op in order_parameters],
+                                processes))
+
+
+@symbolic_cache
+def _chemical_potential(free_energy, order_parameter, constants):
+    return expand_diff_linear(functional_derivative(free_energy, order_parameter), constants=constants)
 
 
 def force_from_phi_and_mu(order_parameters, dim, mu=None):
@@ -349,6 +359,7 @@ def pressure_tensor_interface_component_new(free_energy, order_parameters, dim,
     return result
 
 
+@symbolic_cache
 def pressure_tensor_from_free_energy(free_energy, order_parameters, dim, bulk_chemical_potential=None,
                                      include_bulk=True, include_interface=True):
     op = order_parameters
@@ -365,6 +376,7 @@ def pressure_tensor_from_free_energy(free_energy, order_parameters, dim, bulk_ch
     return result
 
 
+@symbolic_cache
 def force_from_pressure_tensor(pressure_tensor, functions=None, pbs=None):
     assert len(pressure_tensor.shape) == 2 and pressure_tensor.shape[0] == pressure_tensor.shape[1]
     dim = pressure_tensor.shape[0]
@@ -1,8 +1,12 @@
 import sympy as sp
 
+from lbmpy.creationfunctions import create_lb_update_rule
+from lbmpy.macroscopic_value_kernels import pdf_initialization_assignments
 from lbmpy.maxwellian_equilibrium import get_weights
 from lbmpy.methods.creationfunctions import create_from_equilibrium
+from lbmpy.parallel_compilation import KernelCreationPool
 from lbmpy.stencils import get_stencil
+from pystencils import AssignmentCollection, Field, TypedSymbol, create_kernel
 from pystencils.sympyextensions import kronecker_delta, multidimensional_sum
 
 
@@ -43,3 +47,148 @@ def cahn_hilliard_lb_method(stencil, mu, relaxation_rate=sp.Symbol("omega"), gam
     rho = sp.Symbol("rho")
     equilibrium[0] = rho - sp.expand(sum(equilibrium[1:]))
     return create_from_equilibrium(stencil, tuple(equilibrium), relaxation_rate, compressible=True)
+
+
+def batched_update_rule(update_rules, fields=(), stacked_fields=()):
+    """Combines the update rules of several LB methods into one, e.g. of the Cahn-Hilliard LBMs of all order parameters.
+
+    The pdfs of all methods are stored in one field with an additional index dimension: the pdfs of the i'th update
+    rule are stored at ``stacked_field(i, ...)``, such that they are updated by a single kernel and exchanged by a
+    single synchronization.
+
+    Args:
+        update_rules: sequence of assignment collections, all reading and writing the pdfs in ``fields``
+        fields: pdf fields of the update rules with one index dimension, e.g. source and destination field
+        stacked_fields: fields replacing ``fields``, with an additional first index dimension for the update rules
+
+    Returns:
+        assignment collection with the assignments of all update rules, the symbols assigned by the i'th update
+        rule are renamed with suffix ``_i``
+    """
+    subexpressions, main_assignments = [], []
+    for i, update_rule in enumerate(update_rules):
+        substitutions = {}
+        for fa in set().union(*(a.atoms(Field.Access) for a in update_rule.all_assignments)):
+            if fa.field in fields:
+                stacked_field = stacked_fields[fields.index(fa.field)]
+                substitutions[fa] = stacked_field[fa.offsets](i, *fa.index)
+        for a in update_rule.all_assignments:
+            if not isinstance(a.lhs, Field.Access):
+                substitutions[a.lhs] = _renamed_symbol(a.lhs, i)
+        update_rule = update_rule.new_with_substitutions(substitutions, substitute_on_lhs=True)
+        subexpressions += update_rule.subexpressions
+        main_assignments += update_rule.main_assignments
+    return AssignmentCollection(main_assignments, subexpressions)
+
+
+class CahnHilliardLbmStep:
+    """Cahn-Hilliard LBMs of several order parameters, with the pdfs of all of them stored in one array.
+
+    All order parameters are updated by a single stream-pull-collide kernel, which writes the new order parameters
+    into the phi field. No boundary conditions are applied to the Cahn-Hilliard pdfs.
+
+    Like in :class:`lbmpy.lbstep.LatticeBoltzmannStep`, the pdfs are initialized on the CPU and transferred to and
+    from the GPU in :meth:`pre_run` and :meth:`post_run`.
+
+    Args:
+        data_handling: data handling containing phi, mu and velocity field
+        phi_field_name: name of the order parameter field
+        mu_field_name: name of the chemical potential field
+        velocity_field_name: name of the velocity field, input of the equilibrium
+        order_parameter_indices: indices into phi and mu field of the order parameters to solve for
+        stencil: stencil of the Cahn-Hilliard LBMs
+        relaxation_rates: relaxation rate per order parameter index
+        gammas: mobility parameter gamma per order parameter index
+        name: prefix of the pdf arrays
+        optimization: optimization dict, only 'target' and 'openmp' are used
+        compile_processes: number of worker processes creating the kernels, or a
+                           :class:`lbmpy.parallel_compilation.KernelCreationPool` shared with other steps
+    """
+
+    def __init__(self, data_handling, phi_field_name, mu_field_name, velocity_field_name, order_parameter_indices,
+                 stencil, relaxation_rates=1.0, gammas=1, name='ch_lbm', optimization=None, compile_processes=1):
+        if optimization is None:
+            optimization = {}
+        target = optimization.get('target', 'cpu')
+        openmp = optimization.get('openmp', False)
+        if isinstance(stencil, str):
+            stencil = get_stencil(stencil)
+
+        dh = data_handling
+        self.data_handling = dh
+        self.order_parameter_indices = tuple(order_parameter_indices)
+        if not hasattr(relaxation_rates, '__len__'):
+            relaxation_rates = [relaxation_rates] * (max(self.order_parameter_indices) + 1)
+        if not hasattr(gammas, '__len__'):
+            gammas = [gammas] * (max(self.order_parameter_indices) + 1)
+
+        phi_field = dh.fields[phi_field_name]
+        mu_field = dh.fields[mu_field_name]
+        vel_field = dh.fields[velocity_field_name]
+        self.methods = [cahn_hilliard_lb_method(stencil, mu_field(i), relaxation_rate=relaxation_rates[i],
+                                                gamma=gammas[i])
+                        for i in self.order_parameter_indices]
+
+        values_per_cell = (len(self.methods), len(stencil))
+        gpu = target == 'gpu'
+        self.pdf_array_name = name + "_pdfSrc"
+        self.tmp_array_name = name + "_pdfTmp"
+        # structure of arrays layout, the layout strings 'fzyx' and 'zyxf' support only one index dimension in 3D
+        src = dh.add_array(self.pdf_array_name, values_per_cell=values_per_cell, layout='reverse_numpy', gpu=gpu)
+        dst = dh.add_array(self.tmp_array_name, values_per_cell=values_per_cell, layout='reverse_numpy', gpu=gpu,
+                           cpu=not gpu)
+
+        pdfs, tmp_pdfs = Field.create_generic('pdfs', dh.dim, index_shape=(len(stencil),)), \
+            Field.create_generic('tmp_pdfs', dh.dim, index_shape=(len(stencil),))
+        pdf_fields = {'symbolic_field': pdfs, 'symbolic_temporary_field': tmp_pdfs}
+        update_rules = [create_lb_update_rule(lb_method=method, velocity_input=vel_field,
+                                              output={'density': phi_field(i)}, optimization=pdf_fields)
+                        for i, method in zip(self.order_parameter_indices, self.methods)]
+        self.update_rule = batched_update_rule(update_rules, [pdfs, tmp_pdfs], [src, dst])
+
+        setter_eqs = [pdf_initialization_assignments(method, phi_field.center(i), vel_field.center_vector,
+                                                     [src.center(k, d) for d in range(len(stencil))])
+                      for k, (i, method) in enumerate(zip(self.order_parameter_indices, self.methods))]
+
+        pool = compile_processes
+        if not isinstance(pool, KernelCreationPool):
+            pool = KernelCreationPool(compile_processes)
+        self.kernel = pool.submit(_create_kernel, assignments=self.update_rule, target=target, openmp=openmp,
+                                  ghost_layers=dh.ghost_layers_of_field(self.pdf_array_name))
+        # the setter runs on the CPU arrays, which are set by the user, see pre_run
+        self.setter_kernel = pool.submit(_create_kernel, assignments=batched_update_rule(setter_eqs), target='cpu',
+                                         openmp=openmp)
+        if pool is not compile_processes:
+            pool.shutdown(wait=False)
+
+        stencil_name = "D%dQ%d" % (dh.dim, len(stencil))
+        self.sync = dh.synchronization_function([self.pdf_array_name], stencil_name, target)
+        self.gpu = gpu
+
+    def time_step(self, **kwargs):
+        self.sync()
+        self.data_handling.run_kernel(self.kernel, **kwargs)
+        self.data_handling.swap(self.pdf_array_name, self.tmp_array_name, self.gpu)
+
+    def set_pdf_fields_from_macroscopic_values(self):
+        self.data_handling.run_kernel(self.setter_kernel)
+
+    def pre_run(self):
+        if self.gpu:
+            self.data_handling.to_gpu(self.pdf_array_name)
+
+    def post_run(self):
+        if self.gpu:
+            self.data_handling.to_cpu(self.pdf_array_name)
+
+
+# ---- Helper Functions ----
+
+
+def _renamed_symbol(symbol, i):
+    name = "%s_%d" % (symbol.name, i)
+    return TypedSymbol(name, symbol.dtype) if isinstance(symbol, TypedSymbol) else sp.Symbol(name)
+
+
+def _create_kernel(assignments, target, openmp, ghost_layers=None):
+    return create_kernel(assignments, target=target, cpu_openmp=openmp, ghost_layers=ghost_layers)
@@ -4,21 +4,24 @@ from lbmpy.phasefield.analytical import (
     chemical_potentials_from_free_energy, force_from_phi_and_mu, force_from_pressure_tensor,
     pressure_tensor_bulk_sqrt_term, pressure_tensor_from_free_energy, substitute_laplacian_by_sum,
     symmetric_tensor_linearization)
-from pystencils import Assignment
+from lbmpy.phasefield.symbolic_cache import symbolic_cache
+from pystencils import Assignment, Field
 from pystencils.fd import Discretization2ndOrder, discretize_spatial
+from pystencils.sympyextensions import fast_subs
 
 # ---------------------------------- Kernels to compute force ----------------------------------------------------------
 
 
-def mu_kernel(free_energy, order_parameters, phi_field, mu_field, dx=1, discretization='standard'):
-    """Reads from order parameter (phi) field and updates chemical potentials"""
+def mu_kernel(free_energy, order_parameters, phi_field, mu_field, dx=1, discretization='standard', processes=1):
+    """Reads from order parameter (phi) field and updates chemical potentials.
+
+    With processes > 1 the chemical potentials are derived in parallel worker processes, see
+    :func:`lbmpy.phasefield.analytical.chemical_potentials_from_free_energy`.
+    """
     assert phi_field.spatial_dimensions == mu_field.spatial_dimensions
-    dim = phi_field.spatial_dimensions
-    chemical_potential = chemical_potentials_from_free_energy(free_energy, order_parameters)
-    chemical_potential = substitute_laplacian_by_sum(chemical_potential, dim)
-    chemical_potential = chemical_potential.subs({op: phi_field(i) for i, op in enumerate(order_parameters)})
-    return [Assignment(mu_field(i), discretize_spatial(mu_i, dx, discretization))
-            for i, mu_i in enumerate(chemical_potential)]
+    chemical_potential = chemical_potentials_from_free_energy(free_energy, order_parameters, processes=processes)
+    return _discretized_chemical_potentials(chemical_potential, order_parameters, phi_field, mu_field, dx,
+                                            discretization)
 
 
 def force_kernel_using_mu(force_field, phi_field, mu_field, dx=1, discretization='standard'):
@@ -29,6 +32,7 @@ def force_kernel_using_mu(force_field, phi_field, mu_field, dx=1, discretization
                        discretize_spatial(f_i, dx, discretization)).expand() for i, f_i in enumerate(force)]
 
 
+@symbolic_cache
 def pressure_tensor_kernel(free_energy, order_parameters, phi_field, pressure_tensor_field,
                            dx=1, discretization='standard', bulk_chemical_potential=None):
     dim = phi_field.spatial_dimensions
@@ -67,6 +71,7 @@ def pressure_tensor_kernel_pbs(free_energy, order_parameters,
     return eqs
 
 
+@symbolic_cache
 def force_kernel_using_pressure_tensor(force_field, pressure_tensor_field, extra_force=None,
                                        pbs=None, dx=1, discretization='standard'):
     dim = force_field.spatial_dimensions
@@ -80,6 +85,35 @@ def force_kernel_using_pressure_tensor(force_field, pressure_tensor_field, extra
             for i, f_i in enumerate(f)]
 
 
+def inline_field_equations(eqs, field_eqs):
+    """Replaces reads of the fields written by field_eqs by the right hand sides of field_eqs, shifted to the offset
+    of the read.
+
+    This computes e.g. the force of :func:`force_kernel_using_pressure_tensor` directly from the order parameters,
+    by inlining the equations of :func:`pressure_tensor_kernel`, without storing the pressure tensor in a field.
+    The results are the same, but the pressure tensor is computed once for every read, and the returned equations
+    read the fields of field_eqs at the sum of both offsets, which needs more ghost layers.
+
+    Args:
+        eqs: list of assignments reading the fields written by field_eqs
+        field_eqs: list of assignments to center accesses of fields
+
+    Returns:
+        list of assignments, the shifted right hand sides are assigned to subexpression symbols first
+    """
+    field_rhs = {eq.lhs: eq.rhs for eq in field_eqs}
+    inlined_fields = {fa.field for fa in field_rhs}
+    reads = sorted((fa for fa in set().union(*(eq.rhs.atoms(Field.Access) for eq in eqs))
+                    if fa.field in inlined_fields), key=str)
+    substitutions = {fa: sp.Symbol("%s_%d" % (fa.field.name, i)) for i, fa in enumerate(reads)}
+    subexpressions = []
+    for fa, symbol in substitutions.items():
+        rhs = field_rhs[fa.field(*fa.index)]
+        shifted_rhs = fast_subs(rhs, {a: a.get_shifted(*fa.offsets) for a in rhs.atoms(Field.Access)})
+        subexpressions.append(Assignment(symbol, shifted_rhs))
+    return subexpressions + [Assignment(eq.lhs, fast_subs(eq.rhs, substitutions)) for eq in eqs]
+
+
 # ---------------------------------- Cahn Hilliard with finite differences ---------------------------------------------
 
 
@@ -127,3 +161,14 @@ class CahnHilliardFDStep:
 
     def post_run(self):
         pass
+
+
+# -------------------------------------------- Helper Functions --------------------------------------------------------
+
+
+@symbolic_cache
+def _discretized_chemical_potentials(chemical_potential, order_parameters, phi_field, mu_field, dx, discretization):
+    chemical_potential = substitute_laplacian_by_sum(chemical_potential, phi_field.spatial_dimensions)
+    chemical_potential = chemical_potential.subs({op: phi_field(i) for i, op in enumerate(order_parameters)})
+    return [Assignment(mu_field(i), discretize_spatial(mu_i, dx, discretization))
+            for i, mu_i in enumerate(chemical_potential)]
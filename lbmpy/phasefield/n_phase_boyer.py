@@ -8,6 +8,7 @@ import sympy as sp
 
 import pystencils.fd as fd
 from lbmpy.phasefield.analytical import chemical_potentials_from_free_energy
+from lbmpy.phasefield.symbolic_cache import symbolic_cache
 from pystencils.cache import memorycache
 from pystencils.fd import Diff
 from pystencils.sympyextensions import prod
@@ -315,6 +316,7 @@ def simplify_zero_conditions(expression):
     return sp.Piecewise(*result)
 
 
+@symbolic_cache
 def chemical_potential_n_phase_boyer(order_parameters, interface_width, surface_tensions, correction_factor,
                                      zero_threshold=0, assume_nonnegative=False):
     n = len(order_parameters)
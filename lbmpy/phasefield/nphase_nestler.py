@@ -4,10 +4,10 @@ import sympy as sp
 from lbmpy.creationfunctions import create_lb_update_rule
 from lbmpy.macroscopic_value_kernels import pdf_initialization_assignments
 from lbmpy.phasefield.analytical import chemical_potentials_from_free_energy, force_from_phi_and_mu
-from lbmpy.phasefield.cahn_hilliard_lbm import cahn_hilliard_lb_method
+from lbmpy.phasefield.cahn_hilliard_lbm import batched_update_rule, cahn_hilliard_lb_method
 from lbmpy.phasefield.simplex_projection import simplex_projection_2d  # NOQA
 from lbmpy.stencils import get_stencil
-from pystencils import Assignment, create_data_handling, create_kernel
+from pystencils import Assignment, Field, create_data_handling, create_kernel
 from pystencils.fd import Diff, discretize_spatial, expand_diff_full
 from pystencils.fd.derivation import FiniteDifferenceStencilDerivation
 
@@ -76,14 +76,12 @@ def create_model(domain_size, num_phases, coeff_a, coeff_epsilon, gabd, alpha=1,
     force = dh.add_array("F", values_per_cell=dh.dim)
     u = dh.add_array("u", values_per_cell=dh.dim)
 
-    # Distribution functions for each order parameter
-    pdf_field = []
-    pdf_dst_field = []
-    for i in range(num_phases):
-        pdf_field_local = dh.add_array("pdf_ch_%d" % i, values_per_cell=9)  # 9 for D2Q9
-        pdf_dst_field_local = dh.add_array("pdfs_ch_%d_dst" % i, values_per_cell=9)
-        pdf_field.append(pdf_field_local)
-        pdf_dst_field.append(pdf_dst_field_local)
+    # Distribution functions of all order parameters in one array, 9 for D2Q9
+    pdf_field = dh.add_array("pdfs_ch", values_per_cell=(num_phases, 9))
+    pdf_dst_field = dh.add_array("pdfs_ch_dst", values_per_cell=(num_phases, 9))
+    # fields of a single order parameter, the update rules of all order parameters are batched into one kernel
+    ch_src, ch_dst = Field.create_generic("ch_src", dh.dim, index_shape=(9,)), \
+        Field.create_generic("ch_dst", dh.dim, index_shape=(9,))
 
     # Distribution functions for the hydrodynamics
     pdf_hydro_field = dh.add_array("pdfs", values_per_cell=9)
@@ -107,50 +105,35 @@ def create_model(domain_size, num_phases, coeff_a, coeff_epsilon, gabd, alpha=1,
     force_assignments = [Assignment(force(i), force_rhs[i]) for i in range(dh.dim)]
     force_kernel = create_kernel(force_assignments).compile()
 
-    ch_collide_kernels = []
-    ch_methods = []
-    for i in range(num_phases):
-        ch_method = cahn_hilliard_lb_method(get_stencil("D2Q9"), mu(i),
-                                            relaxation_rate=1.0, gamma=1.0)
-        ch_methods.append(ch_method)
-        ch_update_rule = create_lb_update_rule(lb_method=ch_method,
-                                               kernel_type='collide_only',
-                                               density_input=c(i),
-                                               velocity_input=u.center_vector,
-                                               compressible=True,
-                                               optimization={"symbolic_field": pdf_field[i]})
-        ch_assign = ch_update_rule.all_assignments
-        ch_kernel = create_kernel(ch_assign).compile()
-        ch_collide_kernels.append(ch_kernel)
-
-    ch_stream_kernels = []
-    for i in range(num_phases):
-        ch_method = ch_methods[i]
-
-        ch_update_rule = create_lb_update_rule(lb_method=ch_method,
-                                               kernel_type='stream_pull_only',
-                                               temporary_field_name=pdf_dst_field[i].name,
-                                               optimization={"symbolic_field": pdf_field[i]})
-        ch_assign = ch_update_rule.all_assignments
-        ch_kernel = create_kernel(ch_assign).compile()
-        ch_stream_kernels.append(ch_kernel)
-
-    # Defining the initialisation kernels for the C-H pdfs
-    init_kernels = []
-    for i in range(num_phases):
-        ch_method = ch_methods[i]
-        init_assign = pdf_initialization_assignments(lb_method=ch_method,
-                                                     density=c_vec[i], velocity=(0, 0), pdfs=pdf_field[i].center_vector)
-        init_kernel = create_kernel(init_assign).compile()
-        init_kernels.append(init_kernel)
-
-    getter_kernels = []
-    for i in range(num_phases):
-        cqc = ch_methods[i].conserved_quantity_computation
-        output_assign = cqc.output_equations_from_pdfs(pdf_field[i].center_vector,
-                                                       {'density': c(i)})
-        getter_kernel = create_kernel(output_assign).compile()
-        getter_kernels.append(getter_kernel)
+    ch_methods = [cahn_hilliard_lb_method(get_stencil("D2Q9"), mu(i), relaxation_rate=1.0, gamma=1.0)
+                  for i in range(num_phases)]
+    ch_collide_rules = [create_lb_update_rule(lb_method=ch_method,
+                                              kernel_type='collide_only',
+                                              density_input=c(i),
+                                              velocity_input=u.center_vector,
+                                              compressible=True,
+                                              optimization={"symbolic_field": ch_src})
+                        for i, ch_method in enumerate(ch_methods)]
+    ch_collide_kernel = create_kernel(batched_update_rule(ch_collide_rules, [ch_src], [pdf_field])).compile()
+
+    ch_stream_rules = [create_lb_update_rule(lb_method=ch_method,
+                                             kernel_type='stream_pull_only',
+                                             optimization={"symbolic_field": ch_src,
+                                                           "symbolic_temporary_field": ch_dst})
+                       for ch_method in ch_methods]
+    ch_stream_kernel = create_kernel(batched_update_rule(ch_stream_rules, [ch_src, ch_dst],
+                                                         [pdf_field, pdf_dst_field])).compile()
+
+    # Defining the initialisation kernel for the C-H pdfs
+    init_assignments = [pdf_initialization_assignments(lb_method=ch_method, density=c_vec[i], velocity=(0, 0),
+                                                       pdfs=ch_src.center_vector)
+                        for i, ch_method in enumerate(ch_methods)]
+    init_kernel = create_kernel(batched_update_rule(init_assignments, [ch_src], [pdf_field])).compile()
+
+    output_assignments = [ch_method.conserved_quantity_computation.output_equations_from_pdfs(
+        ch_src.center_vector, {'density': c(i)}) for i, ch_method in enumerate(ch_methods)]
+    getter_kernel = create_kernel(batched_update_rule(output_assignments, [ch_src], [pdf_field])).compile()
+    cqc = ch_methods[-1].conserved_quantity_computation
 
     collide_assign = create_lb_update_rule(kernel_type='collide_only',
                                            relaxation_rate=1.0,
@@ -186,14 +169,10 @@ def create_model(domain_size, num_phases, coeff_a, coeff_epsilon, gabd, alpha=1,
     dh.cpu_arrays[force.name].fill(0)
 
     def init():
-        for k in init_kernels:
-            dh.run_kernel(k)
+        dh.run_kernel(init_kernel)
         dh.run_kernel(init_hydro_kernel)
 
-    pdf_sync_fns = []
-    for i in range(num_phases):
-        sync_fn = dh.synchronization_function([pdf_field[i].name])
-        pdf_sync_fns.append(sync_fn)
+    pdf_sync_fn = dh.synchronization_function([pdf_field.name])
     hydro_sync_fn = dh.synchronization_function([pdf_hydro_field.name])
     c_sync_fn = dh.synchronization_function([c.name])
     mu_sync = dh.synchronization_function([mu.name])
@@ -214,12 +193,11 @@ def create_model(domain_size, num_phases, coeff_a, coeff_epsilon, gabd, alpha=1,
             dh.run_kernel(getter_hydro_kernel)
 
             # Cahn-Hilliard LBs
-            for i in range(num_phases):
-                dh.run_kernel(ch_collide_kernels[i])
-                pdf_sync_fns[i]()
-                dh.run_kernel(ch_stream_kernels[i])
-                dh.swap(pdf_field[i].name, pdf_dst_field[i].name)
-                dh.run_kernel(getter_kernels[i])
+            dh.run_kernel(ch_collide_kernel)
+            pdf_sync_fn()
+            dh.run_kernel(ch_stream_kernel)
+            dh.swap(pdf_field.name, pdf_dst_field.name)
+            dh.run_kernel(getter_kernel)
             if simplex_projection:
                 simplex_projection_2d(dh.cpu_arrays[c.name])
         return dh.cpu_arrays[c.name][1:-1, 1:-1, :]
@@ -1,19 +1,24 @@
+import inspect
 from types import MappingProxyType
 
 import numpy as np
 import sympy as sp
 
+from lbmpy.creationfunctions import create_lb_collision_rule
 from lbmpy.lbstep import LatticeBoltzmannStep
+from lbmpy.parallel_compilation import KernelCreationPool
 from lbmpy.phasefield.analytical import (
     chemical_potentials_from_free_energy, symmetric_tensor_linearization)
-from lbmpy.phasefield.cahn_hilliard_lbm import cahn_hilliard_lb_method
+from lbmpy.phasefield.cahn_hilliard_lbm import CahnHilliardLbmStep, cahn_hilliard_lb_method
 from lbmpy.phasefield.kerneleqs import (
-    CahnHilliardFDStep, force_kernel_using_pressure_tensor, mu_kernel, pressure_tensor_kernel)
-from pystencils import create_data_handling, create_kernel
+    CahnHilliardFDStep, force_kernel_using_pressure_tensor, inline_field_equations, mu_kernel,
+    pressure_tensor_kernel)
+from pystencils import Assignment, Field, TypedSymbol, create_data_handling, create_kernel
 from pystencils.boundaries.boundaryhandling import FlagInterface
 from pystencils.boundaries.inkernel import add_neumann_boundary
 from pystencils.simp import sympy_cse_on_assignment_list
 from pystencils.slicing import SlicedGetter, make_slice
+from pystencils.sympyextensions import fast_subs
 
 
 class PhaseFieldStep:
@@ -31,15 +36,50 @@ class PhaseFieldStep:
                  concentration_to_order_parameters=None,
                  order_parameters_to_concentrations=None,
                  homogeneous_neumann_boundaries=False,
-                 discretization='standard'):
+                 discretization='standard',
+                 compile_processes=1,
+                 fuse_kernels=False,
+                 store_pressure_tensor=True):
+        """
+        Args:
+            compile_processes: number of worker processes creating the kernels, or a
+                               :class:`lbmpy.parallel_compilation.KernelCreationPool` shared with other steps
+            fuse_kernels: compute the force from the pressure tensor in the collision kernel of the hydrodynamic
+                          LBM instead of a separate kernel, and update all Cahn-Hilliard LBMs in a single kernel,
+                          see :class:`lbmpy.phasefield.cahn_hilliard_lbm.CahnHilliardLbmStep`. This saves one sweep
+                          over the domain per order parameter, and writing and re-reading the force field. Results
+                          are the same as without fusion, up to rounding. If ``run_hydro_lbm`` is set to False,
+                          the force is computed by a separate kernel.
+            store_pressure_tensor: compute the pressure tensor in a separate kernel and store it in a field, from
+                                   which the force is computed. If False, the force kernel computes the pressure
+                                   tensor of the neighbor cells itself, see
+                                   :func:`lbmpy.phasefield.kerneleqs.inline_field_equations`. This saves the
+                                   pressure tensor field and its ghost layer exchange, but computes the pressure
+                                   tensor several times per cell and needs two ghost layers: the created data
+                                   handling has two, a passed data handling needs at least two. Boundaries are
+                                   set with the same slices as for a single ghost layer, e.g. walls at the domain
+                                   border with ``slice_from_direction('S', dim)``, see
+                                   :meth:`lbmpy.boundaries.boundaryhandling.LatticeBoltzmannBoundaryHandling.set_boundary`.
+        """
 
         if optimization is None:
             optimization = {'openmp': False, 'target': 'cpu'}
         openmp = optimization.get('openmp', False)
         target = optimization.get('target', 'cpu')
 
+        # the force computed directly from φ reads φ of next-to-nearest neighbors
+        ghost_layers = 1 if store_pressure_tensor else 2
         if data_handling is None:
-            data_handling = create_data_handling(domain_size, periodicity=True, parallel=False)
+            data_handling = create_data_handling(domain_size, periodicity=True, parallel=False,
+                                                 default_ghost_layers=ghost_layers)
+        elif data_handling.default_ghost_layers < ghost_layers:
+            raise ValueError("Computing the force without storing the pressure tensor needs a data handling with "
+                             "at least %d ghost layers" % (ghost_layers,))
+
+        # all kernels are created by one pool and compiled when first used, see LatticeBoltzmannStep
+        pool = compile_processes
+        if not isinstance(pool, KernelCreationPool):
+            pool = KernelCreationPool(compile_processes)
 
         self.free_energy = free_energy
 
@@ -54,7 +94,8 @@ class PhaseFieldStep:
             if self.order_parameters_to_concentrations is None:
                 self.order_parameters_to_concentrations = lambda p: np.tensordot(p, op_transformation_inv, axes=axes)
 
-        self.chemical_potentials = chemical_potentials_from_free_energy(free_energy, order_parameters)
+        self.chemical_potentials = chemical_potentials_from_free_energy(free_energy, order_parameters,
+                                                                        processes=pool.processes)
 
         # ------------------ Adding arrays ---------------------
         gpu = target == 'gpu'
@@ -77,8 +118,12 @@ class PhaseFieldStep:
         self.mu_field = dh.add_array(self.mu_field_name, values_per_cell=phi_size, gpu=gpu, latex_name="μ")
         self.vel_field = dh.add_array(self.vel_field_name, values_per_cell=data_handling.dim, gpu=gpu, latex_name="u")
         self.force_field = dh.add_array(self.force_field_name, values_per_cell=dh.dim, gpu=gpu, latex_name="F")
-        self.pressure_tensor_field = data_handling.add_array(self.pressure_tensor_field_name, gpu=gpu,
-                                                             values_per_cell=pressure_tensor_size, latex_name='P')
+        if store_pressure_tensor:
+            self.pressure_tensor_field = data_handling.add_array(self.pressure_tensor_field_name, gpu=gpu,
+                                                                 values_per_cell=pressure_tensor_size, latex_name='P')
+        else:
+            self.pressure_tensor_field = Field.create_generic(self.pressure_tensor_field_name, dh.dim,
+                                                              index_shape=(pressure_tensor_size,))
         self.flag_interface = FlagInterface(data_handling, 'flags')
 
         # ------------------ Creating kernels ------------------
@@ -87,8 +132,7 @@ class PhaseFieldStep:
 
         if homogeneous_neumann_boundaries:
             def apply_neumann_boundaries(eqs):
-                fields = [data_handling.fields[self.phi_field_name],
-                          data_handling.fields[self.pressure_tensor_field_name]]
+                fields = [data_handling.fields[self.phi_field_name], self.pressure_tensor_field]
                 flag_field = data_handling.fields[self.flag_interface.flag_field_name]
                 return add_neumann_boundary(eqs, fields, flag_field, "neumann_flag", inverse_flag=False)
         else:
@@ -97,15 +141,18 @@ class PhaseFieldStep:
 
         # μ and pressure tensor update
         self.phi_sync = data_handling.synchronization_function([self.phi_field_name], target=target)
-        self.mu_eqs = mu_kernel(F, phi, self.phi_field, self.mu_field, dx)
+        self.mu_eqs = mu_kernel(F, phi, self.phi_field, self.mu_field, dx, processes=pool.processes)
 
         self.pressure_tensor_eqs = pressure_tensor_kernel(self.free_energy, order_parameters,
                                                           self.phi_field, self.pressure_tensor_field, dx=dx,
                                                           discretization=discretization)
-        mu_and_pressure_tensor_eqs = self.mu_eqs + self.pressure_tensor_eqs
+        if store_pressure_tensor:
+            mu_and_pressure_tensor_eqs = self.mu_eqs + self.pressure_tensor_eqs
+        else:
+            mu_and_pressure_tensor_eqs = self.mu_eqs
         mu_and_pressure_tensor_eqs = apply_neumann_boundaries(mu_and_pressure_tensor_eqs)
-        self.mu_and_pressure_tensor_kernel = create_kernel(sympy_cse_on_assignment_list(mu_and_pressure_tensor_eqs),
-                                                           target=target, cpu_openmp=openmp).compile()
+        self.mu_and_pressure_tensor_kernel = pool.submit(_create_kernel_ast, eqs=mu_and_pressure_tensor_eqs,
+                                                         cse=True, target=target, openmp=openmp)
 
         # F Kernel
         extra_force = sp.Matrix([0] * self.data_handling.dim)
@@ -114,10 +161,18 @@ class PhaseFieldStep:
                 extra_force += sp.Matrix([f_i * self.phi_field(order_parameter_idx) for f_i in force])
         self.force_eqs = force_kernel_using_pressure_tensor(self.force_field, self.pressure_tensor_field, dx=dx,
                                                             extra_force=extra_force, discretization=discretization)
-        self.force_from_pressure_tensor_kernel = create_kernel(apply_neumann_boundaries(self.force_eqs),
-                                                               target=target, cpu_openmp=openmp).compile()
-        self.pressure_tensor_sync = data_handling.synchronization_function([self.pressure_tensor_field_name],
-                                                                           target=target)
+        force_eqs = apply_neumann_boundaries(self.force_eqs)
+        if not store_pressure_tensor:
+            force_eqs = inline_field_equations(force_eqs, apply_neumann_boundaries(self.pressure_tensor_eqs))
+        # with fused kernels this kernel is only used when the hydrodynamic LBM is disabled
+        self.fuse_kernels = fuse_kernels
+        self.force_from_pressure_tensor_kernel = pool.submit(_create_kernel_ast, eqs=force_eqs, target=target,
+                                                             openmp=openmp, cse=not store_pressure_tensor)
+        if store_pressure_tensor:
+            self.pressure_tensor_sync = data_handling.synchronization_function([self.pressure_tensor_field_name],
+                                                                               target=target)
+        else:
+            self.pressure_tensor_sync = None
 
         hydro_lbm_parameters = hydro_lbm_parameters.copy()
         # Hydrodynamic LBM
@@ -132,12 +187,23 @@ class PhaseFieldStep:
         else:
             hydro_lbm_parameters['optimization'].update(optimization)
 
+        if fuse_kernels:
+            method_parameters = {key: value for key, value in hydro_lbm_parameters.items()
+                                 if key not in inspect.signature(LatticeBoltzmannStep).parameters}
+            method_parameters.setdefault('stencil', 'D2Q9' if data_handling.dim == 2 else 'D3Q27')
+            collision_rule = create_lb_collision_rule(relaxation_rate=hydro_dynamic_relaxation_rate,
+                                                      force=self.force_field,
+                                                      optimization=hydro_lbm_parameters['optimization'],
+                                                      **method_parameters)
+            hydro_lbm_parameters['collision_rule'] = _with_force_from_equations(collision_rule, self.force_field,
+                                                                                force_eqs)
+
         self.hydro_lbm_step = LatticeBoltzmannStep(data_handling=data_handling, name=name + '_hydroLBM',
                                                    relaxation_rate=hydro_dynamic_relaxation_rate,
                                                    compute_velocity_in_every_step=True, force=self.force_field,
                                                    velocity_data_name=self.vel_field_name, kernel_params=kernel_params,
                                                    flag_interface=self.flag_interface,
-                                                   time_step_order='collide_stream',
+                                                   time_step_order='collide_stream', compile_processes=pool,
                                                    **hydro_lbm_parameters)
 
         # Cahn-Hilliard LBMs
@@ -157,6 +223,15 @@ class PhaseFieldStep:
                                          self.vel_field_name, target=target, dx=dx, dt=dt, mobilities=1,
                                          equation_modifier=apply_neumann_boundaries)
             self.cahn_hilliard_steps.append(ch_step)
+        elif fuse_kernels:
+            ch_step = CahnHilliardLbmStep(data_handling, self.phi_field_name, self.mu_field_name,
+                                          self.vel_field_name,
+                                          [i for i, op in enumerate(order_parameters) if op != density_order_parameter],
+                                          stencil=self.hydro_lbm_step.method.stencil,
+                                          relaxation_rates=cahn_hilliard_relaxation_rates,
+                                          gammas=cahn_hilliard_gammas, name=name + "_chLbm",
+                                          optimization=optimization, compile_processes=pool)
+            self.cahn_hilliard_steps.append(ch_step)
         else:
             for i, op in enumerate(order_parameters):
                 if op == density_order_parameter:
@@ -173,9 +248,12 @@ class PhaseFieldStep:
                                                density_data_index=i,
                                                flag_interface=self.hydro_lbm_step.boundary_handling.flag_interface,
                                                name=name + "_chLbm_%d" % (i,),
-                                               optimization=optimization)
+                                               optimization=optimization, compile_processes=pool)
                 self.cahn_hilliard_steps.append(ch_step)
 
+        if pool is not compile_processes:
+            pool.shutdown(wait=False)
+
         self._vtk_writer = None
         self.run_hydro_lbm = True
         self.density_order_parameter = density_order_parameter
@@ -242,8 +320,12 @@ class PhaseFieldStep:
 
         self.phi_sync()
         self.data_handling.run_kernel(self.mu_and_pressure_tensor_kernel, neumann_flag=neumann_flag)
-        self.pressure_tensor_sync()
-        self.data_handling.run_kernel(self.force_from_pressure_tensor_kernel, neumann_flag=neumann_flag)
+        if self.pressure_tensor_sync is not None:
+            self.pressure_tensor_sync()
+        if self.fuse_kernels and self.run_hydro_lbm:
+            self.hydro_lbm_step.kernel_params['neumann_flag'] = neumann_flag
+        else:
+            self.data_handling.run_kernel(self.force_from_pressure_tensor_kernel, neumann_flag=neumann_flag)
 
         if self.run_hydro_lbm:
             self.hydro_lbm_step.time_step()
@@ -334,3 +416,29 @@ class PhaseFieldStep:
     @property
     def force(self):
         return SlicedGetter(self.force_slice)
+
+
+def _create_kernel_ast(eqs, target, openmp, cse=False):
+    if cse:
+        eqs = sympy_cse_on_assignment_list(eqs)
+    return create_kernel(eqs, target=target, cpu_openmp=openmp)
+
+
+def _with_force_from_equations(collision_rule, force_field, force_eqs):
+    """Computes the force in the collision rule from the given equations, and writes it to the force field.
+
+    The field reads of the force equations are assigned to typed symbols first, because in-place collision kernels
+    replace field reads by untyped symbols, which breaks bit operations on flag fields.
+    """
+    field_reads = sorted(set().union(*(eq.rhs.atoms(Field.Access) for eq in force_eqs)), key=str)
+    read_symbols = {fa: TypedSymbol("force_read_%d" % i, fa.field.dtype) for i, fa in enumerate(field_reads)}
+    force_eqs = [Assignment(eq.lhs, fast_subs(eq.rhs, read_symbols)) for eq in force_eqs]
+    force_rhs = {eq.lhs: eq.rhs for eq in force_eqs if isinstance(eq.lhs, Field.Access)}
+    force_symbols = sp.symbols("force_:%d" % len(force_rhs))
+    collision_rule = collision_rule.new_with_substitutions({force_field(i): s for i, s in enumerate(force_symbols)})
+    subexpressions = [Assignment(s, fa) for fa, s in read_symbols.items()]
+    subexpressions += [eq for eq in force_eqs if not isinstance(eq.lhs, Field.Access)]
+    subexpressions += [Assignment(s, force_rhs[force_field(i)]) for i, s in enumerate(force_symbols)]
+    main_assignments = [Assignment(force_field(i), s) for i, s in enumerate(force_symbols)]
+    return collision_rule.copy(collision_rule.main_assignments + main_assignments,
+                               subexpressions + collision_rule.subexpressions)
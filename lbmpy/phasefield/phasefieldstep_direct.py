@@ -1,12 +1,15 @@
+import warnings
+
 import numpy as np
 
-from lbmpy.creationfunctions import create_lb_function
+from lbmpy.creationfunctions import create_lb_function, create_lb_update_rule
 from lbmpy.macroscopic_value_kernels import pdf_initialization_assignments
 from lbmpy.phasefield.analytical import force_from_phi_and_mu
-from lbmpy.phasefield.cahn_hilliard_lbm import cahn_hilliard_lb_method
+from lbmpy.phasefield.cahn_hilliard_lbm import batched_update_rule, cahn_hilliard_lb_method
 from lbmpy.phasefield.kerneleqs import mu_kernel
+from lbmpy.phasefield.symbolic_cache import symbolic_cache
 from lbmpy.stencils import get_stencil
-from pystencils import Assignment, create_data_handling, create_kernel
+from pystencils import Assignment, Field, create_data_handling, create_kernel
 from pystencils.fd import discretize_spatial
 from pystencils.fd.spatial import fd_stencils_forth_order_isotropic
 from pystencils.simp import sympy_cse_on_assignment_list
@@ -14,6 +17,18 @@ from pystencils.slicing import SlicedGetterDataHandling
 
 
 class PhaseFieldStepDirect:
+    """Phase field model computing the force directly from φ and μ, without a pressure tensor.
+
+    The pdfs of the Cahn-Hilliard LBMs of all order parameters are stored in one (source, destination) pair of
+    arrays ``ch_pdf_fields``, with the pdfs of order parameter i at ``ch_pdf_fields[0](i, d)``. They are updated by
+    the single kernel ``ch_lb_kernel`` and initialized by the first of the two ``init_kernels``, the second
+    initializes the hydrodynamic pdfs.
+
+    Previously every order parameter had its own pdf arrays, kernel and init kernel. The deprecated ``ch_pdfs`` and
+    ``ch_lb_kernels`` hold the single pair and kernel for all order parameters, such that
+    ``zip(step.ch_lb_kernels, step.ch_pdfs)`` still works. Code indexing them, or ``init_kernels``, by order
+    parameter has to be adapted.
+    """
 
     def __init__(self, free_energy, order_parameters, domain_size, data_handling=None, name='pfn',
                  hydro_dynamic_relaxation_rate=1.0,
@@ -60,18 +75,18 @@ class PhaseFieldStepDirect:
         self.velocity = SlicedGetterDataHandling(self.data_handling, self.vel_field.name)
         self.force = SlicedGetterDataHandling(self.data_handling, self.force_field.name)
 
-        self.ch_pdfs = []
-        for i in range(len(order_parameters)):
-            src = dh.add_array("{}_ch_src{}".format(name, i), values_per_cell=len(stencil), ghost_layers=gl)
-            dst = dh.add_array("{}_ch_dst{}".format(name, i), values_per_cell=len(stencil), ghost_layers=gl)
-            self.ch_pdfs.append((src, dst))
+        # pdfs of all Cahn-Hilliard LBMs in one array, updated by one kernel
+        q = len(stencil)
+        ch_values_per_cell = (phi_size, q)
+        self.ch_pdf_fields = (dh.add_array("{}_ch_src".format(name), values_per_cell=ch_values_per_cell,
+                                           ghost_layers=gl, layout='reverse_numpy'),
+                              dh.add_array("{}_ch_dst".format(name), values_per_cell=ch_values_per_cell,
+                                           ghost_layers=gl, layout='reverse_numpy'))
         self.hydro_pdfs = (dh.add_array("{}_hydro_src".format(name), values_per_cell=len(stencil), ghost_layers=gl),
                            dh.add_array("{}_hydro_dst".format(name), values_per_cell=len(stencil), ghost_layers=gl))
 
         # Compute Kernels
-        mu_assignments = mu_kernel(self.free_energy, order_parameters, self.phi_field, self.mu_field)
-        mu_assignments = [Assignment(a.lhs, a.rhs.doit()) for a in mu_assignments]
-        mu_assignments = sympy_cse_on_assignment_list(mu_assignments)
+        mu_assignments = _simplified_mu_assignments(self.free_energy, order_parameters, self.phi_field, self.mu_field)
         self.mu_kernel = create_kernel(mu_assignments, **kernel_parameters).compile()
 
         force_rhs = force_from_phi_and_mu(self.phi_field.center_vector, dim=dh.dim, mu=self.mu_field.center_vector)
@@ -80,19 +95,17 @@ class PhaseFieldStepDirect:
                              for lhs, rhs in zip(self.force_field.center_vector, force_rhs)]
         self.force_kernel = create_kernel(force_assignments, **kernel_parameters).compile()
 
-        self.ch_lb_kernels = []
-        for i, (src, dst) in enumerate(self.ch_pdfs):
-            ch_method = cahn_hilliard_lb_method(stencil, self.mu_field(i),
-
-                                                relaxation_rate=cahn_hilliard_relaxation_rates[i],
-                                                gamma=cahn_hilliard_gammas[i])
-            opt = optimization.copy()
-            opt['symbolic_field'] = src
-            opt['symbolic_temporary_field'] = dst
-            kernel = create_lb_function(lb_method=ch_method, optimization=opt,
-                                        velocity_input=self.vel_field.center_vector,
-                                        output={'density': self.phi_field(i)})
-            self.ch_lb_kernels.append(kernel)
+        self.ch_methods = [cahn_hilliard_lb_method(stencil, self.mu_field(i),
+                                                   relaxation_rate=cahn_hilliard_relaxation_rates[i],
+                                                   gamma=cahn_hilliard_gammas[i])
+                           for i in range(phi_size)]
+        src, dst = (Field.create_generic(n, dh.dim, index_shape=(q,)) for n in ('src', 'dst'))
+        ch_update_rules = [create_lb_update_rule(lb_method=ch_method, velocity_input=self.vel_field.center_vector,
+                                                 output={'density': self.phi_field(i)},
+                                                 optimization={'symbolic_field': src, 'symbolic_temporary_field': dst})
+                           for i, ch_method in enumerate(self.ch_methods)]
+        ch_update_rule = batched_update_rule(ch_update_rules, [src, dst], self.ch_pdf_fields)
+        self.ch_lb_kernel = create_kernel(ch_update_rule, target=target, cpu_openmp=openmp, ghost_layers=1).compile()
 
         opt = optimization.copy()
         opt['symbolic_field'] = self.hydro_pdfs[0]
@@ -102,15 +115,12 @@ class PhaseFieldStepDirect:
                                                   output={'velocity': self.vel_field}, optimization=opt)
 
         # Setter Kernels
-        self.init_kernels = []
-        for i in range(len(order_parameters)):
-            ch_method = self.ch_lb_kernels[i].method
-            init_assign = pdf_initialization_assignments(lb_method=ch_method,
-                                                         density=self.phi_field.center_vector[i],
-                                                         velocity=self.vel_field.center_vector,
-                                                         pdfs=self.ch_pdfs[i][0].center_vector)
-            init_kernel = create_kernel(init_assign, **kernel_parameters).compile()
-            self.init_kernels.append(init_kernel)
+        init_assignments = [pdf_initialization_assignments(lb_method=ch_method,
+                                                           density=self.phi_field.center_vector[i],
+                                                           velocity=self.vel_field.center_vector,
+                                                           pdfs=[self.ch_pdf_fields[0].center(i, d) for d in range(q)])
+                            for i, ch_method in enumerate(self.ch_methods)]
+        self.init_kernels = [create_kernel(batched_update_rule(init_assignments), **kernel_parameters).compile()]
 
         init_assign = pdf_initialization_assignments(lb_method=self.hydro_lb_kernel.method, density=1,
                                                      velocity=self.vel_field.center_vector,
@@ -120,11 +130,24 @@ class PhaseFieldStepDirect:
         # Sync functions
         self.phi_sync = dh.synchronization_function([self.phi_field.name])
         self.mu_sync = dh.synchronization_function([self.mu_field.name])
-        self.pdf_sync = dh.synchronization_function([self.hydro_pdfs[0].name]
-                                                    + [src.name for src, _ in self.ch_pdfs])
+        self.pdf_sync = dh.synchronization_function([self.hydro_pdfs[0].name, self.ch_pdf_fields[0].name])
 
         self.reset()
 
+    @property
+    def ch_lb_kernels(self):
+        """Deprecated: the Cahn-Hilliard LBMs of all order parameters are updated by the single ``ch_lb_kernel``."""
+        warnings.warn("PhaseFieldStepDirect.ch_lb_kernels is deprecated, all order parameters are updated by "
+                      "ch_lb_kernel", DeprecationWarning)
+        return [self.ch_lb_kernel]
+
+    @property
+    def ch_pdfs(self):
+        """Deprecated: the pdfs of all order parameters are stored in the single pair ``ch_pdf_fields``."""
+        warnings.warn("PhaseFieldStepDirect.ch_pdfs is deprecated, the pdfs of all order parameters are stored in "
+                      "ch_pdf_fields", DeprecationWarning)
+        return [self.ch_pdf_fields]
+
     def reset(self):
         dh = self.data_handling
         dh.fill(self.vel_field.name, 0)
@@ -171,6 +194,15 @@ class PhaseFieldStepDirect:
         dh.run_kernel(self.hydro_lb_kernel)
         dh.swap(self.hydro_pdfs[0].name, self.hydro_pdfs[1].name)
 
-        for ch_kernel, (src, dst) in zip(self.ch_lb_kernels, self.ch_pdfs):
-            dh.run_kernel(ch_kernel)
-            dh.swap(src.name, dst.name)
+        dh.run_kernel(self.ch_lb_kernel)
+        dh.swap(self.ch_pdf_fields[0].name, self.ch_pdf_fields[1].name)
+
+
+# -------------------------------------------- Helper Functions --------------------------------------------------------
+
+
+@symbolic_cache
+def _simplified_mu_assignments(free_energy, order_parameters, phi_field, mu_field):
+    mu_assignments = mu_kernel(free_energy, order_parameters, phi_field, mu_field)
+    mu_assignments = [Assignment(a.lhs, a.rhs.doit()) for a in mu_assignments]
+    return sympy_cse_on_assignment_list(mu_assignments)
@@ -0,0 +1,331 @@
+"""
+Cache for symbolic derivations
+==============================
+
+Setting up a phase field model differentiates and expands large sympy expressions: the chemical potentials are
+functional derivatives of the free energy, and the pressure tensor and the force are derived from it as well. For
+models with several phases in 3D this takes minutes, and it is repeated every time a step is constructed. Functions
+decorated with :func:`symbolic_cache` memoize their results. The cache key is a structural hash of all arguments,
+i.e. of the free energy, the order parameters, the dimension and the discretization.
+
+Results are always kept in memory. A :class:`SymbolicCache` with a directory additionally pickles them to disk, such
+that later processes skip the derivation. The chemical potentials are cached per order parameter:
+
+>>> import tempfile
+>>> from lbmpy.phasefield.analytical import chemical_potentials_from_free_energy, symbolic_order_parameters
+>>> c = symbolic_order_parameters(2)
+>>> free_energy = c[0] ** 2 * c[1] ** 2
+>>> with tempfile.TemporaryDirectory() as tmp_dir:
+...     previous_cache = set_symbolic_cache(SymbolicCache(tmp_dir))
+...     mu = chemical_potentials_from_free_energy(free_energy, c)
+...     cache = SymbolicCache(tmp_dir)  # a new cache, e.g. in another process, finds the results on disk
+...     _ = set_symbolic_cache(cache)
+...     mu_from_disk = chemical_potentials_from_free_energy(free_energy, c)
+...     hits = cache.statistics['hits']
+...     _ = set_symbolic_cache(previous_cache)
+>>> mu == mu_from_disk, hits
+(True, 2)
+
+By default only the in-memory cache is used. Set the environment variable ``LBMPY_SYMBOLIC_CACHE_DIR`` or call
+``set_symbolic_cache(True)`` to persist results in the user cache directory. Entries contain a hash of the lbmpy
+sources and the sympy and pystencils versions, such that a changed derivation never returns outdated results.
+
+With :func:`cached_map` a cached function is evaluated for several argument tuples in worker processes. This is used
+to differentiate the chemical potential of each order parameter in a separate process, see the ``processes``
+argument of :func:`lbmpy.phasefield.analytical.chemical_potentials_from_free_energy`.
+"""
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import sys
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import sympy as sp
+
+from lbmpy.kernel_cache import UncacheableParameter, _canonical, _lbmpy_source_hash
+from lbmpy.max_domain_size_info import convert_memory_size
+from pystencils.cache import memorycache
+
+__all__ = ['SymbolicCache', 'symbolic_cache', 'cached_map', 'get_symbolic_cache', 'set_symbolic_cache']
+
+CACHE_FORMAT_VERSION = 1
+
+_MISSING = object()
+
+
+class SymbolicCache:
+    """Memoizes results of symbolic derivations in memory and optionally on disk.
+
+    Args:
+        cache_dir: directory where results are pickled to, created if it does not exist. If None, results are only
+                   kept in memory.
+        max_size: size limit of the cache directory, either in bytes or as string like '500 MB'. When a new entry
+                  pushes the cache above this limit, least recently used entries are removed.
+        max_memory_entries: number of results kept in memory
+    """
+
+    def __init__(self, cache_dir=None, max_size='500 MB', max_memory_entries=256):
+        self.cache_dir = os.path.abspath(cache_dir) if cache_dir is not None else None
+        self.max_size = int(convert_memory_size(max_size))
+        self.max_memory_entries = max_memory_entries
+        self._memory = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    @property
+    def statistics(self):
+        """Dictionary with hit and miss counts of this cache object and the number of entries in memory and on disk."""
+        entries = self._disk_entries()
+        return {'hits': self._hits,
+                'misses': self._misses,
+                'memory_entries': len(self._memory),
+                'disk_entries': len(entries),
+                'disk_size': sum(size for _, _, size in entries)}
+
+    def get_or_compute(self, key, compute):
+        """Returns the result stored for key, calling compute only if the key is not in the cache.
+
+        Lists and matrices are returned as shallow copies, such that callers can modify them.
+        """
+        result = self._get(key)
+        if result is _MISSING:
+            result = compute()
+            self._put(key, result)
+        return _copy(result)
+
+    def clear(self):
+        """Removes all entries from memory and disk."""
+        self._memory.clear()
+        for file_name, _, _ in self._disk_entries():
+            _remove_file(file_name)
+
+    def __contains__(self, key):
+        return key in self._memory or (self.cache_dir is not None and os.path.exists(self._file_name(key)))
+
+    def __repr__(self):
+        return "SymbolicCache({!r}, max_size={})".format(self.cache_dir, self.max_size)
+
+    # ------------------------------ Implementation Details ------------------------------------------------------------
+
+    def _get(self, key):
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self._hits += 1
+            return self._memory[key]
+
+        if self.cache_dir is not None:
+            file_name = self._file_name(key)
+            try:
+                with open(file_name, 'rb') as f:
+                    result = pickle.load(f)
+                os.utime(file_name)  # mark as recently used
+            except (OSError, EOFError, AttributeError, ImportError, pickle.UnpicklingError):
+                pass
+            else:
+                self._hits += 1
+                self._remember(key, result)
+                return result
+
+        self._misses += 1
+        return _MISSING
+
+    def _put(self, key, result):
+        self._remember(key, result)
+        if self.cache_dir is None:
+            return
+        try:
+            data = pickle.dumps(result)
+        except (pickle.PicklingError, AttributeError, TypeError):
+            return
+        # written to a temporary file and moved into place, such that other processes never read partial entries
+        fd, tmp_file = tempfile.mkstemp(prefix='.tmp_', dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_file, self._file_name(key))
+        except OSError:
+            _remove_file(tmp_file)
+        self._evict()
+
+    def _remember(self, key, result):
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _file_name(self, key):
+        return os.path.join(self.cache_dir, key + '.pickle')
+
+    def _disk_entries(self):
+        """List of (file name, last access time, size in bytes) tuples"""
+        if self.cache_dir is None:
+            return []
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return []
+        result = []
+        for name in names:
+            if name.startswith('.') or not name.endswith('.pickle'):
+                continue
+            file_name = os.path.join(self.cache_dir, name)
+            try:
+                result.append((file_name, os.path.getmtime(file_name), os.path.getsize(file_name)))
+            except OSError:
+                continue
+        return result
+
+    def _evict(self):
+        entries = sorted(self._disk_entries(), key=lambda e: e[1])
+        total_size = sum(size for _, _, size in entries)
+        # the most recently used entry is never evicted, even if it alone exceeds the limit
+        for file_name, _, size in entries[:-1]:
+            if total_size <= self.max_size:
+                break
+            _remove_file(file_name)
+            total_size -= size
+
+
+_symbolic_cache = None
+
+
+def get_symbolic_cache():
+    """Returns the process-wide symbolic cache, stored on disk if LBMPY_SYMBOLIC_CACHE_DIR is set."""
+    global _symbolic_cache
+    if _symbolic_cache is None:
+        _symbolic_cache = SymbolicCache(os.environ.get('LBMPY_SYMBOLIC_CACHE_DIR', None) or None)
+    return _symbolic_cache
+
+
+def set_symbolic_cache(cache):
+    """Replaces the process-wide symbolic cache.
+
+    Args:
+        cache: :class:`SymbolicCache` instance, True for a disk cache in the user cache directory, or None to keep
+               results only in memory
+
+    Returns:
+        the previous cache
+    """
+    global _symbolic_cache
+    previous = get_symbolic_cache()
+    if cache is True:
+        from appdirs import user_cache_dir
+        cache = SymbolicCache(os.path.join(user_cache_dir('lbmpy'), 'symbolic'))
+    elif cache is None:
+        cache = SymbolicCache()
+    _symbolic_cache = cache
+    return previous
+
+
+def symbolic_cache(function):
+    """Decorator that memoizes the results of a symbolic derivation in the process-wide symbolic cache.
+
+    Calls with arguments that can not be hashed reliably, e.g. lambda functions, bypass the cache. The decorated
+    function has to be defined at module level, such that its results can be computed in worker processes by
+    :func:`cached_map`.
+    """
+    signature = inspect.signature(function)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        key = _cache_key(function, signature, args, kwargs)
+        if key is None:
+            return function(*args, **kwargs)
+        return get_symbolic_cache().get_or_compute(key, lambda: function(*args, **kwargs))
+
+    wrapper.cache_key = lambda *args, **kwargs: _cache_key(function, signature, args, kwargs)
+    return wrapper
+
+
+def cached_map(function, arguments, processes=1):
+    """Evaluates a function decorated with :func:`symbolic_cache` for each tuple of arguments.
+
+    Results that are not in the cache are computed in worker processes and stored in the cache of the main process.
+
+    Args:
+        function: function decorated with :func:`symbolic_cache`
+        arguments: sequence of argument tuples
+        processes: number of worker processes, with a single process all results are computed in the main process
+
+    Returns:
+        list of results
+    """
+    arguments = [tuple(args) for args in arguments]
+    cache = get_symbolic_cache()
+    keys = [function.cache_key(*args) for args in arguments]
+    results = [cache._get(key) if key is not None else _MISSING for key in keys]
+    missing = [i for i, r in enumerate(results) if r is _MISSING]
+
+    if processes > 1 and len(missing) > 1 and _picklable(function, [arguments[i] for i in missing]):
+        with ProcessPoolExecutor(min(processes, len(missing))) as executor:
+            futures = {i: executor.submit(_call_uncached, function, arguments[i]) for i in missing}
+            for i, future in futures.items():
+                results[i] = future.result()
+    else:
+        for i in missing:
+            results[i] = function.__wrapped__(*arguments[i])
+
+    for i in missing:
+        if keys[i] is not None:
+            cache._put(keys[i], results[i])
+    return [_copy(r) for r in results]
+
+
+# -------------------------------------------- Helper Functions --------------------------------------------------------
+
+
+def _cache_key(function, signature, args, kwargs):
+    bound_arguments = signature.bind(*args, **kwargs)
+    bound_arguments.apply_defaults()
+    try:
+        description = _canonical({'function': "{}.{}".format(function.__module__, function.__qualname__),
+                                  'arguments': dict(bound_arguments.arguments)})
+    except UncacheableParameter:
+        return None
+
+    hash_obj = hashlib.sha256()
+    hash_obj.update(description.encode())
+    hash_obj.update(_environment_description().encode())
+    return hash_obj.hexdigest()
+
+
+@memorycache(maxsize=1)
+def _environment_description():
+    import pystencils
+    return "{}|{}|{}|{}|{}".format(CACHE_FORMAT_VERSION, sys.version, sp.__version__, pystencils.__version__,
+                                   _lbmpy_source_hash())
+
+
+def _call_uncached(function, args):
+    return function.__wrapped__(*args)
+
+
+def _picklable(*objects):
+    try:
+        pickle.dumps(objects)
+    except (pickle.PicklingError, AttributeError, TypeError):
+        return False
+    return True
+
+
+def _copy(obj):
+    """Shallow copy of mutable results, such that callers can not modify cached objects."""
+    if isinstance(obj, tuple):
+        return tuple(_copy(e) for e in obj)
+    elif isinstance(obj, (list, dict, sp.MatrixBase)):
+        return obj.copy()
+    return obj
+
+
+def _remove_file(file_name):
+    try:
+        os.remove(file_name)
+    except OSError:
+        pass
@@ -0,0 +1,278 @@
+import numpy as np
+
+from lbmpy.boundaries.boundaryhandling import LatticeBoltzmannBoundaryHandling
+from lbmpy.creationfunctions import create_lb_method, create_lb_update_rule
+from lbmpy.fieldaccess import StreamPullTwoFieldsAccessor
+from lbmpy.parallel_compilation import KernelCreationPool
+from lbmpy.phasefield_allen_cahn.force_model import MultiphaseForceModel
+from lbmpy.phasefield_allen_cahn.kernel_equations import (
+    get_collision_assignments_hydro, hydrodynamic_force, initializer_kernel_hydro_lb, initializer_kernel_phase_field_lb,
+    interface_tracking_force)
+from lbmpy.stencils import get_stencil
+from pystencils import Assignment, AssignmentCollection, create_data_handling, create_kernel
+from pystencils.boundaries.boundaryhandling import FlagInterface
+from pystencils.simp import sympy_cse
+from pystencils.slicing import SlicedGetter, make_slice
+from pystencils.sympyextensions import fast_subs
+from pystencils.timeloop import TimeLoop
+
+
+class AllenCahnStep:
+    """Conservative Allen-Cahn phase field model coupled to a hydrodynamic LBM, according to PhysRevE.96.053301.
+
+    The phase field φ is 1 in the heavy and 0 in the light fluid. It is transported by a lattice Boltzmann scheme for
+    the conservative Allen-Cahn equation. The hydrodynamic LBM is a MRT scheme for the pressure and velocity, whose
+    viscosity and density are interpolated between the two fluids.
+
+    Each of both LBMs is updated by a single kernel per time step: the phase field kernel streams, collides and
+    computes φ, the hydrodynamic kernel streams and collides, including the computation of the force. Only the pdf
+    fields, φ, the velocity and one flag field for the boundaries of both LBMs are allocated, and the ghost layers of
+    both pdf fields are exchanged together.
+
+    The parameters can be computed with the functions in :mod:`lbmpy.phasefield_allen_cahn.parameter_calculation`.
+    """
+
+    def __init__(self, domain_size=None, data_handling=None, name='allen_cahn',
+                 stencil_phase=None, stencil_hydro=None,
+                 density_heavy=1.0, density_light=0.001,
+                 relaxation_time_heavy=0.5, relaxation_time_light=0.5,
+                 mobility=0.02, surface_tension=1e-4, interface_thickness=5,
+                 gravitational_acceleration=0.0, sub_iterations=2,
+                 optimization=None, compile_processes=1):
+        """
+        Args:
+            domain_size: size of the domain, if no data handling is passed. The created data handling is periodic.
+            data_handling: data handling to allocate the fields in
+            name: prefix of the field names
+            stencil_phase: stencil of the phase field LBM, by default D2Q9 in 2D and D3Q15 in 3D
+            stencil_hydro: stencil of the hydrodynamic LBM, by default D2Q9 in 2D and D3Q27 in 3D
+            density_heavy: density of the heavier fluid, where φ is 1
+            density_light: density of the lighter fluid, where φ is 0
+            relaxation_time_heavy: relaxation time of the heavier fluid minus 1/2, i.e. three times its kinematic
+                                   viscosity
+            relaxation_time_light: relaxation time of the lighter fluid minus 1/2
+            mobility: mobility of the phase field
+            surface_tension: surface tension between the fluids
+            interface_thickness: width of the interface in cells
+            gravitational_acceleration: acceleration in y-direction, acting on the local density
+            sub_iterations: number of iterations to compute the velocity from the velocity dependent force
+            optimization: only 'cpu' target is supported, pass {'openmp': True} to parallelize all kernels
+            compile_processes: number of worker processes creating the kernels, or a
+                               :class:`lbmpy.parallel_compilation.KernelCreationPool` shared with other steps
+        """
+        if optimization is None:
+            optimization = {'openmp': False, 'target': 'cpu'}
+        if optimization.get('target', 'cpu') != 'cpu':
+            raise ValueError("AllenCahnStep only supports the 'cpu' target")
+        openmp = optimization.get('openmp', False)
+
+        if data_handling is None:
+            data_handling = create_data_handling(domain_size, periodicity=True, parallel=False)
+        self.data_handling = dh = data_handling
+        dim = dh.dim
+
+        if stencil_phase is None:
+            stencil_phase = 'D2Q9' if dim == 2 else 'D3Q15'
+        if stencil_hydro is None:
+            stencil_hydro = 'D2Q9' if dim == 2 else 'D3Q27'
+        stencil_phase, stencil_hydro = get_stencil(stencil_phase), get_stencil(stencil_hydro)
+        assert len(stencil_phase[0]) == len(stencil_hydro[0]) == dim
+
+        pool = compile_processes
+        if not isinstance(pool, KernelCreationPool):
+            pool = KernelCreationPool(compile_processes)
+
+        # ------------------ Adding arrays ---------------------
+        self.name = name
+        self.phi_field_name = name + "_phi"
+        self.vel_field_name = name + "_u"
+        self.phase_pdf_field_names = (name + "_h", name + "_h_tmp")
+        self.hydro_pdf_field_names = (name + "_g", name + "_g_tmp")
+
+        h, h_tmp = (dh.add_array(n, values_per_cell=len(stencil_phase)) for n in self.phase_pdf_field_names)
+        g, g_tmp = (dh.add_array(n, values_per_cell=len(stencil_hydro)) for n in self.hydro_pdf_field_names)
+        self.phi_field = phi = dh.add_array(self.phi_field_name, latex_name='φ')
+        self.vel_field = u = dh.add_array(self.vel_field_name, values_per_cell=dim, latex_name='u')
+
+        # ------------------ Methods ---------------------------
+        relaxation_time = 0.5 + relaxation_time_light + phi.center * (relaxation_time_heavy - relaxation_time_light)
+        density = density_light + phi.center * (density_heavy - density_light)
+        surface_tension_beta = 12.0 * surface_tension / interface_thickness
+        surface_tension_kappa = 1.5 * surface_tension * interface_thickness
+        phase_relaxation_rate = 1.0 / (0.5 + 3.0 * mobility)
+
+        self.phase_method = create_lb_method(stencil=stencil_phase, method='srt', relaxation_rate=phase_relaxation_rate,
+                                             compressible=True)
+        self.hydro_method = create_lb_method(stencil=stencil_hydro, method='mrt', weighted=True,
+                                             relaxation_rates=[1 / relaxation_time, 1, 1, 1, 1, 1],
+                                             maxwellian_moments=True, entropic=False)
+
+        # ------------------ Creating kernels ------------------
+        # phase field: stream, collide and compute φ from the new pdfs
+        interface_force = [f / 3 for f in interface_tracking_force(phi, stencil_phase, interface_thickness)]
+        self.phase_method.set_force_model(MultiphaseForceModel(force=interface_force))
+        phase_update_rule = create_lb_update_rule(lb_method=self.phase_method, velocity_input=u, compressible=True,
+                                                  optimization={'symbolic_field': h, 'symbolic_temporary_field': h_tmp},
+                                                  kernel_type='stream_pull_collide')
+        phase_update_rule.set_main_assignments_from_dict({**phase_update_rule.main_assignments_dict,
+                                                          phi.center: sum(h_tmp.center_vector)})
+        self.phase_kernel = pool.submit(_create_kernel_ast, eqs=phase_update_rule, openmp=openmp)
+
+        # hydrodynamics: the collision reads the pulled pdfs, such that streaming and collision are a single sweep
+        body_force = [0] * 3
+        body_force[1] = gravitational_acceleration * density
+        force = hydrodynamic_force(g, phi, self.hydro_method, relaxation_time, density_heavy, density_light,
+                                   surface_tension_kappa, surface_tension_beta, body_force)
+        collision = get_collision_assignments_hydro(lb_method=self.hydro_method, density=density, velocity_input=u,
+                                                    force=force, sub_iterations=sub_iterations,
+                                                    optimization={'symbolic_field': g,
+                                                                  'symbolic_temporary_field': g_tmp},
+                                                    kernel_type='collide_only')
+        hydro_eqs = _pull_collision(collision, g, g_tmp, stencil_hydro)
+        self.hydro_kernel = pool.submit(_create_kernel_ast, eqs=hydro_eqs, openmp=openmp)
+
+        # Setter Kernels
+        phase_init = initializer_kernel_phase_field_lb(h, phi, u, self.phase_method, interface_thickness)
+        hydro_init = initializer_kernel_hydro_lb(g, u, self.hydro_method)
+        self.init_kernels = [pool.submit(_create_kernel_ast, eqs=eqs, openmp=openmp, cse=False)
+                             for eqs in (phase_init, hydro_init)]
+        if pool is not compile_processes:
+            pool.shutdown(wait=False)
+
+        # Sync functions
+        self.pdf_sync = dh.synchronization_function([h.name, g.name])
+        self.phi_sync = dh.synchronization_function([phi.name])
+
+        # Boundary handling
+        self.flag_interface = FlagInterface(dh, name + "_flags")
+        self.phase_boundary_handling = LatticeBoltzmannBoundaryHandling(
+            self.phase_method, dh, h.name, name=name + "_phase_boundary_handling",
+            flag_interface=self.flag_interface, openmp=openmp)
+        self.hydro_boundary_handling = LatticeBoltzmannBoundaryHandling(
+            self.hydro_method, dh, g.name, name=name + "_hydro_boundary_handling",
+            flag_interface=self.flag_interface, openmp=openmp)
+
+        self._vtk_writer = None
+        self.time_steps_run = 0
+        self.reset()
+
+    @property
+    def vtk_writer(self):
+        if self._vtk_writer is None:
+            self._vtk_writer = self.data_handling.create_vtk_writer(self.name, [self.phi_field_name,
+                                                                                self.vel_field_name])
+        return self._vtk_writer
+
+    @property
+    def shape(self):
+        return self.data_handling.shape
+
+    @property
+    def number_of_cells(self):
+        return int(np.prod(self.data_handling.shape))
+
+    def write_vtk(self):
+        self.vtk_writer(self.time_steps_run)
+
+    def reset(self):
+        self.data_handling.fill(self.phi_field_name, 0.0, ghost_layers=True)
+        self.data_handling.fill(self.vel_field_name, 0.0, ghost_layers=True)
+        for field_name in self.phase_pdf_field_names + self.hydro_pdf_field_names:
+            self.data_handling.fill(field_name, 0.0, ghost_layers=True)
+        self.set_pdf_fields_from_macroscopic_values()
+        self.time_steps_run = 0
+
+    def set_boundary(self, boundary_obj, slice_obj=None, mask_callback=None):
+        """Sets a boundary condition for the phase field and the hydrodynamic LBM, see
+        :meth:`pystencils.boundaries.BoundaryHandling.set_boundary`. To use different conditions for both, set them at
+        phase_boundary_handling and hydro_boundary_handling, the second one with replace=False."""
+        self.phase_boundary_handling.set_boundary(boundary_obj, slice_obj, mask_callback)
+        self.hydro_boundary_handling.set_boundary(boundary_obj, slice_obj, mask_callback, replace=False)
+
+    def set_pdf_fields_from_macroscopic_values(self):
+        """Initializes both pdf fields from φ and the velocity, the phase field pdfs depend on the gradient of φ."""
+        self.phi_sync()
+        for kernel in self.init_kernels:
+            self.data_handling.run_kernel(kernel)
+
+    def pre_run(self):
+        pass
+
+    def post_run(self):
+        pass
+
+    def time_step(self):
+        dh = self.data_handling
+        self.phase_boundary_handling()
+        self.hydro_boundary_handling()
+        self.pdf_sync()
+        dh.run_kernel(self.phase_kernel)
+        self.phi_sync()
+        dh.run_kernel(self.hydro_kernel)
+        dh.swap(*self.phase_pdf_field_names)
+        dh.swap(*self.hydro_pdf_field_names)
+        self.time_steps_run += 1
+
+    def run(self, time_steps):
+        self.pre_run()
+        for i in range(time_steps):
+            self.time_step()
+        self.post_run()
+
+    def get_time_loop(self):
+        time_loop = TimeLoop(steps=1)
+        time_loop.add_pre_run_function(self.pre_run)
+        time_loop.add_post_run_function(self.post_run)
+        time_loop.add_single_step_function(self.time_step)
+        time_loop.add_call(self.time_step, {})
+        return time_loop
+
+    def benchmark_run(self, time_steps):
+        """Runs time_steps time steps and returns the performance in MLUPS."""
+        duration_of_time_step = self.get_time_loop().benchmark_run(time_steps)
+        return self.number_of_cells / duration_of_time_step * 1e-6
+
+    def benchmark(self, time_for_benchmark=5, init_time_steps=2, number_of_time_steps_for_estimation='auto'):
+        """Runs time steps for about time_for_benchmark seconds and returns the performance in MLUPS."""
+        duration_of_time_step = self.get_time_loop().benchmark(time_for_benchmark, init_time_steps,
+                                                               number_of_time_steps_for_estimation)
+        return self.number_of_cells / duration_of_time_step * 1e-6
+
+    def _get_slice(self, data_name, slice_obj):
+        if slice_obj is None:
+            slice_obj = make_slice[:, :] if self.data_handling.dim == 2 else make_slice[:, :, 0.5]
+        return self.data_handling.gather_array(data_name, slice_obj).squeeze()
+
+    def phi_slice(self, slice_obj=None):
+        return self._get_slice(self.phi_field_name, slice_obj)
+
+    def velocity_slice(self, slice_obj=None):
+        return self._get_slice(self.vel_field_name, slice_obj)
+
+    @property
+    def phi(self):
+        return SlicedGetter(self.phi_slice)
+
+    @property
+    def velocity(self):
+        return SlicedGetter(self.velocity_slice)
+
+
+def _create_kernel_ast(eqs, openmp, cse=True):
+    if cse:
+        eqs = sympy_cse(eqs)
+    return create_kernel(eqs, cpu_openmp=openmp)
+
+
+def _pull_collision(collision, src, dst, stencil):
+    """Turns an in-place collision of src into an update rule that pulls from src and writes the collided pdfs to
+    dst."""
+    pulled = StreamPullTwoFieldsAccessor().read(src, stencil)
+    substitutions = {src.center(i): pulled_i for i, pulled_i in enumerate(pulled)}
+
+    def pull(assignments):
+        return [Assignment(dst.center(a.lhs.index[0]) if a.lhs in substitutions else a.lhs,
+                           fast_subs(a.rhs, substitutions)) for a in assignments]
+
+    return AssignmentCollection(main_assignments=pull(collision.main_assignments),
+                                subexpressions=pull(collision.subexpressions))
@@ -0,0 +1,144 @@
+"""Per-phase timing of lattice Boltzmann time steps
+
+A :class:`Profiler` accumulates wall time, number of calls and estimated memory traffic of named phases, e.g. the
+ghost layer synchronization, each boundary condition and each kernel of a time step. It is enabled with
+:meth:`lbmpy.lbstep.LatticeBoltzmannStep.enable_profiling`, without it the time step calls the kernels directly.
+
+>>> from lbmpy.lbstep import LatticeBoltzmannStep
+>>> from lbmpy.boundaries import NoSlip
+>>> step = LatticeBoltzmannStep((32, 32), method='srt', relaxation_rate=1.8)
+>>> flag = step.boundary_handling.set_boundary(NoSlip(), slice_obj=(slice(None), slice(0, 1)))
+>>> profiler = step.enable_profiling()
+>>> step.run(10)
+>>> profile = profiler.to_dict()
+>>> sorted(profile)
+['boundary NoSlip', 'ghost layer sync', 'stream_collide']
+>>> profile['stream_collide']['calls'], profile['stream_collide']['bytes_per_call']
+(10, 221184)
+
+Besides the cumulative numbers, every call is recorded as event, which can be written to a JSON file in the
+Chrome trace format with :meth:`Profiler.to_chrome_trace` and inspected in chrome://tracing or Perfetto.
+"""
+import json
+import os
+import time
+
+
+class Profiler:
+    """Cumulative wall time, call count and memory traffic of named phases.
+
+    Args:
+        cells_per_time_step: lattice cell updates a phase is part of, if not given per call. The MLUPS of a phase are
+                             the updates per second if the time step consisted of this phase only.
+        trace: record every call as event for :meth:`to_chrome_trace`
+        max_trace_events: events after this number are only added to the cumulative numbers
+    """
+
+    def __init__(self, cells_per_time_step=0, trace=True, max_trace_events=10 ** 6):
+        self.cells_per_time_step = cells_per_time_step
+        self.trace = trace
+        self.max_trace_events = max_trace_events
+        self.phases = {}
+        self.events = []
+        self._start = time.perf_counter()
+
+    def timed(self, name, function, category='', cells=None, bytes_per_call=0):
+        """Returns a function that calls the given function and records its wall time under the phase name.
+
+        Args:
+            name: name of the phase, calls of different functions with the same name are accumulated
+            function: function to time
+            category: group of the phase, e.g. 'kernel', 'boundary' or 'sync'
+            cells: lattice cell updates per call, by default ``cells_per_time_step``
+            bytes_per_call: estimated memory traffic of a call
+        """
+        clock = time.perf_counter
+
+        def timed_function(*args, **kwargs):
+            start = clock()
+            result = function(*args, **kwargs)
+            self.record(name, start, clock() - start, category, cells, bytes_per_call)
+            return result
+
+        return timed_function
+
+    def record(self, name, start, duration, category='', cells=None, bytes_per_call=0):
+        """Adds a call, started at ``start`` (``time.perf_counter()``) and taking ``duration`` seconds."""
+        phase = self.phases.get(name)
+        if phase is None:
+            phase = self.phases[name] = {'category': category, 'calls': 0, 'time': 0.0, 'cells': 0, 'bytes': 0}
+        phase['calls'] += 1
+        phase['time'] += duration
+        phase['cells'] += self.cells_per_time_step if cells is None else cells
+        phase['bytes'] += bytes_per_call
+        if self.trace and len(self.events) < self.max_trace_events:
+            self.events.append((name, category, start, duration))
+
+    def reset(self):
+        """Removes all recorded calls."""
+        self.phases.clear()
+        self.events.clear()
+        self._start = time.perf_counter()
+
+    @property
+    def total_time(self):
+        return sum(phase['time'] for phase in self.phases.values())
+
+    def to_dict(self):
+        """Dict mapping phase names to dicts with 'category', 'calls', 'time' (seconds), 'fraction' of the total
+        time, 'mlups', 'bytes_per_call' and 'bandwidth' (bytes per second), ordered by descending time."""
+        total_time = self.total_time
+        result = {}
+        for name, phase in sorted(self.phases.items(), key=lambda item: -item[1]['time']):
+            seconds = phase['time']
+            result[name] = {
+                'category': phase['category'],
+                'calls': phase['calls'],
+                'time': seconds,
+                'fraction': seconds / total_time if total_time > 0 else 0.0,
+                'mlups': phase['cells'] / seconds * 1e-6 if seconds > 0 else 0.0,
+                'bytes_per_call': phase['bytes'] // phase['calls'],
+                'bandwidth': phase['bytes'] / seconds if seconds > 0 else 0.0,
+            }
+        return result
+
+    def to_chrome_trace(self, file_name=None):
+        """Recorded events in the Chrome trace event format, written as JSON to ``file_name`` if given."""
+        pid = os.getpid()
+        trace = {
+            'traceEvents': [{'name': name, 'cat': category, 'ph': 'X', 'pid': pid, 'tid': 0,
+                             'ts': (start - self._start) * 1e6, 'dur': duration * 1e6}
+                            for name, category, start, duration in self.events],
+            'displayTimeUnit': 'ms',
+        }
+        if file_name is not None:
+            with open(file_name, 'w') as f:
+                json.dump(trace, f)
+        return trace
+
+    def _build_table(self):
+        header = ['Phase', 'Calls', 'Time [s]', 'Fraction', 'MLUPS', 'GB/s']
+
+        def to_str(e):
+            if isinstance(e, float):
+                return format(e, ">10.3f")
+            return format(str(e), ">10")
+
+        rows = [[name, p['calls'], p['time'], p['fraction'], p['mlups'], p['bandwidth'] * 1e-9]
+                for name, p in self.to_dict().items()]
+        return [[to_str(e) for e in header]] + [[to_str(e) for e in row] for row in rows]
+
+    def _repr_html_(self):
+        import ipy_table
+        # noinspection PyProtectedMember
+        return ipy_table.make_table(self._build_table())._repr_html_()
+
+    def __str__(self):
+        header, *content = self._build_table()
+        lines = ['|'.join(header)]
+        lines.append('-' * len(lines[0]))
+        lines.extend('|'.join(row) for row in content)
+        return "\n".join(lines)
+
+    def __repr__(self):
+        return self.__str__()
@@ -61,7 +61,7 @@ def create_fully_periodic_flow(initial_velocity, periodicity_in_kernel=False, lb
 
     if data_handling is None:
         data_handling = create_data_handling(domain_size, periodicity=not periodicity_in_kernel,
-                                             default_ghost_layers=1, parallel=parallel)
+                                             default_ghost_layers=kwargs.get('ghost_layers', 1), parallel=parallel)
     step = LatticeBoltzmannStep(data_handling=data_handling, name="periodic_scenario", lbm_kernel=lbm_kernel, **kwargs)
     for b in step.data_handling.iterate(ghost_layers=False):
         np.copyto(b[step.velocity_data_name], initial_velocity[b.global_slice])
@@ -89,7 +89,7 @@ def create_lid_driven_cavity(domain_size=None, lid_velocity=0.005, lbm_kernel=No
         target = optimization.get('target', None) if optimization else None
         data_handling = create_data_handling(domain_size,
                                              periodicity=False,
-                                             default_ghost_layers=1,
+                                             default_ghost_layers=kwargs.get('ghost_layers', 1),
                                              parallel=parallel,
                                              default_target=target)
     step = LatticeBoltzmannStep(data_handling=data_handling, lbm_kernel=lbm_kernel, name="ldc", **kwargs)
@@ -133,7 +133,7 @@ def create_channel(domain_size=None, force=None, pressure_difference=None, u_max
         dim = len(domain_size)
         assert dim in (2, 3)
         data_handling = create_data_handling(domain_size, periodicity=periodicity[:dim],
-                                             default_ghost_layers=1, parallel=parallel)
+                                             default_ghost_layers=kwargs.get('ghost_layers', 1), parallel=parallel)
 
     dim = data_handling.dim
     if force:
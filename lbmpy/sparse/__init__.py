@@ -1,8 +1,12 @@
+from .lbstep_sparse import SparseLatticeBoltzmannStep
 from .mapping import SparseLbBoundaryMapper, SparseLbMapper
+from .storage_selection import (
+    choose_storage, estimate_storage_costs, select_storage, sparse_step_from_dense)
 from .update_rule_sparse import (
     create_lb_update_rule_sparse, create_macroscopic_value_getter_sparse,
     create_macroscopic_value_setter_sparse, create_symbolic_list)
 
-__all__ = ['SparseLbBoundaryMapper', 'SparseLbMapper', 'create_lb_update_rule_sparse',
+__all__ = ['SparseLatticeBoltzmannStep', 'SparseLbBoundaryMapper', 'SparseLbMapper', 'create_lb_update_rule_sparse',
            'create_macroscopic_value_setter_sparse', 'create_macroscopic_value_getter_sparse',
-           'create_symbolic_list']
+           'create_symbolic_list', 'choose_storage', 'estimate_storage_costs', 'select_storage',
+           'sparse_step_from_dense']
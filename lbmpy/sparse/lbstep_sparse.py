@@ -0,0 +1,278 @@
+from types import MappingProxyType
+
+import numpy as np
+
+from lbmpy.boundaries import NoSlip
+from lbmpy.creationfunctions import create_lb_collision_rule, update_with_default_parameters
+from lbmpy.sparse.mapping import SparseLbBoundaryMapper, SparseLbMapper
+from lbmpy.sparse.update_rule_sparse import (
+    create_lb_update_rule_sparse, create_macroscopic_value_getter_sparse,
+    create_macroscopic_value_setter_sparse, create_symbolic_list)
+from pystencils import create_kernel, make_slice
+from pystencils.slicing import SlicedGetter, normalize_slice
+from pystencils.timeloop import TimeLoop
+
+
+class SparseLatticeBoltzmannStep:
+    """Lattice Boltzmann scenario that stores pdfs only for fluid and boundary cells (indirect addressing).
+
+    The counterpart of :class:`lbmpy.lbstep.LatticeBoltzmannStep` for geometries with a low fluid fraction:
+    pdfs are kept in compact lists created by a :class:`lbmpy.sparse.SparseLbMapper`, the neighbors are found through
+    an index array. Memory and time per step scale with the number of fluid cells instead of the domain size.
+
+    The geometry is fixed at construction time by a flag array including ghost layers. Each bit of the flag array
+    marks either fluid or one of the boundaries. Cells in the ghost layers without any flag are periodic, i.e. the
+    pdfs are streamed in from the opposite side of the domain.
+
+    Args:
+        flag_arr: integer array with the shape of the domain plus ghost layers
+        boundaries: dict mapping flag bits to boundary objects. :class:`lbmpy.boundaries.NoSlip` boundaries are
+                    resolved in the index array, all other boundaries get their own kernel.
+        fluid_flag: flag bit that marks fluid cells
+        ghost_layers: number of ghost layers of the flag array
+        kernel_params: dict of parameters passed to all kernels, e.g. values of symbolic relaxation rates
+        name: prefix for the names of the pdf lists
+        optimization: optimization parameters, see :func:`lbmpy.creationfunctions.create_lb_function`, the pdf
+                      lists are never vectorized
+        layout: memory layout of the lists, see :class:`lbmpy.sparse.SparseLbMapper`
+        cell_order: order of the cells in the lists, see :class:`lbmpy.sparse.SparseLbMapper`
+        block_width: number of cells per block for layout 'AoSoA'
+        max_lookup_table_size: memory budget of the coordinate lookup table, see :class:`lbmpy.sparse.SparseLbMapper`
+        method_parameters: parameters of the LB method, see :func:`lbmpy.creationfunctions.create_lb_method`,
+                           or an existing method passed as 'lb_method'
+    """
+
+    def __init__(self, flag_arr, boundaries=MappingProxyType({}), fluid_flag=1, ghost_layers=1,
+                 kernel_params=MappingProxyType({}), name="lbm", optimization={}, layout='SoA',
+                 cell_order='lexicographic', block_width=4, max_lookup_table_size='512 MB', **method_parameters):
+        dim = len(flag_arr.shape)
+        if 'stencil' not in method_parameters:
+            method_parameters['stencil'] = 'D2Q9' if dim == 2 else 'D3Q27'
+        method_parameters, optimization = update_with_default_parameters(method_parameters, optimization)
+        if optimization['target'] != 'cpu':
+            raise NotImplementedError("Sparse lattice Boltzmann kernels are only available for the CPU")
+        if optimization['vectorization']:
+            raise ValueError("Kernels with indirect addressing can not be vectorized")
+        field_dtype = np.float64 if optimization['double_precision'] else np.float32
+        del method_parameters['kernel_type']
+
+        no_slip_mask = 0
+        other_boundary_mask = 0
+        for flag, boundary in boundaries.items():
+            if isinstance(boundary, NoSlip):
+                no_slip_mask |= flag
+            elif boundary.additional_data:
+                raise NotImplementedError("Boundary '{}' requires additional data, which is not supported for "
+                                          "sparse pdf lists".format(boundary.name))
+            else:
+                other_boundary_mask |= flag
+
+        self.name = name
+        self.kernel_params = kernel_params.copy()
+        self.time_steps_run = 0
+        self._ghost_layers = ghost_layers
+        self._optimization = optimization
+        self._pdf_arr_name = name + "_pdfSrc"
+        self._tmp_arr_name = name + "_pdfTmp"
+        self._index_arr_name = name + "_idx"
+        self._velocity_arr_name = name + "_velocity"
+        self._density_arr_name = name + "_density"
+
+        # --- Kernel creation ---
+        collision_rule = create_lb_collision_rule(optimization=optimization, **method_parameters)
+        self.method = collision_rule.method
+        q = len(self.method.stencil)
+
+        self._mapping = SparseLbMapper(self.method.stencil, flag_arr, fluid_flag, no_slip_mask, other_boundary_mask,
+                                       max_lookup_table_size=max_lookup_table_size, cell_order=cell_order,
+                                       layout=layout, block_width=block_width)
+        mapping = self._mapping
+
+        pdf_field = create_symbolic_list(self._pdf_arr_name, None, q, field_dtype, layout, block_width)
+        tmp_field = create_symbolic_list(self._tmp_arr_name, None, q, field_dtype, layout, block_width)
+        index_field = create_symbolic_list(self._index_arr_name, None, q - 1, np.uint32, layout, block_width)
+        update_rule = create_lb_update_rule_sparse(collision_rule, pdf_field, tmp_field, index_field, layout=layout)
+        self.ast = self._create_kernel(update_rule)
+        self._lbm_kernel = self.ast.compile()
+
+        self._boundary_kernels = []
+        for flag, boundary in boundaries.items():
+            if isinstance(boundary, NoSlip):
+                continue
+            boundary_mapper = SparseLbBoundaryMapper(boundary, self.method, pdf_field)
+            boundary_index_arr = boundary_mapper.create_index_arr(mapping, flag, ghost_layers)
+            if boundary_index_arr.size > 0:
+                kernel = self._create_kernel(boundary_mapper.assignments()).compile()
+                self._boundary_kernels.append((kernel, boundary_index_arr))
+
+        # -- Macroscopic Value Kernels
+        density_field = create_symbolic_list(self._density_arr_name, None, 1, field_dtype, layout, block_width)
+        velocity_field = create_symbolic_list(self._velocity_arr_name, None, self.method.dim, field_dtype,
+                                              layout, block_width)
+        getter_eqs = create_macroscopic_value_getter_sparse(self.method, pdf_field,
+                                                            {'density': density_field.center,
+                                                             'velocity': velocity_field})
+        self._getter_kernel = self._create_kernel(getter_eqs).compile()
+        setter_eqs = create_macroscopic_value_setter_sparse(self.method, pdf_field, density_field.center,
+                                                            velocity_field.center_vector)
+        self._setter_kernel = self._create_kernel(setter_eqs).compile()
+
+        # -- Lists
+        self._index_arr = mapping.create_index_array(ghost_layers)
+        self._pdf_arr = mapping.create_list(len(mapping), q, field_dtype)
+        self._tmp_arr = mapping.create_list(len(mapping), q, field_dtype)
+        self._density_arr = mapping.create_list(len(mapping), 1, field_dtype)
+        self._velocity_arr = mapping.create_list(len(mapping), self.method.dim, field_dtype)
+        self._density_arr.fill(1.0)
+        self._velocity_arr.fill(0.0)
+        self.set_pdf_fields_from_macroscopic_values()
+
+    @property
+    def mapping(self):
+        """The :class:`lbmpy.sparse.SparseLbMapper` that defines the order and layout of all lists."""
+        return self._mapping
+
+    @property
+    def dim(self):
+        return len(self._mapping.flag_array.shape)
+
+    @property
+    def domain_size(self):
+        return tuple(s - 2 * self._ghost_layers for s in self._mapping.flag_array.shape)
+
+    @property
+    def number_of_cells(self):
+        """Number of fluid cells, i.e. the number of cells updated per time step."""
+        return self._mapping.num_fluid_cells
+
+    @property
+    def pdf_array_name(self):
+        return self._pdf_arr_name
+
+    @property
+    def pdf_list(self):
+        return self._pdf_arr
+
+    @property
+    def memory_usage(self):
+        """Number of bytes allocated for pdf lists, index arrays and macroscopic values."""
+        arrays = [self._pdf_arr, self._tmp_arr, self._index_arr, self._density_arr, self._velocity_arr]
+        arrays += [index_arr for _, index_arr in self._boundary_kernels]
+        return sum(a.nbytes for a in arrays)
+
+    def _get_slice(self, list_arr, slice_obj, masked):
+        if slice_obj is None:
+            slice_obj = make_slice[:, :] if self.dim == 2 else make_slice[:, :, 0.5]
+        mapping = self._mapping
+        values = mapping.list_values(list_arr, mapping.num_fluid_cells)
+        fluid_coordinates = mapping.fluid_coordinates
+        fluid_coordinates = tuple(fluid_coordinates[name] - self._ghost_layers
+                                  for name in fluid_coordinates.dtype.names)
+
+        result = np.zeros(self.domain_size + values.shape[1:], dtype=values.dtype)
+        result[fluid_coordinates] = values
+        slice_obj = normalize_slice(slice_obj[:self.dim], self.domain_size) + tuple(slice_obj[self.dim:])
+        result = result[slice_obj]
+
+        if masked:
+            mask = np.ones(self.domain_size + values.shape[1:], dtype=bool)
+            mask[fluid_coordinates] = False
+            result = np.ma.masked_array(result, mask[slice_obj]).squeeze()
+        return result
+
+    def velocity_slice(self, slice_obj=None, masked=True):
+        return self._get_slice(self._velocity_arr, slice_obj, masked)
+
+    def density_slice(self, slice_obj=None, masked=True):
+        return self._get_slice(self._density_arr, slice_obj, masked)
+
+    @property
+    def velocity(self):
+        return SlicedGetter(self.velocity_slice)
+
+    @property
+    def density(self):
+        return SlicedGetter(self.density_slice)
+
+    def set_pdf_fields_from_macroscopic_values(self, density=None, velocity=None):
+        """Sets the pdfs of all cells to equilibrium.
+
+        Args:
+            density: scalar or array with the shape of the domain (without ghost layers), None keeps the current
+                     values of the fluid cells
+            velocity: vector or array with the shape of the domain and the velocity components as last dimension
+        """
+        mapping = self._mapping
+        fluid_coordinates = mapping.fluid_coordinates
+        fluid_coordinates = tuple(fluid_coordinates[name] - self._ghost_layers
+                                  for name in fluid_coordinates.dtype.names)
+        for list_arr, values, values_per_cell in ((self._density_arr, density, ()),
+                                                  (self._velocity_arr, velocity, (self.dim,))):
+            if values is None:
+                continue
+            values = np.asarray(values)
+            if values.shape == self.domain_size + values_per_cell:
+                values = values[fluid_coordinates]
+            else:
+                values = np.broadcast_to(values, (mapping.num_fluid_cells,) + values_per_cell)
+            mapping.set_list_values(list_arr, values)
+        self._setter_kernel(**{self._pdf_arr_name: self._pdf_arr, self._density_arr_name: self._density_arr,
+                               self._velocity_arr_name: self._velocity_arr}, **self.kernel_params)
+
+    def time_step(self):
+        for kernel, boundary_index_arr in self._boundary_kernels:
+            kernel(indexField=boundary_index_arr, **{self._pdf_arr_name: self._pdf_arr}, **self.kernel_params)
+        self._lbm_kernel(**self._lbm_kernel_kwargs(self._pdf_arr, self._tmp_arr))
+        self._pdf_arr, self._tmp_arr = self._tmp_arr, self._pdf_arr
+
+    def get_time_loop(self):
+        fixed_loop = TimeLoop(steps=2)
+        fixed_loop.add_post_run_function(self.post_run)
+        fixed_loop.add_single_step_function(self.time_step)
+
+        src, dst = self._pdf_arr, self._tmp_arr
+        for t in range(2):
+            for kernel, boundary_index_arr in self._boundary_kernels:
+                fixed_loop.add_call(kernel, {'indexField': boundary_index_arr, self._pdf_arr_name: src,
+                                             **self.kernel_params})
+            fixed_loop.add_call(self._lbm_kernel, self._lbm_kernel_kwargs(src, dst))
+            src, dst = dst, src
+        return fixed_loop
+
+    def post_run(self):
+        mapping = self._mapping
+        self._getter_kernel(**{self._pdf_arr_name: mapping.fluid_part(self._pdf_arr),
+                               self._density_arr_name: mapping.fluid_part(self._density_arr),
+                               self._velocity_arr_name: mapping.fluid_part(self._velocity_arr)},
+                            **self.kernel_params)
+
+    def run(self, time_steps):
+        time_loop = self.get_time_loop()
+        time_loop.run(time_steps)
+        self.time_steps_run += time_loop.time_steps_run
+
+    def benchmark_run(self, time_steps, number_of_cells=None):
+        """Runs the given number of time steps and returns the performance in fluid lattice updates per second."""
+        if number_of_cells is None:
+            number_of_cells = self.number_of_cells
+        time_loop = self.get_time_loop()
+        duration_of_time_step = time_loop.benchmark_run(time_steps)
+        mlups = number_of_cells / duration_of_time_step * 1e-6
+        self.time_steps_run += time_loop.time_steps_run
+        return mlups
+
+    def benchmark(self, time_for_benchmark=5, init_time_steps=2, number_of_time_steps_for_estimation='auto'):
+        time_loop = self.get_time_loop()
+        duration_of_time_step = time_loop.benchmark(time_for_benchmark, init_time_steps,
+                                                    number_of_time_steps_for_estimation)
+        mlups = self.number_of_cells / duration_of_time_step * 1e-6
+        self.time_steps_run += time_loop.time_steps_run
+        return mlups
+
+    def _create_kernel(self, assignments):
+        return create_kernel(assignments, ghost_layers=0, cpu_openmp=self._optimization['openmp'])
+
+    def _lbm_kernel_kwargs(self, src, dst):
+        fluid_part = self._mapping.fluid_part
+        return {self._pdf_arr_name: fluid_part(src), self._tmp_arr_name: fluid_part(dst),
+                self._index_arr_name: self._index_arr, **self.kernel_params}
@@ -4,6 +4,7 @@ import numpy as np
 import sympy as sp
 
 from lbmpy.boundaries.boundaryhandling import LbmWeightInfo
+from lbmpy.max_domain_size_info import convert_memory_size
 from pystencils import Assignment, Field, TypedSymbol
 from pystencils.boundaries.boundaryhandling import BoundaryOffsetInfo
 from pystencils.boundaries.createindexlist import (
@@ -13,13 +14,50 @@ from pystencils.boundaries.createindexlist import (
 class SparseLbMapper:
     """Manages the mapping of cell coordinates to indices and back.
 
+    Coordinates are mapped to list indices either by a dense lookup table with the shape of the flag array,
+    or, if the table would not fit into the given memory budget, by a binary search in the sorted coordinate list.
+
+    The order of the cells in the list can be chosen to improve cache locality of the neighbor accesses: fluid
+    cells always come first, followed by the boundary cells, each group sorted along the selected ordering.
+
+    The memory layout of the value lists (pdfs, index arrays, macroscopic values) is one of
+        - 'SoA': all cells for the first value, then all cells for the second value, ...
+        - 'AoS': all values of the first cell, then all values of the second cell, ...
+        - 'AoSoA': SoA blocks of block_width cells each, the blocks stored one after another. Lists have shape
+          (block_width, number of blocks, values per cell), i.e. two spatial dimensions where the first one is the
+          position in the block. The last block is padded.
+
     Args:
           flag_arr: integer array where each bit corresponds to a boundary or 'fluid'
+          max_lookup_table_size: maximum size of the dense lookup table, in bytes or as string like '512 MB'.
+                                 Pass 0 to always use the sorted search.
+          cell_order: order of cells in the list, one of 'lexicographic', 'morton', 'hilbert' (space filling curves)
+                      or 'blocked' (lexicographic blocks of block_size cells, lexicographic inside each block)
+          block_size: edge length of the blocks for cell_order 'blocked', integer or tuple with one entry per dim
+          layout: memory layout of pdf and index lists, one of 'SoA', 'AoS', 'AoSoA'
+          block_width: number of cells per block for layout 'AoSoA', typically the SIMD width
     """
-    def __init__(self, stencil, flag_arr, fluid_flag, no_slip_flag, other_boundary_mask):
+    CELL_ORDERS = ('lexicographic', 'morton', 'hilbert', 'blocked')
+    LAYOUTS = ('SoA', 'AoS', 'AoSoA')
+
+    def __init__(self, stencil, flag_arr, fluid_flag, no_slip_flag, other_boundary_mask,
+                 max_lookup_table_size='512 MB', cell_order='lexicographic', block_size=8,
+                 layout='SoA', block_width=4):
+        if cell_order not in self.CELL_ORDERS:
+            raise ValueError("Unknown cell order '{}', use one of {}".format(cell_order, self.CELL_ORDERS))
+        if layout not in self.LAYOUTS:
+            raise ValueError("Unknown layout '{}', use one of {}".format(layout, self.LAYOUTS))
         self._flag_arr = flag_arr
+        self.cell_order = cell_order
+        self.block_size = block_size
+        self.layout = layout
+        self.block_width = block_width
         self._coordinate_arr = None
         self._sorter = None  # array of indices that sort _coordinate_arr
+        self._sorted_keys = None  # sorted linear indices of _coordinate_arr, for fast bulk lookup
+        self._lookup_table = None  # cell index for each entry of flag array, -1 if cell is not in list
+        self._max_lookup_table_size = convert_memory_size(max_lookup_table_size)
+        self._last_cell_idx = None  # index of the largest coordinate, returned for missing cells by the lookup table
         self._dirty = True
         self.fluid_flag = fluid_flag
         self.no_slip_flag = no_slip_flag
@@ -42,16 +80,76 @@ class SparseLbMapper:
 
     @property
     def num_fluid_cells(self):
+        if self._dirty:
+            self._assemble()
         return self._num_fluid_cells
 
     @property
     def flag_array(self):
         return self._flag_arr
 
+    @property
+    def uses_lookup_table(self):
+        """True if coordinates are mapped with a dense lookup table, False if the sorted search is used."""
+        return self._flag_arr.size * np.dtype(np.int32).itemsize <= self._max_lookup_table_size
+
+    def pdf_offset(self, cell_indices, direction_indices):
+        """Position of the pdfs of given cells and directions in the pdf list, counted in elements."""
+        cell_indices = np.asarray(cell_indices, dtype=np.int64)
+        direction_indices = np.asarray(direction_indices, dtype=np.int64)
+        if self.layout == 'SoA':
+            return cell_indices + direction_indices * len(self)
+        elif self.layout == 'AoS':
+            return cell_indices * len(self.stencil) + direction_indices
+        else:
+            width = self.block_width
+            return ((cell_indices // width) * len(self.stencil) + direction_indices) * width + cell_indices % width
+
+    def create_list(self, num_cells, values_per_cell, dtype=np.float64):
+        """Allocates a list with values_per_cell entries per cell in the layout of this mapping.
+
+        Pdf lists have to be allocated for all cells with num_cells=len(mapping), lists of macroscopic values
+        usually for the fluid cells only. Lists with one value per cell have no index dimension.
+        """
+        if self.layout == 'SoA':
+            result = np.empty((num_cells, values_per_cell), dtype=dtype, order='F')
+        elif self.layout == 'AoS':
+            result = np.empty((num_cells, values_per_cell), dtype=dtype)
+        else:
+            num_blocks = -(-num_cells // self.block_width)
+            result = np.empty((num_blocks, values_per_cell, self.block_width), dtype=dtype).transpose(2, 0, 1)
+        return result[..., 0] if values_per_cell == 1 else result
+
+    def fluid_part(self, list_arr):
+        """Part of a list that kernels iterating over all fluid cells have to be called with."""
+        if self.layout == 'AoSoA':
+            return list_arr[:, :-(-self.num_fluid_cells // self.block_width)]
+        return list_arr[:self.num_fluid_cells]
+
+    def list_values(self, list_arr, num_cells=None):
+        """Values of a list in cell order as array of shape (num_cells, values_per_cell), or (num_cells,)."""
+        if self.layout == 'AoSoA':
+            list_arr = np.swapaxes(list_arr, 0, 1).reshape((-1,) + list_arr.shape[2:])
+        return list_arr[:num_cells]
+
+    def set_list_values(self, list_arr, values):
+        """Inverse of :meth:`list_values`: writes values of the first len(values) cells into the list."""
+        if self.layout == 'AoSoA':
+            cell_indices = np.arange(len(values))
+            list_arr[cell_indices % self.block_width, cell_indices // self.block_width] = values
+        else:
+            list_arr[:len(values)] = values
+
     def cell_idx(self, coordinate: Tuple[int, ...]) -> np.uint32:
         """Maps from coordinates (x,y,z) or (x,y) tuple to the list index. Raises ValueError if coordinate not found."""
         if self._dirty:
             self._assemble()
+        if self._lookup_table is not None:
+            coordinate = tuple(int(c) for c in coordinate)
+            inside = all(0 <= c < size for c, size in zip(coordinate, self._flag_arr.shape))
+            if not inside or self._lookup_table[coordinate] < 0:
+                raise IndexError("Coordinate not found")
+            return np.uint32(self._lookup_table[coordinate])
         coordinate = np.array(coordinate, dtype=self._coordinate_arr.dtype)
         left = np.searchsorted(self._coordinate_arr, coordinate, sorter=self._sorter, side='left')
         right = np.searchsorted(self._coordinate_arr, coordinate, sorter=self._sorter, side='right')
@@ -61,11 +159,28 @@ class SparseLbMapper:
             return self._sorter[left]
 
     def cell_idx_bulk(self, coordinates):
-        coordinates = coordinates.astype(self._coordinate_arr.dtype)
-        left = np.searchsorted(self._coordinate_arr, coordinates, sorter=self._sorter, side='left')
-        right = np.searchsorted(self._coordinate_arr, coordinates, sorter=self._sorter, side='right')
-        left[left + 1 != right] = -1
-        return self._sorter[left]
+        """Vectorized version of :meth:`cell_idx` for a structured array of coordinates.
+
+        Coordinates that are not in the list are mapped to an arbitrary index instead of raising an error.
+        """
+        if self._dirty:
+            self._assemble()
+        coordinates = coordinates.astype(self._coordinate_arr.dtype, copy=False)
+        if self._lookup_table is not None:
+            index = tuple(coordinates[name] for name in coordinates.dtype.names)
+            inside = np.logical_and.reduce([c < size for c, size in zip(index, self._flag_arr.shape)])
+            if np.all(inside):
+                result = self._lookup_table[index]
+            else:
+                result = np.full(coordinates.shape, -1, dtype=self._lookup_table.dtype)
+                result[inside] = self._lookup_table[tuple(c[inside] for c in index)]
+            return np.where(result < 0, self._last_cell_idx, result).astype(np.uint32)
+        keys = self._linear_keys(coordinates)
+        positions = np.searchsorted(self._sorted_keys, keys)
+        found = positions < len(self._sorted_keys)
+        found[found] = self._sorted_keys[positions[found]] == keys[found]
+        positions[~found] = -1
+        return self._sorter[positions]
 
     def coordinate(self, cell_idx: int) -> Tuple[np.uint32, ...]:
         """Maps from a cell index to its coordinate.
@@ -91,6 +206,9 @@ class SparseLbMapper:
         # Add fluid cells
         coordinates_fluid = np.argwhere(np.bitwise_and(self._flag_arr, self.fluid_flag)).astype(np.uint32)
         coordinates_boundary = np.argwhere(np.bitwise_and(self._flag_arr, self.other_boundary_mask)).astype(np.uint32)
+        if self.cell_order != 'lexicographic':
+            coordinates_fluid = coordinates_fluid[self._cell_permutation(coordinates_fluid)]
+            coordinates_boundary = coordinates_boundary[self._cell_permutation(coordinates_boundary)]
         self._num_fluid_cells = coordinates_fluid.shape[0]
 
         total_cells = len(coordinates_fluid) + len(coordinates_boundary)
@@ -100,58 +218,148 @@ class SparseLbMapper:
             self._coordinate_arr[d_name][:self._num_fluid_cells] = coordinates_fluid[:, d]
             self._coordinate_arr[d_name][self._num_fluid_cells:] = coordinates_boundary[:, d]
 
-        self._sorter = np.argsort(self._coordinate_arr).astype(np.uint32)
+        if self.uses_lookup_table:
+            self._lookup_table = np.full(self._flag_arr.shape, -1, dtype=np.int32)
+            self._lookup_table[tuple(self._coordinate_arr[name] for name in struct_type.names)] = np.arange(total_cells)
+            self._sorter = self._sorted_keys = None
+            # missing coordinates are mapped to the same index as in the sorted search
+            self._last_cell_idx = np.argmax(self._linear_keys(self._coordinate_arr)) if total_cells else 0
+        else:
+            self._lookup_table = None
+            self._sorter = np.argsort(self._coordinate_arr).astype(np.uint32)
+            self._sorted_keys = self._linear_keys(self._coordinate_arr)[self._sorter]
         self._dirty = False
 
-    def create_index_array(self, ghost_layers=1):
-        # TODO support different layouts here
+    def _cell_permutation(self, coordinates):
+        """Permutation that sorts lexicographically ordered (n, dim) coordinates along the selected cell order."""
+        bits = max(1, int(np.ceil(np.log2(max(self._flag_arr.shape)))))
+        if self.cell_order == 'morton':
+            keys = _interleave_bits(coordinates, bits)
+        elif self.cell_order == 'hilbert':
+            keys = _interleave_bits(_hilbert_transpose(coordinates, bits), bits)
+        else:
+            block_size = self.block_size
+            if not hasattr(block_size, '__len__'):
+                block_size = (block_size,) * coordinates.shape[1]
+            block_coordinates = coordinates // np.array(block_size, dtype=coordinates.dtype)
+            # np.lexsort sorts by last key first
+            return np.lexsort(tuple(coordinates.T[::-1]) + tuple(block_coordinates.T[::-1]))
+        return np.argsort(keys, kind='stable')
+
+    def _linear_keys(self, coordinates):
+        """Row-major linear indices of coordinates in the flag array, -1 for coordinates outside of it.
+
+        Linear indices are ordered like the coordinate tuples, so they can be searched in _sorter order.
+        """
+        keys = np.zeros(coordinates.shape, dtype=np.int64)
+        inside = np.ones(coordinates.shape, dtype=bool)
+        for name, size in zip(coordinates.dtype.names, self._flag_arr.shape):
+            coordinate = coordinates[name].astype(np.int64)
+            inside &= (coordinate >= 0) & (coordinate < size)
+            keys = keys * size + coordinate
+        keys[~inside] = -1
+        return keys
+
+    def create_index_array(self, ghost_layers=1, chunk_size=None):
+        """Creates the array of pdf indices that are pulled into each fluid cell during streaming.
+
+        Entry (i, d-1) holds the position (see :meth:`pdf_offset`) in the sparse pdf list of the pdf that is streamed
+        into fluid cell i from direction d. Pdfs that would come from no-slip cells are replaced by the bounced-back
+        pdf of the cell itself. Neighbors in the outermost ghost layer that are neither fluid nor boundary are wrapped
+        around periodically. The index array is stored in the layout of the mapping, for 'AoSoA' padding cells in the
+        last block point to their own pdfs.
+
+        Args:
+            ghost_layers: number of ghost layers of the flag array
+            chunk_size: number of fluid cells processed at once. Limits the size of temporary arrays for large
+                        domains; if None, all cells are processed in one go
+
+        Returns:
+            uint32 array of shape (num_fluid_cells, len(stencil) - 1), or (block_width, number of blocks,
+            len(stencil) - 1) for 'AoSoA'
+        """
         stencil = self.stencil
+        fluid_coordinates = self.fluid_coordinates
+        num_fluid_cells = self.num_fluid_cells
+        dim = len(self.flag_array.shape)
+        coordinate_names = boundary_index_array_coordinate_names[:dim]
 
-        def pdf_index(cell_index, direction_index):
-            return cell_index + direction_index * len(self)
+        directions = [(idx, d) for idx, d in enumerate(stencil) if any(d_i != 0 for d_i in d)]
+        assert len(directions) == len(stencil) - 1 and stencil.index(tuple([0] * dim)) == 0
 
-        def inverse_idx(idx):
-            return stencil.index(tuple(-d_i for d_i in stencil[idx]))
+        if chunk_size is None:
+            chunk_size = max(num_fluid_cells, 1)
 
+        if self.layout == 'AoSoA':
+            num_rows = -(-num_fluid_cells // self.block_width) * self.block_width
+        else:
+            num_rows = num_fluid_cells
+        result = self.create_list(num_rows, len(directions), dtype=np.uint32)
+        # index array in cell order - for 'SoA' and 'AoS' the result itself
+        rows = np.empty((num_rows, len(directions)), dtype=np.uint32) if self.layout == 'AoSoA' else result
+        for start in range(0, num_fluid_cells, chunk_size):
+            chunk = fluid_coordinates[start:start + chunk_size]
+            cells = np.stack([chunk[name] for name in coordinate_names], axis=1).astype(np.int64)
+            own_cell_indices = np.arange(start, start + len(cells), dtype=np.int64)
+            for column, (direction_idx, direction) in enumerate(directions):
+                cell_indices, pdf_directions = self._pull_sources(cells, own_cell_indices, direction_idx,
+                                                                  ghost_layers)
+                rows[start:start + len(cells), column] = self.pdf_offset(cell_indices, pdf_directions)
+
+        if self.layout == 'AoSoA':
+            padding_cells = np.arange(num_fluid_cells, num_rows)[:, np.newaxis]
+            rows[num_fluid_cells:] = self.pdf_offset(padding_cells, [idx for idx, _ in directions])
+            result[...] = rows.reshape(-1, self.block_width, len(directions)).swapaxes(0, 1)
+        return result
+
+    def _pull_sources(self, cells, own_cell_indices, direction_idx, ghost_layers):
+        """Cell and direction indices of the pdfs streamed into the given cells from direction direction_idx."""
+        stencil = self.stencil
+        direction = stencil[direction_idx]
+        inverse_direction_idx = stencil.index(tuple(-d_i for d_i in direction))
         flag_arr = self.flag_array
-        no_slip_flag = self.no_slip_flag
         fluid_boundary_mask = self.other_boundary_mask | self.fluid_flag
 
-        result = []
-        for direction_idx, direction in enumerate(stencil):
-            if all(d_i == 0 for d_i in direction):
-                assert direction_idx == 0
-                continue
-            for own_cell_idx, cell in enumerate(self.fluid_coordinates):
-                inv_neighbor_cell = np.array([cell_i - dir_i for cell_i, dir_i in zip(cell, direction)])
-                if flag_arr[tuple(inv_neighbor_cell)] & fluid_boundary_mask:
-                    neighbor_cell_idx = self.cell_idx(tuple(inv_neighbor_cell))
-                    result.append(pdf_index(neighbor_cell_idx, direction_idx))
-                elif flag_arr[tuple(inv_neighbor_cell)] & no_slip_flag:  # no-slip before periodicity!
-                    result.append(pdf_index(own_cell_idx, inverse_idx(direction_idx)))
-                else:
-                    at_border = False
-                    for i, x_i in enumerate(inv_neighbor_cell):
-                        if x_i == (ghost_layers - 1):
-                            inv_neighbor_cell[i] += flag_arr.shape[i] - (2 * ghost_layers)
-                            at_border = True
-                        elif x_i == flag_arr.shape[i] - ghost_layers:
-                            inv_neighbor_cell[i] -= flag_arr.shape[i] - (2 * ghost_layers)
-                            at_border = True
-                    if at_border:
-                        assert flag_arr[tuple(inv_neighbor_cell)] & fluid_boundary_mask
-                        neighbor_cell_idx = self.cell_idx(tuple(inv_neighbor_cell))
-                        result.append(pdf_index(neighbor_cell_idx, direction_idx))
-                    else:
-                        raise ValueError("Could not find neighbor for {} direction {}".format(cell, direction))
-
-        index_array = np.array(result, dtype=np.uint32)
-        index_arr = index_array.reshape([len(stencil) - 1, self.num_fluid_cells])
-        index_arr = index_arr.swapaxes(0, 1)
-        return index_arr
+        neighbors = cells - np.array(direction, dtype=np.int64)
+        flags = flag_arr[tuple(neighbors.T)]
+        in_list = np.bitwise_and(flags, fluid_boundary_mask) != 0
+        no_slip = ~in_list & (np.bitwise_and(flags, self.no_slip_flag) != 0)  # no-slip before periodicity!
+        periodic = ~(in_list | no_slip)
+
+        if np.any(periodic):
+            wrapped = neighbors[periodic]
+            at_border = np.zeros(len(wrapped), dtype=bool)
+            for i, size in enumerate(flag_arr.shape):
+                lower = wrapped[:, i] == ghost_layers - 1
+                upper = wrapped[:, i] == size - ghost_layers
+                wrapped[lower, i] += size - 2 * ghost_layers
+                wrapped[upper, i] -= size - 2 * ghost_layers
+                at_border |= lower | upper
+            if not np.all(at_border):
+                cell = cells[periodic][np.argmin(at_border)]
+                raise ValueError("Could not find neighbor for {} direction {}".format(tuple(cell), direction))
+            assert np.all(np.bitwise_and(flag_arr[tuple(wrapped.T)], fluid_boundary_mask))
+            neighbors[periodic] = wrapped
+            in_list |= periodic
+
+        neighbor_coordinates = np.empty(np.count_nonzero(in_list), dtype=self._coordinate_arr.dtype)
+        for i, name in enumerate(neighbor_coordinates.dtype.names):
+            neighbor_coordinates[name] = neighbors[in_list, i]
+
+        cell_indices = np.empty(len(cells), dtype=np.int64)
+        cell_indices[in_list] = self.cell_idx_bulk(neighbor_coordinates)
+        cell_indices[no_slip] = own_cell_indices[no_slip]
+        pdf_directions = np.where(no_slip, inverse_direction_idx, direction_idx)
+        return cell_indices, pdf_directions
 
 
 class SparseLbBoundaryMapper:
+    """Boundary kernel and index list for a sparse pdf list.
+
+    For each boundary link the index list stores the list indices of the cells the boundary accesses, or for
+    layout 'AoSoA' the position of their first pdf. For 'AoSoA' the pdf field has to be two dimensional like the
+    lists created by the mapping, and the index list gets a second dimension of size one.
+    """
     NEIGHBOR_IDX_NAME = 'nidx{}'
     DIR_SYMBOL = TypedSymbol("dir", np.uint32)
 
@@ -170,19 +378,22 @@ class SparseLbBoundaryMapper:
         index_field_dtype = np.dtype([('dir', np.uint32),
                                       *neighbor_offsets_dtype,
                                       *boundary.additional_data])
-        index_field = Field.create_generic('indexField', spatial_dimensions=1, dtype=index_field_dtype)
+        # all fields of a kernel need the same number of spatial dimensions
+        index_field = Field.create_generic('indexField', spatial_dimensions=pdf_field_sparse.spatial_dimensions,
+                                           dtype=index_field_dtype, layout=pdf_field_sparse.layout)
         boundary_eqs = boundary(full_pdf_field, self.DIR_SYMBOL, method, index_field)
 
         offset_subs = {off: sp.Symbol(self.NEIGHBOR_IDX_NAME.format(i)) for i, off in enumerate(neighbor_offsets)}
+        padding = [0] * (pdf_field_sparse.spatial_dimensions - 1)
 
         new_boundary_eqs = []
         for eq in boundary_eqs:
             substitutions = {
-                fa: pdf_field_sparse.absolute_access([index_field(offset_subs[fa.offsets].name)], fa.index)
+                fa: pdf_field_sparse.absolute_access([index_field(offset_subs[fa.offsets].name), *padding], fa.index)
                 for fa in eq.atoms(Field.Access)
                 if fa.field == full_pdf_field
             }
-            new_boundary_eqs.append(eq.subs(substitutions))
+            new_boundary_eqs.append(eq.xreplace(substitutions))
 
         self.boundary_eqs = new_boundary_eqs
         self.boundary_eqs_orig = boundary_eqs
@@ -225,14 +436,63 @@ class SparseLbBoundaryMapper:
                                 for substitution in substitutions])
             for i, coord_name in enumerate(coord_names):
                 neighbor_coordinates[coord_name] += offsets[:, i][idx_arr['dir']]
-            result[self.NEIGHBOR_IDX_NAME.format(j)] = mapping.cell_idx_bulk(neighbor_coordinates)
+            neighbor_indices = mapping.cell_idx_bulk(neighbor_coordinates)
+            if mapping.layout == 'AoSoA':
+                neighbor_indices = mapping.pdf_offset(neighbor_indices, 0)
+            result[self.NEIGHBOR_IDX_NAME.format(j)] = neighbor_indices
 
         result[direction_member_name] = idx_arr[direction_member_name]
-        # Find neighbor indices
-        return result
+        return result[:, np.newaxis] if mapping.layout == 'AoSoA' else result
 
     def assignments(self):
         return [BoundaryOffsetInfo(self.method.stencil),
                 LbmWeightInfo(self.method),
                 Assignment(self.DIR_SYMBOL, self.index_field(self.DIR_SYMBOL.name)),
                 *self.boundary_eqs]
+
+
+# ---------------------------------------- Helper Functions ------------------------------------------------------------
+
+
+def _interleave_bits(coordinates, bits):
+    """Morton (Z-order) keys of (n, dim) integer coordinates, first coordinate is the most significant."""
+    coordinates = coordinates.astype(np.uint64)
+    dim = coordinates.shape[1]
+    keys = np.zeros(len(coordinates), dtype=np.uint64)
+    for b in range(bits):
+        for d in range(dim):
+            bit = (coordinates[:, d] >> np.uint64(b)) & np.uint64(1)
+            keys |= bit << np.uint64(b * dim + dim - 1 - d)
+    return keys
+
+
+def _hilbert_transpose(coordinates, bits):
+    """Hilbert index of (n, dim) coordinates in transposed form: interleaving the bits gives the curve index.
+
+    Vectorized version of the 'AxestoTranspose' algorithm by J. Skilling, 'Programming the Hilbert curve' (2004).
+    """
+    x = coordinates.astype(np.uint64)
+    dim = x.shape[1]
+    top = 1 << (bits - 1)
+
+    q = top
+    while q > 1:
+        p = np.uint64(q - 1)
+        for i in range(dim):
+            bit_set = (x[:, i] & np.uint64(q)) != 0
+            x[bit_set, 0] ^= p
+            exchange = ~bit_set
+            t = (x[exchange, 0] ^ x[exchange, i]) & p
+            x[exchange, 0] ^= t
+            x[exchange, i] ^= t
+        q >>= 1
+
+    for i in range(1, dim):
+        x[:, i] ^= x[:, i - 1]
+    t = np.zeros(len(x), dtype=np.uint64)
+    q = top
+    while q > 1:
+        t[(x[:, dim - 1] & np.uint64(q)) != 0] ^= np.uint64(q - 1)
+        q >>= 1
+    x ^= t[:, np.newaxis]
+    return x
@@ -0,0 +1,177 @@
+"""Choice between dense arrays and sparse lists for the pdfs of a scenario.
+
+Dense storage keeps the pdfs of every cell and updates obstacle cells as well, sparse storage only keeps fluid and
+boundary cells but needs an index array to find the neighbors. Which one is faster depends on the fluid fraction:
+
+>>> import numpy as np
+>>> flag_arr = np.zeros((102, 102), dtype=np.uint32)
+>>> flag_arr[1:-1, 1:-1] = 1
+>>> flag_arr[1:-1, 1:-1][np.random.RandomState(0).rand(100, 100) > 0.15] = 2
+>>> costs = estimate_storage_costs(flag_arr, fluid_flag=1, other_boundary_mask=0, q=9)
+>>> costs['sparse']['traffic'] < costs['dense']['traffic']
+True
+
+Both kernels are memory bound, so the estimates count the bytes that have to be transferred per time step
+(criterion 'traffic') or the bytes allocated (criterion 'memory'):
+
+    - dense: 2 pdf arrays, density and velocity for all cells, pdfs of all inner cells are read and written each step
+    - sparse: 2 pdf lists, density and velocity for fluid and boundary cells, plus one 32 bit index per fluid cell and
+      non-center direction; pdfs and indices of the fluid cells are read and pdfs written each step
+
+Use :func:`select_storage` after setting up the geometry of a :class:`lbmpy.lbstep.LatticeBoltzmannStep`, e.g. with
+one of the functions in :mod:`lbmpy.scenarios`, to continue with the cheaper representation.
+"""
+import numpy as np
+
+from lbmpy.boundaries import NoSlip
+from lbmpy.sparse.lbstep_sparse import SparseLatticeBoltzmannStep
+
+STORAGE_CRITERIA = ('traffic', 'memory')
+
+
+def estimate_storage_costs(flag_arr, fluid_flag, other_boundary_mask, q, ghost_layers=1, dtype=np.float64,
+                           index_dtype=np.uint32):
+    """Memory and memory traffic per time step of dense and sparse storage of a domain.
+
+    Args:
+        flag_arr: flag array including ghost layers, for blocked data handlings the array of a single block
+        fluid_flag: flag bit that marks fluid cells
+        other_boundary_mask: flag bits of all boundaries except no-slip, these cells are part of the sparse lists
+        q: number of pdfs per cell
+        ghost_layers: number of ghost layers of the flag array
+        dtype: data type of pdfs and macroscopic values
+        index_dtype: data type of the sparse index array
+
+    Returns:
+        dict {'dense': {'memory': bytes, 'traffic': bytes}, 'sparse': {...}}, the traffic is given per time step
+    """
+    value_size = np.dtype(dtype).itemsize
+    index_size = np.dtype(index_dtype).itemsize
+    dim = len(flag_arr.shape)
+    values_per_cell = 2 * q + dim + 1
+
+    inner_cells = int(np.prod([s - 2 * ghost_layers for s in flag_arr.shape]))
+    num_fluid_cells = np.count_nonzero(np.bitwise_and(flag_arr, fluid_flag))
+    num_list_cells = np.count_nonzero(np.bitwise_and(flag_arr, fluid_flag | other_boundary_mask))
+
+    return {
+        'dense': {'memory': flag_arr.size * (values_per_cell * value_size + flag_arr.itemsize),
+                  'traffic': inner_cells * 2 * q * value_size},
+        'sparse': {'memory': num_list_cells * values_per_cell * value_size + num_fluid_cells * (q - 1) * index_size,
+                   'traffic': num_fluid_cells * (2 * q * value_size + (q - 1) * index_size)},
+    }
+
+
+def choose_storage(step, criterion='traffic'):
+    """Cheaper storage for each block of a :class:`lbmpy.lbstep.LatticeBoltzmannStep`.
+
+    Args:
+        step: scenario with boundaries already set up
+        criterion: 'traffic' to minimize time per step, or 'memory'
+
+    Returns:
+        list with 'dense' or 'sparse' for each block on this process, in the order of the data handling's iterate().
+        All blocks are 'dense' if the scenario uses features the sparse kernels do not support.
+    """
+    if criterion not in STORAGE_CRITERIA:
+        raise ValueError("Unknown criterion '{}', use one of {}".format(criterion, STORAGE_CRITERIA))
+    dh = step.data_handling
+    boundary_handling = step.boundary_handling
+    flag_name = boundary_handling.flag_array_name
+    ghost_layers = dh.ghost_layers_of_field(flag_name)
+    dtype = dh.fields[step.pdf_array_name].dtype.numpy_dtype
+    supported = _sparse_supported(step)
+
+    other_boundary_mask = 0
+    for boundary in boundary_handling.boundary_objects:
+        if not isinstance(boundary, NoSlip):
+            other_boundary_mask |= boundary_handling.get_flag(boundary)
+
+    result = []
+    for b in dh.iterate(ghost_layers=ghost_layers):
+        costs = estimate_storage_costs(b[flag_name], boundary_handling.flag_interface.domain_flag, other_boundary_mask,
+                                       len(step.method.stencil), ghost_layers, dtype)
+        sparse_is_cheaper = costs['sparse'][criterion] < costs['dense'][criterion]
+        result.append('sparse' if supported and sparse_is_cheaper else 'dense')
+    return result
+
+
+def select_storage(step, criterion='traffic', **sparse_step_kwargs):
+    """Returns the step itself, or an equivalent :class:`lbmpy.sparse.SparseLatticeBoltzmannStep` if that is cheaper.
+
+    Sparse steps consist of a single block, so for data handlings with multiple blocks the dense step is returned.
+    Use :func:`choose_storage` to get the choice per block in this case.
+
+    Args:
+        step: scenario with boundaries and initial values already set up
+        criterion: see :func:`choose_storage`
+        sparse_step_kwargs: passed on to :func:`sparse_step_from_dense`
+    """
+    storage = choose_storage(step, criterion)
+    if storage == ['sparse']:
+        return sparse_step_from_dense(step, **sparse_step_kwargs)
+    return step
+
+
+def sparse_step_from_dense(step, **kwargs):
+    """Creates a :class:`lbmpy.sparse.SparseLatticeBoltzmannStep` with method, geometry and macroscopic values of
+    a dense single block :class:`lbmpy.lbstep.LatticeBoltzmannStep`.
+
+    Ghost layers in periodic directions are filled with the boundaries of the opposite side of the domain,
+    ghost layers in other directions have to be covered by boundaries. The pdfs of all fluid and boundary cells are
+    copied, so the sparse step continues the simulation where the dense one stopped.
+
+    Args:
+        step: dense scenario
+        kwargs: passed on to :class:`lbmpy.sparse.SparseLatticeBoltzmannStep`, e.g. layout or optimization
+    """
+    dh = step.data_handling
+    if len(list(dh.iterate())) != 1:
+        raise NotImplementedError("Only scenarios with a single block can be converted to sparse storage")
+    boundary_handling = step.boundary_handling
+    flag_name = boundary_handling.flag_array_name
+    fluid_flag = boundary_handling.flag_interface.domain_flag
+    ghost_layers = dh.ghost_layers_of_field(flag_name)
+    flag_arr = _periodic_flag_array(dh.gather_array(flag_name, ghost_layers=True), dh.periodicity, fluid_flag,
+                                    ghost_layers)
+
+    boundaries = {boundary_handling.get_flag(b): b for b in boundary_handling.boundary_objects}
+    kwargs.setdefault('name', step.name)
+    kwargs.setdefault('kernel_params', step.kernel_params)
+    double_precision = dh.fields[step.pdf_array_name].dtype.numpy_dtype == np.float64
+    kwargs.setdefault('optimization', {'double_precision': double_precision})
+    sparse_step = SparseLatticeBoltzmannStep(flag_arr, boundaries, fluid_flag=fluid_flag, ghost_layers=ghost_layers,
+                                             lb_method=step.method, **kwargs)
+
+    mapping = sparse_step.mapping
+    coordinates = mapping.coordinates
+    pdf_arr = dh.gather_array(step.pdf_array_name, ghost_layers=ghost_layers)
+    mapping.set_list_values(sparse_step.pdf_list, pdf_arr[tuple(coordinates[name] for name in coordinates.dtype.names)])
+    sparse_step.run(0)  # computes density and velocity
+    return sparse_step
+
+
+# ---------------------------------------- Helper Functions ------------------------------------------------------------
+
+
+def _sparse_supported(step):
+    boundaries = step.boundary_handling.boundary_objects
+    return step.data_handling.default_target == 'cpu' and all(not b.additional_data for b in boundaries)
+
+
+def _periodic_flag_array(flag_arr, periodicity, fluid_flag, ghost_layers):
+    """Flag array for a sparse mapping: periodic ghost layers get the flags of the opposite side, without fluid."""
+    flag_arr = flag_arr.copy()
+    ghost_slices = (slice(0, ghost_layers), slice(-ghost_layers, None))
+    for d, periodic in enumerate(periodicity):
+        if periodic:
+            inner_size = flag_arr.shape[d] - 2 * ghost_layers
+            source_slices = (slice(inner_size, inner_size + ghost_layers), slice(ghost_layers, 2 * ghost_layers))
+            for ghost_slice, source_slice in zip(ghost_slices, source_slices):
+                ghost = (slice(None),) * d + (ghost_slice,)
+                flag_arr[ghost] = flag_arr[(slice(None),) * d + (source_slice,)] & ~fluid_flag
+    for d, periodic in enumerate(periodicity):
+        ghost_flags = [flag_arr[(slice(None),) * d + (s,)] for s in ghost_slices]
+        if not periodic and any(np.any(np.bitwise_and(f, fluid_flag) != 0) for f in ghost_flags):
+            raise ValueError("Ghost layers in non-periodic direction {} have to be boundaries".format(d))
+    return flag_arr
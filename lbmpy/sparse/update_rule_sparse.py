@@ -1,25 +1,47 @@
 from pystencils import Assignment, AssignmentCollection
+from pystencils.astnodes import LoopOverCoordinate
 # noinspection PyProtectedMember
 from pystencils.field import Field, FieldType, compute_strides
 
 AC = AssignmentCollection
 
 
-def create_symbolic_list(name, num_cells, values_per_cell, dtype, layout='AoS'):
-    assert layout in ('AoS', 'SoA')
-    layout = (0, 1) if layout == 'AoS' else (1, 0)
-    if values_per_cell > 1:
-        shape = (num_cells, values_per_cell)
-        spatial_layout = (0,)
+def create_symbolic_list(name, num_cells, values_per_cell, dtype, layout='SoA', block_width=4):
+    """Creates a field for a list of values per cell, see :class:`lbmpy.sparse.SparseLbMapper` for the layouts.
+
+    Args:
+        name: name of the field
+        num_cells: number of cells in the list, or None for a list whose length is only known when the kernel is
+                   called
+        values_per_cell: number of values per cell, lists with a single value have no index dimension
+        dtype: data type
+        layout: 'SoA', 'AoS' or 'AoSoA', the default matches the default of :class:`lbmpy.sparse.SparseLbMapper`
+        block_width: number of cells per block for layout 'AoSoA'
+    """
+    assert layout in ('SoA', 'AoS', 'AoSoA')
+    spatial_dimensions = 2 if layout == 'AoSoA' else 1
+    spatial_layout = (1, 0) if layout == 'AoSoA' else (0,)
+    if num_cells is None:
+        index_shape = (values_per_cell,) if values_per_cell > 1 else ()
+        return Field.create_generic(name, spatial_dimensions, dtype, index_shape=index_shape, layout=spatial_layout,
+                                    field_type=FieldType.CUSTOM)
+
+    if layout == 'AoSoA':
+        shape = (block_width, -(-num_cells // block_width))
+        layout = (1, 2, 0)
     else:
         shape = (num_cells,)
-        spatial_layout = (0,)
-        layout = (0,)
+        layout = (0, 1) if layout == 'AoS' else (1, 0)
+    if values_per_cell > 1:
+        shape += (values_per_cell,)
+    else:
+        layout = tuple(d for d in layout if d < len(shape))
     strides = compute_strides(shape, layout)
     return Field(name, FieldType.CUSTOM, dtype, spatial_layout, shape, strides)
 
 
-def create_lb_update_rule_sparse(collision_rule, src, dst, idx, kernel_type='stream_pull_collide') -> AC:
+def create_lb_update_rule_sparse(collision_rule, src, dst, idx, kernel_type='stream_pull_collide',
+                                 layout='SoA') -> AC:
     """Creates a update rule from a collision rule using compressed pdf storage and two (src/dst) arrays.
 
     Args:
@@ -28,6 +50,8 @@ def create_lb_update_rule_sparse(collision_rule, src, dst, idx, kernel_type='str
         dst: symbolic field to write to
         idx: symbolic index field
         kernel_type: one of 'stream_pull_collide', 'collide_only' or 'stream_pull_only'
+        layout: layout of the pdf lists, has to match the layout of the
+                :class:`lbmpy.sparse.SparseLbMapper` that created the index array
     Returns:
         update rule
     """
@@ -35,7 +59,7 @@ def create_lb_update_rule_sparse(collision_rule, src, dst, idx, kernel_type='str
     method = collision_rule.method
     q = len(method.stencil)
 
-    symbol_subs = _list_substitutions(method, src, idx)
+    symbol_subs = _list_substitutions(method, src, idx, layout=layout)
 
     if kernel_type == 'stream_pull_only':
         assignments = []
@@ -46,8 +70,11 @@ def create_lb_update_rule_sparse(collision_rule, src, dst, idx, kernel_type='str
                 assignments.append(Assignment(lhs, rhs))
         return AssignmentCollection(assignments, subexpressions=[])
     else:
-        write_target = src if kernel_type == 'collide_only' else dst
-        symbol_subs.update({sym: write_target(i) for i, sym in enumerate(method.post_collision_pdf_symbols)})
+        if kernel_type == 'collide_only':
+            write_targets = [_center_access(src, i, layout) for i in range(q)]
+        else:
+            write_targets = [dst(i) for i in range(q)]
+        symbol_subs.update({sym: target for sym, target in zip(method.post_collision_pdf_symbols, write_targets)})
         return collision_rule.new_with_substitutions(symbol_subs)
 
 
@@ -83,13 +110,37 @@ def create_macroscopic_value_setter_sparse(method, pdfs, density, velocity) -> A
 # ---------------------------------------- Helper Functions ------------------------------------------------------------
 
 
-def _list_substitutions(method, src, idx, store_center=False):
+def _list_substitutions(method, src, idx, store_center=False, layout='SoA'):
     if store_center:
-        result = {sym: src.absolute_access((idx(i),), ())
+        result = {sym: _list_access(src, idx(i), layout)
                   for i, sym in enumerate(method.pre_collision_pdf_symbols)}
     else:
-        result = {sym: src.absolute_access((idx(i - 1),), ())
+        result = {sym: _list_access(src, idx(i - 1), layout)
                   for i, sym in enumerate(method.pre_collision_pdf_symbols)}
-        result[method.pre_collision_pdf_symbols[0]] = src(0)
+        result[method.pre_collision_pdf_symbols[0]] = _center_access(src, 0, layout)
 
     return result
+
+
+def _center_access(field, index, layout):
+    """Access to the value of the current cell.
+
+    pystencils names the intermediate base pointers of two dimensional fields by the access offsets only, so
+    relative and absolute accesses to the same 'AoSoA' list would share a pointer. Thus the center is accessed
+    absolutely as well, assuming unit stride of the first coordinate.
+    """
+    if layout != 'AoSoA':
+        return field(index)
+    lane, block = (LoopOverCoordinate.get_loop_counter_symbol(i) for i in range(2))
+    return field.absolute_access((lane + block * field.strides[1], 0), (index,))
+
+
+def _list_access(field, position, layout):
+    """Access to the element at the given position, counted in elements from the start of the list.
+
+    The position is put on the coordinate with unit stride - for 'AoS' this is the index coordinate.
+    """
+    assert layout in ('AoS', 'SoA', 'AoSoA')
+    if layout == 'AoS':
+        return field.absolute_access((0,), (position,))
+    return field.absolute_access((position,) + (0,) * (field.spatial_dimensions - 1), ())
@@ -1,22 +1,39 @@
-"""Function to process benchmark results in pandas."""
-from pystencils.runhelper.db import Database, remove_constant_columns
+"""Function to process benchmark results in pandas.
+
+Results are loaded from the store given by the environment variable LBMPY_BENCHMARK_DB, e.g. a file written by
+``python -m lbmpy.benchmark run``, see :func:`lbmpy.benchmark.open_result_store`. By default the mongodb database
+'lbmpy_bench' is used.
+"""
+import os
+
+from lbmpy.benchmark import open_result_store
 
 db = None
 
-def get_categorical(query):
+
+def get_store():
     global db
     if db is None:
-        db = Database('mongo://lbmpy_bench')
-    res = basic_clean_up(db.to_pandas(query))
+        db = open_result_store(os.environ.get('LBMPY_BENCHMARK_DB', 'mongo://lbmpy_bench'))
+    return db
+
+
+def get_categorical(query):
+    res = basic_clean_up(get_store().to_pandas(query))
     res = make_categorical(res)
     return res
 
 
 def get(query, **kwargs):
-    global db
-    if db is None:
-        db = Database('mongo://lbmpy_bench')
-    return basic_clean_up(db.to_pandas(query, **kwargs))
+    return basic_clean_up(get_store().to_pandas(query, **kwargs))
+
+
+def remove_constant_columns(df):
+    """Removes all columns of a pandas data frame that have the same value in all rows."""
+    import pandas as pd
+    remaining_df = df.loc[:, df.apply(pd.Series.nunique) > 1]
+    constants = df.loc[:, df.apply(pd.Series.nunique) <= 1].iloc[0]
+    return remaining_df, constants
 
 
 def remove_all_column_prefixes(df, inplace=False):
@@ -1,142 +1,12 @@
 from statistics import median
 
-import numpy as np
 import pytest
-import sympy as sp
 
-from lbmpy.scenarios import create_lid_driven_cavity
+from lbmpy.benchmark import benchmark_scenarios, run_benchmark
 from pystencils.cpu.cpujit import add_or_change_compiler_flags
 from pystencils.runhelper import ParameterStudy
 
 
-def parameter_filter(parameters):
-    """Returns false for parameter combinations which are invalid or not implemented yet."""
-    is_entropic_kbc = parameters['method'].startswith('trt-kbc-') and parameters.get("entropic", False)
-    if is_entropic_kbc and parameters['stencil'] == 'D3Q19':
-        return False
-    if is_entropic_kbc and not parameters['compressible']:
-        return False
-    return True
-
-
-def optimization_options_cpu(all_vectorization_options=False, all_cse_options=False, cores=(1,), with_split=False,
-                             instruction_set='avx'):
-    """Generator of different CPU optimization options.
-
-    Args:
-        all_vectorization_options: if true, explore all different vectorization possibilities (x6 more options)
-        all_cse_options: if true, explore all cse options
-        cores: sequence of core numbers
-        with_split: if true, yield configurations with and without split, otherwise only without split
-        instruction_set: 'sse', 'avx' or 'avx2'
-    """
-
-    if all_vectorization_options:
-        vectorization_options = [
-            {'instruction_set': instruction_set,
-             'assume_aligned': assume_aligned,
-             'nontemporal': nontemporal,
-             'assume_inner_stride_one': True,
-             'assume_sufficient_line_padding': lp}
-            for assume_aligned in (False, True)
-            for nontemporal in ((False, True) if assume_aligned else (False,))
-            for lp in (False, True)
-        ]
-        vectorization_options.append(False)
-    else:
-        vectorization_options = [{'instruction_set': instruction_set, 'assume_aligned': True,
-                                  'nontemporal': True, 'assume_inner_stride_one': True}]
-
-    if all_cse_options:
-        cse_options = [
-            {'cse_pdfs': cse_pdfs, 'cse_global': cse_global}
-            for cse_pdfs in (False, True) for cse_global in (False, True)
-        ]
-    else:
-        cse_options = [{'cse_pdfs': False, 'cse_global': True}]
-
-    for vectorization_option in vectorization_options:
-        for cse_option in cse_options:
-            for split in (False, True) if with_split else (False,):
-                for openmp in cores:
-                    for field_layout in ('fzyx', 'zyxf'):
-                        if field_layout == 'zyxf' and vectorization_option is not False:
-                            continue
-                        opt_option = cse_option.copy()
-                        opt_option['vectorization'] = vectorization_option
-                        opt_option['split'] = split
-                        opt_option['openmp'] = openmp
-                        opt_option['field_layout'] = field_layout
-                        yield opt_option
-
-
-def method_options(dim=2, with_srt=False, with_mrt=False,
-                   with_entropic=False, with_cumulant=False, with_smagorinsky=False, with_d3q27=True):
-    """Generator for different lbmpy method parameters
-
-    Args:
-        dim: 2D or 3D
-        with_srt: include single relaxation time models (by default only TRT are included)
-        with_mrt: include multi-relaxation time models
-        with_entropic: include entropic models
-        with_cumulant: include cumulant models
-        with_smagorinsky: include methods with Smagorinsky turbulence model
-    """
-    relaxation_rates = tuple(np.linspace(1.1, 1.9, 27))
-    rr_free = "rr_free"
-    methods = [{'method': 'trt'}]
-    if with_mrt:
-        methods += [{'method': 'mrt'}, {'method': 'mrt_raw'}]
-
-    if with_srt:
-        methods += [{'method': 'srt'}]
-
-    if with_entropic:
-        methods += [{'entropic': True, 'method': 'mrt', 'relaxation_rates': [1.5, 1.5, rr_free, rr_free,
-                                                                             rr_free, rr_free]},
-                    {'entropic': True, 'method': 'mrt', 'relaxation_rates': [1.5, rr_free, rr_free, rr_free,
-                                                                             rr_free, rr_free]},
-                    {'entropic': True, 'method': 'trt-kbc-n1'},
-                    {'entropic': True, 'method': 'trt-kbc-n2'},
-                    {'entropic': True, 'method': 'trt-kbc-n3'},
-                    {'entropic': True, 'method': 'trt-kbc-n4'},
-                    {'method': 'entropic-srt'}]
-
-    if with_cumulant:
-        methods += [{'cumulant': True, 'method': 'srt'},
-                    {'cumulant': True, 'method': 'trt'},
-                    {'cumulant': True, 'method': 'mrt3'},
-                    {'cumulant': True, 'method': 'mrt_raw'}]
-
-    if with_smagorinsky:
-        methods += [{'smagorinsky': True, 'method': 'srt'},
-                    {'smagorinsky': True, 'method': 'mrt3'}]
-
-    stencils3d = ('D3Q19', 'D3Q27') if with_d3q27 else ("D3Q19",)
-    for stencil in ("D2Q9",) if dim == 2 else stencils3d:
-        for method in methods:
-            options = {'compressible': True, 'stencil': stencil, 'relaxation_rates': relaxation_rates}
-            options.update(method)
-            if parameter_filter(options):
-                yield options
-
-
-def benchmark_scenarios(domain_size, method_option_params={}, optimization_option_params={},
-                        fixed_loop_sizes=True, fixed_relaxation_rates=True):
-
-    method_option_params['dim'] = len(domain_size)
-    for method_option in method_options(**method_option_params):
-        for optimization in optimization_options_cpu(**optimization_option_params):
-            result = method_option.copy()
-            result.update({
-                'domain_size': domain_size,
-                'optimization': optimization,
-                'fixed_loop_sizes': fixed_loop_sizes,
-                'fixed_relaxation_rates': fixed_relaxation_rates,
-            })
-            yield result
-
-
 def run(domain_size, **kwargs):
     color = {'yellow': '\033[93m',
              'blue': '\033[94m',
@@ -147,9 +17,6 @@ def run(domain_size, **kwargs):
     study_name = kwargs.get('study_name', 'study')
     del kwargs['study_name']
 
-    if 'relaxation_rates' in kwargs:
-        kwargs['relaxation_rates'] = [sp.sympify(e) for e in kwargs['relaxation_rates']]
-
     if 'compiler_flags' in kwargs:
         add_or_change_compiler_flags(kwargs['compiler_flags'].split())
         del kwargs['compiler_flags']
@@ -162,25 +29,18 @@ def run(domain_size, **kwargs):
                 "comp: {compressible:d}, const_loop: {fixed_loop_sizes:d}, const_rr: {fixed_relaxation_rates:d}, " \
                 "{green}opt: {opt_str}{cend}"
     param_str = param_str.format(opt_str=opt_str, domain_size=domain_size, **kwargs, **color)
-    sc = create_lid_driven_cavity(domain_size, **kwargs)
-
-    mlups = [sc.benchmark(time_for_benchmark=2) for _ in range(5)]
-    if not np.isfinite(sc.data_handling.max(sc.velocity_data_name)):
+    result = run_benchmark(domain_size, **kwargs)
+    if not result['stable']:
         print("-> ", param_str, " got unstable", flush=True)
-        return {'mlups_max': None,
-                'mlups_median': None,
-                'all_measurements': [],
-                'stable': False,
-                'study_name': study_name}
+        result['study_name'] = study_name
+        return result
 
+    mlups = result['all_measurements']
     result_str = "  {yellow}{bold}{mlups:.0f}±{diff:.2f} MLUPS {cend}".format(mlups=median(mlups),
                                                                               diff=max(mlups) - min(mlups),
                                                                               **color)
     print("-> ", param_str, result_str, flush=True)
-    return {'mlups_max': max(mlups),
-            'mlups_median': median(mlups),
-            'all_measurements': mlups,
-            'stable': True}
+    return result
 
 
 def study_optimization_options(study, domain_sizes=((1024, 1024), (256, 256, 128)),
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from lbmpy.creationfunctions import create_lb_update_rule
+from lbmpy.lbstep import LatticeBoltzmannStep
+from lbmpy.phasefield.cahn_hilliard_lbm import CahnHilliardLbmStep, batched_update_rule, cahn_hilliard_lb_method
+from lbmpy.stencils import get_stencil
+from pystencils import Field, create_data_handling, create_kernel
+
+
+@pytest.mark.parametrize('stencil_name', ['D2Q9', 'D3Q19'])
+def test_batched_update_rule(stencil_name):
+    stencil = get_stencil(stencil_name)
+    dim, q = len(stencil[0]), len(stencil)
+    dh = create_data_handling((6,) * dim, periodicity=True, default_layout='fzyx')
+    mu = dh.add_array('mu', values_per_cell=2)
+    u = dh.add_array('u', values_per_cell=dim)
+    phi, phi_batched = dh.add_array('phi', values_per_cell=2), dh.add_array('phi_batched', values_per_cell=2)
+    pdfs = [(dh.add_array('src_%d' % i, values_per_cell=q), dh.add_array('dst_%d' % i, values_per_cell=q))
+            for i in range(2)]
+    stacked = [dh.add_array(name, values_per_cell=(2, q), layout='reverse_numpy') for name in ('src', 'dst')]
+
+    methods = [cahn_hilliard_lb_method(stencil, mu(i), relaxation_rate=1.2 + 0.3 * i, gamma=1 + i) for i in range(2)]
+    kernels = [create_kernel(create_lb_update_rule(lb_method=method, velocity_input=u, output={'density': phi(i)},
+                                                   optimization={'symbolic_field': src,
+                                                                 'symbolic_temporary_field': dst})).compile()
+               for i, (method, (src, dst)) in enumerate(zip(methods, pdfs))]
+
+    generic_src, generic_dst = (Field.create_generic(n, dim, index_shape=(q,)) for n in ('generic_src', 'generic_dst'))
+    update_rules = [create_lb_update_rule(lb_method=method, velocity_input=u, output={'density': phi_batched(i)},
+                                          optimization={'symbolic_field': generic_src,
+                                                        'symbolic_temporary_field': generic_dst})
+                    for i, method in enumerate(methods)]
+    batched_kernel = create_kernel(batched_update_rule(update_rules, [generic_src, generic_dst], stacked),
+                                   ghost_layers=1).compile()
+
+    np.random.seed(42)
+    for name in ('mu', 'u', 'src_0', 'src_1'):
+        dh.cpu_arrays[name][...] = np.random.rand(*dh.cpu_arrays[name].shape)
+    for i in range(2):
+        dh.cpu_arrays['src'][..., i, :] = dh.cpu_arrays['src_%d' % i]
+
+    for kernel in kernels:
+        dh.run_kernel(kernel)
+    dh.run_kernel(batched_kernel)
+
+    inner = (slice(1, -1),) * dim
+    for i in range(2):
+        np.testing.assert_equal(dh.cpu_arrays['dst'][inner + (i,)], dh.cpu_arrays['dst_%d' % i][inner])
+    np.testing.assert_equal(dh.cpu_arrays['phi_batched'][inner], dh.cpu_arrays['phi'][inner])
+
+
+def test_cahn_hilliard_lbm_step():
+    dh = create_data_handling((16, 12), periodicity=True)
+    for name in ('phi', 'phi_reference', 'mu'):
+        dh.add_array(name, values_per_cell=3)
+    dh.add_array('u', values_per_cell=2)
+
+    relaxation_rates, gammas = [1.0, 1.3, 1.6], [1, 2, 3]
+    order_parameter_indices = [0, 2]
+    batched = CahnHilliardLbmStep(dh, 'phi', 'mu', 'u', order_parameter_indices, 'D2Q9',
+                                  relaxation_rates=relaxation_rates, gammas=gammas)
+    references = []
+    for i in order_parameter_indices:
+        method = cahn_hilliard_lb_method('D2Q9', dh.fields['mu'](i), relaxation_rates[i], gammas[i])
+        references.append(LatticeBoltzmannStep(data_handling=dh, lb_method=method, velocity_input_array_name='u',
+                                               velocity_data_name='u', density_data_name='phi_reference',
+                                               density_data_index=i, compute_density_in_every_step=True,
+                                               name='reference_%d' % i))
+
+    np.random.seed(0)
+    for name in ('phi', 'mu', 'u'):
+        dh.cpu_arrays[name][...] = 0.1 * np.random.rand(*dh.cpu_arrays[name].shape)
+    dh.cpu_arrays['phi_reference'][...] = dh.cpu_arrays['phi']
+    for step in [batched] + references:
+        step.set_pdf_fields_from_macroscopic_values()
+    for _ in range(10):
+        for step in [batched] + references:
+            step.time_step()
+
+    np.testing.assert_allclose(dh.gather_array('phi'), dh.gather_array('phi_reference'), atol=1e-13)
+    for k, reference in enumerate(references):
+        np.testing.assert_allclose(dh.gather_array(batched.pdf_array_name)[..., k, :],
+                                   dh.gather_array(reference.pdf_array_name), atol=1e-13)
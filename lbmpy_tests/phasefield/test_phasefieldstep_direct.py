@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+import sympy as sp
+
+from lbmpy.phasefield.phasefieldstep_direct import PhaseFieldStepDirect
+from pystencils import make_slice
+from pystencils.fd import Diff
+
+
+def test_deprecated_per_phase_attributes():
+    c = sp.symbols("c_:2")
+    free_energy = sum(0.005 * c_i ** 2 * (1 - c_i) ** 2 + 0.005 * Diff(c_i) ** 2 for c_i in c)
+    free_energy += 0.01 * (1 - sum(c)) ** 2
+    step = PhaseFieldStepDirect(free_energy, c, (16, 16))
+    step.set_single_concentration(make_slice[:, 0.5:], phase_idx=0)
+    step.set_single_concentration(make_slice[:, :0.5], phase_idx=1)
+    step.set_pdf_fields_from_macroscopic_values()
+    for _ in range(5):
+        step.time_step()
+    assert np.isfinite(step.phi[:, :]).all()
+
+    with pytest.warns(DeprecationWarning):
+        kernels = step.ch_lb_kernels
+    with pytest.warns(DeprecationWarning):
+        pdfs = step.ch_pdfs
+    # usage pattern of the former per order parameter kernels and pdf fields
+    for kernel, (src, dst) in zip(kernels, pdfs):
+        assert kernel is step.ch_lb_kernel
+        assert (src, dst) == step.ch_pdf_fields
+        assert src.index_shape == (2, 9)
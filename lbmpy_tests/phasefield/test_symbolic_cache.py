@@ -0,0 +1,66 @@
+import sympy as sp
+
+from lbmpy.phasefield.analytical import (
+    chemical_potentials_from_free_energy, free_energy_functional_n_phases_penalty_term)
+from lbmpy.phasefield.kerneleqs import force_kernel_using_pressure_tensor, mu_kernel, pressure_tensor_kernel
+from lbmpy.phasefield.n_phase_boyer import chemical_potential_n_phase_boyer
+from lbmpy.phasefield.symbolic_cache import SymbolicCache, set_symbolic_cache
+from pystencils import fields
+
+
+def kernel_equations(free_energy, order_parameters):
+    phi, mu, pressure_tensor, force = fields("phi(3), mu(3), P(3), F(2): [2D]")
+    return (mu_kernel(free_energy, order_parameters, phi, mu),
+            pressure_tensor_kernel(free_energy, order_parameters, phi, pressure_tensor),
+            force_kernel_using_pressure_tensor(force, pressure_tensor))
+
+
+def test_cached_derivation(tmp_path):
+    c = sp.symbols("c_:3")
+    free_energy = free_energy_functional_n_phases_penalty_term(c, 1, (0.01, 0.01, 0.005))
+    previous_cache = set_symbolic_cache(SymbolicCache(tmp_path))
+    try:
+        reference = kernel_equations(free_energy, c)
+        reference[0].append(None)  # results are copies, modifying them does not change the cache
+        # new cache object for the same directory behaves like a cache in another process
+        cache = SymbolicCache(tmp_path)
+        set_symbolic_cache(cache)
+        result = kernel_equations(free_energy, c)
+        # chemical potential of each order parameter, its discretization, pressure tensor and force
+        assert cache.statistics['misses'] == 0 and cache.statistics['hits'] == 6
+        assert list(result) == [reference[0][:-1], reference[1], reference[2]]
+
+        kernel_equations(free_energy_functional_n_phases_penalty_term(c, 1, (0.01, 0.01, 0.006)), c)
+        assert cache.statistics['misses'] > 0
+
+        # fields that differ only in their data type are different arguments
+        phi32, phi64 = fields("phi(3): float32[2D]"), fields("phi(3): float64[2D]")
+        pressure_tensor = fields("P(3): [2D]")
+        assert (pressure_tensor_kernel.cache_key(free_energy, c, phi32, pressure_tensor)
+                != pressure_tensor_kernel.cache_key(free_energy, c, phi64, pressure_tensor))
+        assert (force_kernel_using_pressure_tensor.cache_key(pressure_tensor, pressure_tensor, [phi32(0)])
+                != force_kernel_using_pressure_tensor.cache_key(pressure_tensor, pressure_tensor, [phi64(0)]))
+
+        cache.clear()
+        assert cache.statistics['disk_entries'] == 0
+    finally:
+        set_symbolic_cache(previous_cache)
+
+
+def test_parallel_chemical_potentials():
+    c = sp.symbols("c_:3")
+    free_energy = free_energy_functional_n_phases_penalty_term(c, 1, (0.01, 0.01, 0.005))
+    previous_cache = set_symbolic_cache(None)
+    try:
+        parallel = chemical_potentials_from_free_energy(free_energy, c, processes=2)
+        set_symbolic_cache(None)
+        assert parallel == chemical_potentials_from_free_energy(free_energy, c)
+    finally:
+        set_symbolic_cache(previous_cache)
+
+
+def test_uncacheable_arguments():
+    c = sp.symbols("c_:3")
+    # lambda functions can not be hashed across processes, the result is computed without cache
+    assert chemical_potential_n_phase_boyer.cache_key(c, 1, lambda i, j: 1, 0) is None
+    assert chemical_potential_n_phase_boyer.cache_key(c, 1, sp.ones(3, 3), 0) is not None
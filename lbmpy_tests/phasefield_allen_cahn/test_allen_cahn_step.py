@@ -0,0 +1,133 @@
+import math
+
+import numpy as np
+import pytest
+
+from lbmpy.boundaries import NoSlip
+from lbmpy.boundaries.boundaryhandling import LatticeBoltzmannBoundaryHandling
+from lbmpy.creationfunctions import create_lb_method, create_lb_update_rule
+from lbmpy.phasefield_allen_cahn.allen_cahn_step import AllenCahnStep
+from lbmpy.phasefield_allen_cahn.force_model import MultiphaseForceModel
+from lbmpy.phasefield_allen_cahn.kernel_equations import (
+    get_collision_assignments_hydro, hydrodynamic_force, initializer_kernel_hydro_lb, initializer_kernel_phase_field_lb,
+    interface_tracking_force)
+from lbmpy.phasefield_allen_cahn.parameter_calculation import calculate_parameters_rti
+from lbmpy.stencils import get_stencil
+from pystencils import create_data_handling, create_kernel, make_slice
+
+domain_size = (32, 64)
+interface_thickness = 5
+parameters = calculate_parameters_rti(reference_length=domain_size[0], reference_time=200, density_heavy=1.0,
+                                      capillary_number=0.44, reynolds_number=300, atwood_number=0.5,
+                                      peclet_number=100, density_ratio=3, viscosity_ratio=1)
+parameters = {'density_light': parameters['density_light'],
+              'relaxation_time_heavy': parameters['relaxation_time_heavy'],
+              'relaxation_time_light': parameters['relaxation_time_light'],
+              'mobility': parameters['mobility'],
+              'surface_tension': parameters['surface_tension'],
+              'gravitational_acceleration': parameters['gravitational_acceleration']}
+
+
+def set_initial_phi(dh, phi_name):
+    for block in dh.iterate(ghost_layers=True, inner_ghost_layers=False):
+        x, y = block.midpoint_arrays[0], block.midpoint_arrays[1]
+        perturbation = 0.1 * domain_size[0] * np.cos(2 * math.pi * x / domain_size[0])
+        block[phi_name][...] = 0.5 + 0.5 * np.tanh((y - domain_size[1] / 2 - perturbation) / (interface_thickness / 2))
+
+
+def reference_simulation(time_steps):
+    """Separate collision and streaming of the hydrodynamic LBM, as in the Allen-Cahn notebooks"""
+    stencil = get_stencil('D2Q9')
+    dh = create_data_handling(domain_size, periodicity=(True, False))
+    g, g_tmp, h, h_tmp = (dh.add_array(n, values_per_cell=9) for n in ('g', 'g_tmp', 'h', 'h_tmp'))
+    u = dh.add_array('u', values_per_cell=2)
+    phi = dh.add_array('phi')
+    for name in dh.array_names:
+        dh.fill(name, 0.0, ghost_layers=True)
+
+    tau = 0.5 + parameters['relaxation_time_light'] + phi.center * (parameters['relaxation_time_heavy']
+                                                                    - parameters['relaxation_time_light'])
+    rho_light = parameters['density_light']
+    rho = rho_light + phi.center * (1 - rho_light)
+    beta = 12.0 * parameters['surface_tension'] / interface_thickness
+    kappa = 1.5 * parameters['surface_tension'] * interface_thickness
+    method_phase = create_lb_method(stencil=stencil, method='srt', compressible=True,
+                                    relaxation_rate=1 / (0.5 + 3 * parameters['mobility']))
+    method_hydro = create_lb_method(stencil=stencil, method='mrt', weighted=True, maxwellian_moments=True,
+                                    relaxation_rates=[1 / tau, 1, 1, 1, 1, 1], entropic=False)
+
+    h_init = create_kernel(initializer_kernel_phase_field_lb(h, phi, u, method_phase, interface_thickness)).compile()
+    g_init = create_kernel(initializer_kernel_hydro_lb(g, u, method_hydro)).compile()
+
+    force_h = [f / 3 for f in interface_tracking_force(phi, stencil, interface_thickness)]
+    method_phase.set_force_model(MultiphaseForceModel(force=force_h))
+    force_g = hydrodynamic_force(g, phi, method_hydro, tau, 1.0, rho_light, kappa, beta,
+                                 [0, parameters['gravitational_acceleration'] * rho, 0])
+    allen_cahn_lb = create_lb_update_rule(lb_method=method_phase, velocity_input=u, compressible=True,
+                                          optimization={'symbolic_field': h, 'symbolic_temporary_field': h_tmp},
+                                          kernel_type='stream_pull_collide')
+    allen_cahn_lb.set_main_assignments_from_dict({**allen_cahn_lb.main_assignments_dict,
+                                                  phi.center: sum(h_tmp.center_vector)})
+    allen_cahn_kernel = create_kernel(allen_cahn_lb).compile()
+    hydro_lb = get_collision_assignments_hydro(lb_method=method_hydro, density=rho, velocity_input=u, force=force_g,
+                                               optimization={'symbolic_field': g, 'symbolic_temporary_field': g_tmp},
+                                               kernel_type='collide_only')
+    hydro_kernel = create_kernel(hydro_lb).compile()
+    stream_g = create_kernel(create_lb_update_rule(stencil=stencil, kernel_type='stream_pull_only',
+                                                   optimization={'symbolic_field': g,
+                                                                 'symbolic_temporary_field': g_tmp})).compile()
+
+    sync_g, sync_h, sync_phi = (dh.synchronization_function([name]) for name in ('g', 'h', 'phi'))
+    bh_phase = LatticeBoltzmannBoundaryHandling(method_phase, dh, 'h', name='bh_h')
+    bh_hydro = LatticeBoltzmannBoundaryHandling(method_hydro, dh, 'g', name='bh_g')
+    for bh in (bh_phase, bh_hydro):
+        bh.set_boundary(NoSlip(), make_slice[:, 0])
+        bh.set_boundary(NoSlip(), make_slice[:, -1])
+
+    set_initial_phi(dh, 'phi')
+    dh.run_kernel(h_init)
+    dh.run_kernel(g_init)
+    for _ in range(time_steps):
+        bh_phase()
+        sync_h()
+        dh.run_kernel(allen_cahn_kernel)
+        sync_phi()
+        dh.run_kernel(hydro_kernel)
+        bh_hydro()
+        sync_g()
+        dh.run_kernel(stream_g)
+        dh.swap('h', 'h_tmp')
+        dh.swap('g', 'g_tmp')
+    return dh.gather_array('phi'), dh.gather_array('u')
+
+
+def create_rayleigh_taylor_instability(**kwargs):
+    dh = create_data_handling(domain_size, periodicity=(True, False))
+    step = AllenCahnStep(data_handling=dh, **parameters, **kwargs)
+    step.set_boundary(NoSlip(), make_slice[:, 0])
+    step.set_boundary(NoSlip(), make_slice[:, -1])
+    set_initial_phi(dh, step.phi_field_name)
+    step.set_pdf_fields_from_macroscopic_values()
+    return step
+
+
+def test_allen_cahn_step():
+    step = create_rayleigh_taylor_instability()
+    assert set(step.data_handling.array_names) == {step.phi_field_name, step.vel_field_name,
+                                                   *step.phase_pdf_field_names, *step.hydro_pdf_field_names,
+                                                   step.flag_interface.flag_field_name}
+    phi_sum = np.sum(step.phi[:, :])
+    step.run(20)
+    assert step.time_steps_run == 20
+    # the conservative Allen-Cahn model conserves the amount of the heavy fluid
+    np.testing.assert_allclose(np.sum(step.phi[:, :]), phi_sum, rtol=1e-10)
+
+    reference_phi, reference_velocity = reference_simulation(20)
+    np.testing.assert_allclose(step.phi[:, :], reference_phi, atol=1e-12)
+    np.testing.assert_allclose(step.velocity[:, :], reference_velocity, atol=1e-12)
+
+    assert step.benchmark(time_for_benchmark=0.05, number_of_time_steps_for_estimation=2) > 0
+    assert step.time_steps_run > 20
+
+    with pytest.raises(ValueError):
+        AllenCahnStep(domain_size, optimization={'target': 'gpu'})
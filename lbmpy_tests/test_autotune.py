@@ -0,0 +1,57 @@
+import platform
+
+import pytest
+
+import lbmpy.kernel_cache
+from lbmpy.autotune import (
+    TuningStore, _tuning_key, autotune, default_candidates, machine_fingerprint, optimization_options_cpu)
+from lbmpy.kernel_cache import KernelCache
+
+
+def test_autotune(tmp_path):
+    store = TuningStore(tmp_path / 'tuning.json')
+    candidates = list(optimization_options_cpu(instruction_set=None))
+    assert [c['field_layout'] for c in candidates] == ['fzyx', 'zyxf']
+    kwargs = {'candidates': candidates, 'store': store, 'time_steps': 4, 'repetitions': 1,
+              'kernel_cache': KernelCache(tmp_path / 'kernels'), 'stencil': 'D2Q9', 'method': 'srt',
+              'relaxation_rate': 1.8}
+
+    best = autotune((32, 16), **kwargs)
+    assert best in candidates
+    (key, result), = store.results().items()
+    assert result['optimization'] == best
+    assert len(result['timings']) == 2 and result['mlups'] > 0
+
+    # stored results are returned without timing, for this machine only
+    store.set(key, dict(result, optimization={'field_layout': 'zyxf'}))
+    assert autotune((32, 16), **kwargs) == {'field_layout': 'zyxf'}
+    assert TuningStore(tmp_path / 'tuning.json').get(key) is not None
+    assert TuningStore(tmp_path / 'tuning.json', fingerprint='other machine').get(key) is None
+    assert autotune((32, 16), **dict(kwargs, retune=True)) in candidates
+    assert autotune((32, 17), **kwargs) in candidates
+    assert len(store.results()) == 2
+
+    with pytest.warns(UserWarning):
+        assert autotune((32, 16), **dict(kwargs, candidates=[{'field_layout': 'unknown'}] + candidates,
+                                         store=False)) in candidates
+    with pytest.raises(ValueError):
+        with pytest.warns(UserWarning):
+            autotune((32, 16), **dict(kwargs, candidates=[{'field_layout': 'unknown'}], store=False))
+
+    store.clear()
+    assert store.results() == {}
+    assert all(c['openmp'] >= 1 for c in default_candidates())
+
+
+def test_results_shared_across_nodes_and_lbmpy_versions(tmp_path, monkeypatch):
+    method_parameters = {'stencil': 'D2Q9', 'method': 'srt', 'relaxation_rate': 1.8}
+    fingerprint = machine_fingerprint()
+    key = _tuning_key((32, 16), [{'field_layout': 'fzyx'}], method_parameters)
+    store = TuningStore(tmp_path / 'tuning.json')
+    store.set(key, {'optimization': {'field_layout': 'fzyx'}})
+
+    monkeypatch.setattr(platform, 'node', lambda: 'other-node')
+    monkeypatch.setattr(lbmpy.kernel_cache, '_environment_description', lambda: 'other lbmpy sources')
+    assert machine_fingerprint() == fingerprint
+    assert _tuning_key((32, 16), [{'field_layout': 'fzyx'}], method_parameters) == key
+    assert TuningStore(tmp_path / 'tuning.json').get(key) == {'optimization': {'field_layout': 'fzyx'}}
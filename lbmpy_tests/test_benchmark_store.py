@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from lbmpy.benchmark import (
+    JsonLinesResultStore, SqliteResultStore, benchmark_scenarios, compare_results, main, open_result_store,
+    run_phase_field_benchmark)
+
+
+@pytest.mark.parametrize('file_name', ['results.jsonl', 'results.db'])
+def test_result_store(tmp_path, file_name):
+    store = open_result_store(str(tmp_path / 'sub' / file_name))
+    assert isinstance(store, SqliteResultStore if file_name.endswith('.db') else JsonLinesResultStore)
+    assert list(store.documents()) == []
+
+    params = {'stencil': 'D2Q9', 'domain_size': (16, 16), 'relaxation_rates': tuple(np.linspace(1.1, 1.9, 3)),
+              'optimization': {'openmp': 1, 'vectorization': False}}
+    store.save(params, {'mlups_median': 10.0}, env={'lbmpy_version': 'a'})
+    store.save(dict(params, stencil='D2Q9'), {'mlups_median': 11.0}, env={'lbmpy_version': 'b'}, study_name='s')
+    store.save(dict(params, domain_size=(32, 32)), {'mlups_median': 20.0})
+
+    documents = list(open_result_store(str(tmp_path / 'sub' / file_name)).documents())
+    assert len(documents) == 3
+    assert documents[0]['params']['domain_size'] == [16, 16]
+    assert documents[1]['study_name'] == 's'
+    assert 'machine_fingerprint' in documents[2]['env'] and 'lbmpy_version' in documents[2]['env']
+
+    assert store.was_already_simulated(params)
+    assert not store.was_already_simulated(dict(params, stencil='D2Q5'))
+    assert len(store.filter_params({'domain_size': (16, 16)})) == 2
+    assert [d['result']['mlups_median'] for d in store.filter_env({'lbmpy_version': 'b'})] == [11.0]
+
+
+def test_compare_results():
+    def doc(method, mlups):
+        return {'params': {'method': method}, 'result': {'mlups_median': mlups}, 'env': {}}
+
+    baseline = [doc('srt', 100), doc('srt', 90), doc('trt', 100), doc('mrt', 100), doc('cumulant', None),
+                doc('kbc', 0)]
+    current = [doc('srt', 96), doc('trt', 50), doc('mrt', 80), doc('cumulant', 10), doc('entropic', 1),
+               doc('kbc', 20)]
+    regressions = compare_results(baseline, current, threshold=0.05)
+    assert [(r['params']['method'], r['ratio']) for r in regressions] == [('trt', 0.5), ('mrt', 0.8)]
+    assert compare_results(baseline, current, threshold=0.3)[0]['baseline'] == 100
+    # a run dropping to 0 is a regression, only baselines of 0 are skipped
+    assert [(r['params']['method'], r['ratio']) for r in compare_results(current, baseline)] == [('kbc', 0)]
+
+
+def test_command_line(tmp_path, capsys):
+    store_file = str(tmp_path / 'results.db')
+    run_args = ['run', store_file, '--domain-size', '16', '8', '--instruction-set', 'none', '--with-srt',
+                '--time', '0.01', '--repetitions', '2']
+    assert main(run_args + ['--dry-run']) == 0
+    assert list(open_result_store(store_file).documents()) == []
+    assert len(capsys.readouterr().out.splitlines()) == len(list(benchmark_scenarios(
+        (16, 8), {'with_srt': True}, {'instruction_set': None}))) == 4
+
+    assert main(run_args + ['--version-label', 'old']) == 0
+    documents = list(open_result_store(store_file).documents())
+    assert len(documents) == 4 and all(d['result']['stable'] and d['env']['lbmpy_version'] == 'old'
+                                       for d in documents)
+    assert main(run_args + ['--skip-existing']) == 0
+    assert len(list(open_result_store(store_file).documents())) == 4
+
+    # a faster copy of the results is no regression, a slower one is
+    new_store = SqliteResultStore(tmp_path / 'new.db')
+    for d in documents:
+        new_store.save(d['params'], {'mlups_median': d['result']['mlups_median'] * 2}, env={'lbmpy_version': 'new'})
+        new_store.save(d['params'], {'mlups_median': d['result']['mlups_median'] / 2}, env={'lbmpy_version': 'bad'})
+    capsys.readouterr()
+    assert main(['compare', store_file, str(tmp_path / 'new.db'), '--current-version', 'new']) == 0
+    assert main(['compare', str(tmp_path / 'new.db'), '--baseline-version', 'new', '--current-version', 'bad',
+                 '--threshold', '0.4']) == 1
+    assert "4 regression(s) beyond 40%" in capsys.readouterr().out
+
+
+@pytest.mark.parametrize('store_pressure_tensor', [True, False])
+def test_phase_field_benchmark(store_pressure_tensor):
+    result = run_phase_field_benchmark((12, 12), time_for_benchmark=0.01, repetitions=2,
+                                       store_pressure_tensor=store_pressure_tensor)
+    assert result['stable'] and len(result['all_measurements']) == 2 and result['mlups_median'] > 0
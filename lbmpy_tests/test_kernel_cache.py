@@ -0,0 +1,79 @@
+import multiprocessing
+
+import numpy as np
+
+from lbmpy.creationfunctions import create_lb_function, create_lb_method, update_with_default_parameters
+from lbmpy.kernel_cache import KernelCache, parameter_hash
+from lbmpy.updatekernels import create_pdf_array
+
+
+def run_kernel(kernel, size=(8, 6)):
+    src = create_pdf_array(size, len(kernel.method.stencil), layout='fzyx')
+    src[...] = np.random.RandomState(42).rand(*src.shape)
+    dst = np.zeros_like(src)
+    kernel(src=src, dst=dst)
+    return dst
+
+
+def test_cached_kernel_is_equivalent(tmp_path):
+    params = dict(stencil='D2Q9', method='trt', relaxation_rate=1.8, compressible=True)
+    reference = create_lb_function(**params)
+
+    first = create_lb_function(**params, optimization={'kernel_cache': KernelCache(tmp_path)})
+    # new cache object for the same directory behaves like a cache in another process
+    cache = KernelCache(tmp_path)
+    second = create_lb_function(**params, optimization={'kernel_cache': cache})
+    assert cache.statistics['hits'] == 1
+    assert cache.statistics['misses'] == 0
+    assert cache.statistics['entries'] == 1
+
+    assert second.method.stencil == reference.method.stencil
+    assert len(second.update_rule.main_assignments) == len(reference.update_rule.main_assignments)
+    np.testing.assert_equal(run_kernel(reference), run_kernel(first))
+    np.testing.assert_equal(run_kernel(reference), run_kernel(second))
+
+
+def test_parameter_hash():
+    def key(optimization=None, **kwargs):
+        return parameter_hash(*update_with_default_parameters(kwargs, optimization))
+
+    assert key(stencil='D2Q9', relaxation_rate=1.8) == key(stencil='D2Q9', relaxation_rate=1.8)
+    assert key(stencil='D2Q9', relaxation_rate=1.8) != key(stencil='D2Q9', relaxation_rate=1.7)
+    assert key(stencil='D2Q9', relaxation_rate=1.8) != key(stencil='D2Q9', relaxation_rate=1.8,
+                                                           optimization={'split': True})
+    assert key(stencil='D2Q9', relaxation_rate=1.8) == key(stencil='D2Q9', relaxation_rate=1.8,
+                                                           optimization={'kernel_cache': True})
+    assert key(stencil='D2Q9', relaxation_rate=1.8, force_model='guo', force=(1e-5, 0)) != \
+        key(stencil='D2Q9', relaxation_rate=1.8, force_model='luo', force=(1e-5, 0))
+
+    # objects from earlier pipeline stages are not cached
+    method = create_lb_method(stencil='D2Q9', relaxation_rate=1.8)
+    assert key(lb_method=method) is None
+
+
+def test_lru_eviction(tmp_path):
+    cache = KernelCache(tmp_path, max_size=1)
+    create_lb_function(stencil='D2Q9', relaxation_rate=1.8, optimization={'kernel_cache': cache})
+    create_lb_function(stencil='D2Q9', relaxation_rate=1.7, optimization={'kernel_cache': cache})
+    statistics = cache.statistics
+    assert statistics['misses'] == 2
+    assert statistics['evictions'] == 1
+    assert statistics['entries'] == 1
+
+    create_lb_function(stencil='D2Q9', relaxation_rate=1.7, optimization={'kernel_cache': cache})
+    assert cache.statistics['hits'] == 1
+    cache.clear()
+    assert cache.statistics['entries'] == 0
+
+
+def _create_cached_kernel(cache_dir):
+    cache = KernelCache(cache_dir)
+    create_lb_function(stencil='D2Q9', method='srt', relaxation_rate=1.5, optimization={'kernel_cache': cache})
+    return cache.statistics['misses']
+
+
+def test_concurrent_processes(tmp_path):
+    with multiprocessing.get_context('spawn').Pool(3) as pool:
+        misses = pool.map(_create_cached_kernel, [str(tmp_path)] * 3)
+    assert sum(misses) == 1
+    assert KernelCache(tmp_path).statistics['entries'] == 1
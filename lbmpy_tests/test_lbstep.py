@@ -1,7 +1,11 @@
 import numpy as np
 import pytest
 
-from lbmpy.scenarios import create_fully_periodic_flow, create_lid_driven_cavity
+from lbmpy.boundaries import NeumannByCopy, NoSlip
+from lbmpy.lbstep import LatticeBoltzmannStep
+from lbmpy.scenarios import create_channel, create_fully_periodic_flow, create_lid_driven_cavity
+from pystencils import make_slice
+from pystencils.slicing import slice_from_direction
 
 try:
     import pycuda.driver
@@ -130,3 +134,228 @@ def test_advanced_initialization():
 
     shear_flow_scenario = create_fully_periodic_flow(initial_velocity=init_vel, relaxation_rate=1.6)
     shear_flow_scenario.run_iterative_initialization(max_steps=20000, check_residuum_after=500)
+
+
+@pytest.mark.parametrize('streaming_pattern', ['aa', 'esotwist'])
+@pytest.mark.parametrize('stencil, domain_size', [('D2Q9', (14, 11)), ('D3Q19', (8, 7, 5))])
+def test_in_place_streaming_patterns(streaming_pattern, stencil, domain_size):
+    initial_velocity = np.random.RandomState(0).rand(*domain_size, len(domain_size)) * 0.01
+    method_parameters = {'stencil': stencil, 'method': 'trt', 'relaxation_rate': 1.7, 'compressible': True}
+    reference = create_fully_periodic_flow(initial_velocity, **method_parameters)
+    step = create_fully_periodic_flow(initial_velocity, streaming_pattern=streaming_pattern, **method_parameters)
+    assert not step.data_handling.has_data(step.name + "_pdfTmp")
+
+    whole_domain = (slice(None),) * len(domain_size)
+    for time_steps in (1, 4, 3):
+        reference.run(time_steps)
+        step.run(time_steps)
+        np.testing.assert_almost_equal(step.velocity[whole_domain], reference.velocity[whole_domain], decimal=14)
+        np.testing.assert_almost_equal(step.density[whole_domain], reference.density[whole_domain], decimal=14)
+
+    velocity = step.velocity[whole_domain]
+    step.set_pdf_fields_from_macroscopic_values()  # at odd parity
+    step.run(0)
+    np.testing.assert_almost_equal(step.velocity[whole_domain], velocity, decimal=14)
+
+
+def create_scenario_with_boundaries(scenario, domain_size, **kwargs):
+    dim = len(domain_size)
+    if scenario == 'cavity':
+        step = create_lid_driven_cavity(domain_size, lid_velocity=0.05, **kwargs)
+    elif scenario == 'outflow':
+        step = create_channel(domain_size, pressure_difference=0.002, **kwargs)
+        step.boundary_handling.set_boundary(NeumannByCopy(), slice_from_direction('E', dim))
+    else:  # periodic channel with an obstacle, the walls cross the periodic border
+        step = LatticeBoltzmannStep(domain_size, periodicity=(True,) + (False,) * (dim - 1), **kwargs)
+        for direction in ('N', 'S', 'T', 'B')[:2 * (dim - 1)]:
+            step.boundary_handling.set_boundary(NoSlip(), slice_from_direction(direction, dim))
+        step.boundary_handling.set_boundary(NoSlip(), (slice(3, 6), slice(1, 3)) + (slice(None),) * (dim - 2),
+                                            ghost_layers=False)
+        velocity = np.random.RandomState(0).rand(*domain_size, dim) * 0.01
+        for b in step.data_handling.iterate(ghost_layers=False):
+            b[step.velocity_data_name][...] = velocity[b.global_slice]
+        step.set_pdf_fields_from_macroscopic_values()
+    return step
+
+
+@pytest.mark.parametrize('streaming_pattern', ['aa', 'esotwist'])
+@pytest.mark.parametrize('scenario, domain_size', [('cavity', (12, 9)), ('outflow', (12, 9)),
+                                                   ('periodic', (12, 9)), ('periodic', (8, 6, 5))])
+def test_in_place_streaming_with_boundaries(streaming_pattern, scenario, domain_size):
+    stencil = 'D2Q9' if len(domain_size) == 2 else 'D3Q19'
+    method_parameters = {'stencil': stencil, 'method': 'trt', 'relaxation_rate': 1.7, 'compressible': True}
+    reference = create_scenario_with_boundaries(scenario, domain_size, **method_parameters)
+    step = create_scenario_with_boundaries(scenario, domain_size, streaming_pattern=streaming_pattern,
+                                           **method_parameters)
+
+    whole_domain = (slice(None),) * len(domain_size)
+    for time_steps in (1, 4, 3):
+        reference.run(time_steps)
+        step.run(time_steps)
+        np.testing.assert_almost_equal(step.velocity[whole_domain], reference.velocity[whole_domain], decimal=13)
+        np.testing.assert_almost_equal(step.density[whole_domain], reference.density[whole_domain], decimal=13)
+    assert np.max(np.abs(reference.velocity[whole_domain])) > 1e-4
+
+    with pytest.raises(NotImplementedError):
+        step.boundary_handling.force_on_boundary(NoSlip())
+
+
+@pytest.mark.longrun
+def test_in_place_streaming_benchmark():
+    initial_velocity = np.zeros((100, 100, 100, 3))
+    print("{:<12}{:>14}{:>10}".format("Pattern", "pdf MB", "MLUPS"))
+    for streaming_pattern in ('pull', 'aa', 'esotwist'):
+        step = create_fully_periodic_flow(initial_velocity, streaming_pattern=streaming_pattern, stencil='D3Q19',
+                                          method='srt', relaxation_rate=1.8)
+        arrays = step.data_handling.cpu_arrays
+        pdf_memory = sum(arr.nbytes for name, arr in arrays.items() if name.startswith(step.name + "_pdf"))
+        print("{:<12}{:>14.1f}{:>10.2f}".format(streaming_pattern, pdf_memory / 1e6, step.benchmark(3)))
+
+
+@pytest.mark.parametrize('scenario, domain_size', [('cavity', (12, 9)), ('periodic', (8, 6, 5))])
+def test_overlap_communication(scenario, domain_size):
+    stencil = 'D2Q9' if len(domain_size) == 2 else 'D3Q19'
+    method_parameters = {'stencil': stencil, 'method': 'trt', 'relaxation_rate': 1.7, 'compressible': True}
+    reference = create_scenario_with_boundaries(scenario, domain_size, **method_parameters)
+    step = create_scenario_with_boundaries(scenario, domain_size, overlap_communication=True, **method_parameters)
+    assert len(step._frame_kernels) == 2 * len(domain_size)
+
+    whole_domain = (slice(None),) * len(domain_size)
+    for run in ('run', 'run_old'):
+        getattr(reference, run)(5)
+        getattr(step, run)(5)
+        np.testing.assert_almost_equal(step.velocity[whole_domain], reference.velocity[whole_domain], decimal=14)
+        np.testing.assert_almost_equal(step.density[whole_domain], reference.density[whole_domain], decimal=14)
+    assert np.max(np.abs(reference.velocity[whole_domain])) > 1e-4
+
+    with pytest.raises(ValueError):
+        LatticeBoltzmannStep(domain_size, overlap_communication=True, streaming_pattern='aa', **method_parameters)
+
+
+@pytest.mark.parametrize('ghost_layers', [2, 3])
+@pytest.mark.parametrize('scenario, domain_size', [('cavity', (12, 9)), ('outflow', (12, 9)),
+                                                   ('periodic', (12, 9)), ('periodic', (8, 6, 5))])
+def test_multiple_ghost_layers(scenario, domain_size, ghost_layers):
+    # boundaries are set with the same slices as for a single ghost layer
+    stencil = 'D2Q9' if len(domain_size) == 2 else 'D3Q19'
+    method_parameters = {'stencil': stencil, 'method': 'trt', 'relaxation_rate': 1.7, 'compressible': True}
+    reference = create_scenario_with_boundaries(scenario, domain_size, **method_parameters)
+    step = create_scenario_with_boundaries(scenario, domain_size, ghost_layers=ghost_layers, **method_parameters)
+    assert step.data_handling.default_ghost_layers == ghost_layers
+
+    whole_domain = (slice(None),) * len(domain_size)
+    for run, time_steps in (('run', 5), ('run_old', 4), ('run', 7)):  # exchanges happen at different time steps
+        getattr(reference, run)(time_steps)
+        getattr(step, run)(time_steps)
+        np.testing.assert_almost_equal(step.velocity[whole_domain], reference.velocity[whole_domain], decimal=14)
+        np.testing.assert_almost_equal(step.density[whole_domain], reference.density[whole_domain], decimal=13)
+    assert np.max(np.abs(reference.velocity[whole_domain])) > 1e-4
+
+    with pytest.raises(ValueError):
+        LatticeBoltzmannStep(domain_size, ghost_layers=ghost_layers, streaming_pattern='aa', **method_parameters)
+
+
+def test_multiple_ghost_layers_collide_stream():
+    # collide stream kernels update the inner cells only, ghost layers are exchanged every time step
+    method_parameters = {'stencil': 'D2Q9', 'method': 'trt', 'relaxation_rate': 1.7, 'compressible': True,
+                         'time_step_order': 'collide_stream', 'compute_velocity_in_every_step': True}
+    reference = create_scenario_with_boundaries('periodic', (12, 9), **method_parameters)
+    step = create_scenario_with_boundaries('periodic', (12, 9), ghost_layers=2, **method_parameters)
+    assert not step._sub_step_kernels
+    reference.run(5)
+    step.run(5)
+    np.testing.assert_almost_equal(step.velocity[:, :], reference.velocity[:, :], decimal=14)
+
+
+@pytest.mark.parametrize('temporal_blocking', [3, (2, 2)])
+@pytest.mark.parametrize('scenario, domain_size', [('cavity', (12, 9)), ('outflow', (12, 9)), ('periodic', (8, 6, 5))])
+def test_temporal_blocking(scenario, domain_size, temporal_blocking):
+    stencil = 'D2Q9' if len(domain_size) == 2 else 'D3Q19'
+    method_parameters = {'stencil': stencil, 'method': 'trt', 'relaxation_rate': 1.7, 'compressible': True}
+    reference = create_scenario_with_boundaries(scenario, domain_size, **method_parameters)
+    step = create_scenario_with_boundaries(scenario, domain_size, temporal_blocking=temporal_blocking,
+                                           **method_parameters)
+
+    whole_domain = (slice(None),) * len(domain_size)
+    for time_steps in (7, 4):  # includes single time steps without blocking
+        reference.run(time_steps)
+        step.run(time_steps)
+        np.testing.assert_almost_equal(step.velocity[whole_domain], reference.velocity[whole_domain], decimal=14)
+        np.testing.assert_almost_equal(step.density[whole_domain], reference.density[whole_domain], decimal=13)
+    assert np.max(np.abs(reference.velocity[whole_domain])) > 1e-4
+
+    with pytest.raises(ValueError):
+        LatticeBoltzmannStep(domain_size, periodicity=True, temporal_blocking=temporal_blocking, **method_parameters)
+    with pytest.raises(ValueError):
+        LatticeBoltzmannStep(domain_size, streaming_pattern='aa', temporal_blocking=temporal_blocking,
+                             **method_parameters)
+
+
+@pytest.mark.longrun
+def test_temporal_blocking_benchmark():
+    method_parameters = {'stencil': 'D3Q19', 'method': 'srt', 'relaxation_rate': 1.8}
+    blockings = (None, 2, 4, 8)
+    print("{:>16}".format("Domain size") + "".join("{:>12}".format("T = {}".format(t or 1)) for t in blockings))
+    for domain_size in ((32, 32, 32), (64, 64, 64), (128, 128, 128)):
+        mlups = [LatticeBoltzmannStep(domain_size, temporal_blocking=t, **method_parameters).benchmark(2)
+                 for t in blockings]
+        print("{:>16}".format(str(domain_size)) + "".join("{:>12.1f}".format(m) for m in mlups))
+
+
+@pytest.mark.parametrize('streaming_pattern', ['pull', 'aa'])
+def test_lazy_compilation(streaming_pattern):
+    def create():
+        step = LatticeBoltzmannStep((12, 10), method='trt', relaxation_rate=1.8, streaming_pattern=streaming_pattern,
+                                    periodicity=(True, False), force=(1e-5, 0))
+        step.boundary_handling.set_boundary(NoSlip(), slice_from_direction('S', 2))
+        step.boundary_handling.set_boundary(NoSlip(), slice_from_direction('N', 2))
+        return step
+
+    step = create()
+    assert step.method.stencil == step.boundary_handling.lb_method.stencil
+    kernels = step._lbmKernels + list(step._getterKernels) + list(step._setterKernels)
+    assert not any(k.done for k in kernels)
+
+    # the pdfs at rest are the same as set by the setter kernel
+    pdfs = step.data_handling.cpu_arrays[step._pdf_arr_name].copy()
+    step.set_pdf_fields_from_macroscopic_values()
+    np.testing.assert_allclose(step.data_handling.cpu_arrays[step._pdf_arr_name], pdfs, atol=1e-15)
+
+    step.run(2)
+    # kernels created in this process are generated from the method of the step
+    assert all(k.method is step.method for k in step._lbmKernels)
+    # the getter and setter of the odd time step are not used yet
+    assert step.warmup() == (0 if streaming_pattern == 'pull' else 2)
+    assert step.warmup() == 0
+
+    reference = create()
+    assert reference.warmup() == (4 if streaming_pattern == 'pull' else 8)
+    reference.run(2)
+    np.testing.assert_allclose(step.velocity[:, :], reference.velocity[:, :], atol=1e-15)
+
+
+@pytest.mark.parametrize('streaming_pattern', ['pull', 'aa'])
+def test_lazy_macroscopic_values(streaming_pattern):
+    def create(**kwargs):
+        step = LatticeBoltzmannStep((10, 8, 6), method='trt', relaxation_rate=1.8, streaming_pattern=streaming_pattern,
+                                    periodicity=(True, False, True), force=(1e-5, 0, 0), **kwargs)
+        step.boundary_handling.set_boundary(NoSlip(), slice_from_direction('S', 3))
+        step.boundary_handling.set_boundary(NoSlip(), slice_from_direction('N', 3))
+        step.run(3)  # odd number of steps, in-place patterns read the pdfs from neighbors
+        return step
+
+    reference = create()
+    step = create(lazy_macroscopic_values=True)
+    velocity_arr = step.data_handling.cpu_arrays[step.velocity_data_name]
+    assert np.all(velocity_arr == 0)
+
+    for slice_obj in (make_slice[2:5, 0:3, 4], make_slice[:, 0.5, :], make_slice[-1, :, :]):
+        np.testing.assert_allclose(step.velocity_slice(slice_obj), reference.velocity_slice(slice_obj), atol=1e-15)
+        np.testing.assert_allclose(step.density_slice(slice_obj), reference.density_slice(slice_obj), atol=1e-15)
+    # only the requested cells are computed
+    assert np.count_nonzero(velocity_arr[..., 0]) == 3 * 3 + 10 * 6 + 8 * 6 - 2 * 3
+
+    step.update_macroscopic_values()
+    inner = (slice(1, -1),) * 3
+    reference_arr = reference.data_handling.cpu_arrays[reference.velocity_data_name]
+    np.testing.assert_allclose(velocity_arr[inner], reference_arr[inner], atol=1e-15)
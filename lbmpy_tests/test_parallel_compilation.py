@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+import sympy as sp
+
+from lbmpy.boundaries import NoSlip, UBB
+from lbmpy.kernel_cache import KernelCache
+from lbmpy.lbstep import LatticeBoltzmannStep
+from lbmpy.parallel_compilation import KernelCreationPool
+from lbmpy.phasefield.analytical import free_energy_functional_n_phases_penalty_term
+from lbmpy.phasefield.phasefieldstep import PhaseFieldStep
+from pystencils import Assignment, create_kernel, fields, make_slice
+from pystencils.slicing import slice_from_direction
+
+
+def create_cavity(**kwargs):
+    step = LatticeBoltzmannStep((12, 10), method='trt', relaxation_rate=1.7, **kwargs)
+    for direction in ('W', 'E', 'S'):
+        step.boundary_handling.set_boundary(NoSlip(), slice_from_direction(direction, 2))
+    step.boundary_handling.set_boundary(UBB((0.05, 0)), slice_from_direction('N', 2))
+    return step
+
+
+@pytest.mark.parametrize('kwargs', [{'time_step_order': 'collide_stream'}, {'streaming_pattern': 'aa'}])
+def test_parallel_step_creation(kwargs):
+    reference = create_cavity(**kwargs)
+    reference.run(5)
+
+    step = create_cavity(compile_processes=2, **kwargs)
+    assert len(step._getterKernels) == len(reference._getterKernels)
+    step.run(5)
+    # kernels derived in other processes may sum up terms in a different order
+    np.testing.assert_allclose(step.velocity[:, :], reference.velocity[:, :], atol=1e-15)
+
+
+def test_kernel_creation_pool(tmp_path):
+    cache = KernelCache(tmp_path)
+    with KernelCreationPool(processes=2) as pool:
+        # kernel is created by the worker and loaded from the cache by the main process
+        future = pool.submit_lb_function(stencil='D2Q9', relaxation_rate=1.8, optimization={'kernel_cache': cache})
+        assert future.result() is future.result()
+        assert cache.statistics['entries'] == 1
+
+        src, dst = fields("src, dst: [2D]")
+
+        def copy():  # local functions can not be sent to the workers
+            return create_kernel([Assignment(dst.center, 2 * src.center)])
+
+        kernel = pool.submit(copy).result()
+    assert pool._executor is None
+    arr = np.ones((4, 4))
+    out = np.zeros_like(arr)
+    kernel(src=arr, dst=out)
+    np.testing.assert_equal(out, 2 * arr)
+
+
+def test_parallel_phase_field_step_creation():
+    c = sp.symbols("c_:3")
+    free_energy = free_energy_functional_n_phases_penalty_term(c, 1, (0.01, 0.01, 0.005))
+
+    def run(**kwargs):
+        sc = PhaseFieldStep(free_energy, c, domain_size=(20, 20), hydro_dynamic_relaxation_rate=1.8, **kwargs)
+        sc.set_concentration(make_slice[:, 0.5:], [1, 0, 0])
+        sc.set_concentration(make_slice[:, :0.5], [0, 1, 0])
+        sc.set_concentration(make_slice[0.4:0.6, 0.4:0.6], [0, 0, 1])
+        sc.set_pdf_fields_from_macroscopic_values()
+        sc.run(10)
+        return sc.phi[:, :, :]
+
+    np.testing.assert_allclose(run(compile_processes=2), run(), atol=1e-14)
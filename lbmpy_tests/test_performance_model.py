@@ -0,0 +1,47 @@
+import pytest
+
+from lbmpy.creationfunctions import create_lb_function
+from lbmpy.lbstep import LatticeBoltzmannStep
+from lbmpy.performance_model import KernelPerformanceModel, RooflineReport, measure_memory_bandwidth
+
+
+@pytest.mark.parametrize('kernel_type, double_precision, bytes_per_lattice_update', [
+    ('stream_pull_collide', True, 456), ('stream_pull_collide', False, 228), ('aa_even', True, 304)])
+def test_bytes_per_lattice_update(kernel_type, double_precision, bytes_per_lattice_update):
+    kernel = create_lb_function(stencil='D3Q19', method='srt', relaxation_rate=1.8, kernel_type=kernel_type,
+                                optimization={'double_precision': double_precision})
+    model = KernelPerformanceModel(kernel)
+    assert (model.loads, model.stores) == (19, 19)
+    assert model.bytes_per_lattice_update == bytes_per_lattice_update
+    assert KernelPerformanceModel(kernel.ast, write_allocate=False).bytes_per_lattice_update == 19 * 2 * (
+        8 if double_precision else 4)
+
+    assert 0 < model.flops <= sum(kernel.update_rule.operation_count.values())
+    assert model.arithmetic_intensity == model.flops / bytes_per_lattice_update
+    assert model.predicted_mlups(1e9) == pytest.approx(1e3 / bytes_per_lattice_update)
+    assert model.predicted_mlups(1e9, peak_flops=1e6) == pytest.approx(1 / model.flops)
+
+
+def test_roofline_report():
+    assert measure_memory_bandwidth('1 MB', repetitions=2) > 0
+
+    method_parameters = {'stencil': 'D2Q9', 'method': 'trt', 'relaxation_rate': 1.8}
+    steps = {'pull': LatticeBoltzmannStep((64, 32), **method_parameters),
+             'aa': LatticeBoltzmannStep((64, 32), streaming_pattern='aa', **method_parameters)}
+    report = RooflineReport(steps, bandwidth=1e12, time_for_benchmark=0.05)
+    assert [row['Name'] for row in report.rows] == ['pull', 'aa']
+    assert [row['B/LUP'] for row in report.rows] == [216, 144]
+    assert all(row['Measured'] > 0 and row['Fraction'] == row['Measured'] / row['Predicted'] for row in report.rows)
+    assert report.off_roofline(threshold=0) == []
+    assert report.off_roofline(threshold=float('inf')) == ['pull', 'aa']
+    assert 'Predicted' in str(report)
+
+
+@pytest.mark.longrun
+def test_roofline_report_d3q19():
+    """Example of the module docstring"""
+    step = LatticeBoltzmannStep((32, 32, 32), stencil='D3Q19', method='srt', relaxation_rate=1.8)
+    report = RooflineReport({'srt': step}, bandwidth=20e9, time_for_benchmark=0.1)
+    assert report.rows[0]['B/LUP'] == 456
+    assert report.rows[0]['Measured'] > 0
+    print(report)
@@ -3,6 +3,7 @@ import warnings
 from tempfile import TemporaryDirectory
 
 import numpy as np
+import pytest
 import sympy as sp
 
 from lbmpy.boundaries import NoSlip
@@ -11,7 +12,8 @@ from lbmpy.phasefield.experiments2D import (
     create_two_drops_between_phases, write_phase_field_picture_sequence,
     write_phase_velocity_picture_sequence)
 from lbmpy.phasefield.phasefieldstep import PhaseFieldStep
-from pystencils import make_slice
+from pystencils import create_data_handling, make_slice
+from pystencils.slicing import slice_from_direction
 
 
 def create_falling_drop(domain_size=(160, 200), omega=1.9, kappas=(0.001, 0.001, 0.0005), **kwargs):
@@ -47,3 +49,68 @@ def test_falling_drop():
             file_pattern = os.path.join(tmp_dir, "output_%d.png")
             write_phase_velocity_picture_sequence(sc, file_pattern, total_steps=200)
         assert np.isfinite(np.max(sc.phi[:, :, :]))
+
+
+def test_fused_kernels():
+    reference = create_falling_drop(domain_size=(30, 40), optimization={'openmp': False})
+    reference.run(20)
+    sc = create_falling_drop(domain_size=(30, 40), optimization={'openmp': False}, fuse_kernels=True)
+    assert len(sc.cahn_hilliard_steps) == 1
+    sc.run(20)
+    assert not sc.force_from_pressure_tensor_kernel.done  # the force is computed in the hydrodynamic LBM kernel
+    np.testing.assert_allclose(sc.phi[:, :, :], reference.phi[:, :, :], atol=1e-13)
+    np.testing.assert_allclose(sc.velocity[:, :, :], reference.velocity[:, :, :], atol=1e-13)
+    np.testing.assert_allclose(sc.force[:, :, :], reference.force[:, :, :], atol=1e-13)
+
+    # without the hydrodynamic LBM the force is still computed
+    reference.run_hydro_lbm = sc.run_hydro_lbm = False
+    reference.run(5)
+    sc.run(5)
+    np.testing.assert_allclose(sc.phi[:, :, :], reference.phi[:, :, :], atol=1e-13)
+    np.testing.assert_allclose(sc.force[:, :, :], reference.force[:, :, :], atol=1e-13)
+
+
+def test_fused_kernels_gpu():
+    pytest.importorskip('pycuda')
+    reference = create_falling_drop(domain_size=(30, 40), optimization={'openmp': False}, fuse_kernels=True)
+    reference.run(20)
+    # concentrations are set on the host, the pdfs are initialized from them and transferred in pre_run
+    sc = create_falling_drop(domain_size=(30, 40), optimization={'target': 'gpu'}, fuse_kernels=True)
+    sc.run(20)
+    np.testing.assert_allclose(sc.phi[:, :, :], reference.phi[:, :, :], atol=1e-10)
+    np.testing.assert_allclose(sc.velocity[:, :, :], reference.velocity[:, :, :], atol=1e-10)
+
+
+def test_force_without_pressure_tensor_field():
+    def run(ghost_layers, **kwargs):
+        c = sp.symbols("c_:3")
+        free_energy = free_energy_functional_n_phases_penalty_term(c, 1, (0.001, 0.001, 0.0005))
+        dh = create_data_handling((30, 40), periodicity=True, parallel=False, default_ghost_layers=ghost_layers)
+        sc = PhaseFieldStep(free_energy, c, data_handling=dh, hydro_dynamic_relaxation_rate=1.9,
+                            order_parameter_force={2: (0, -1e-6), 1: (0, 0), 0: (0, 0)}, **kwargs)
+        # slices include the ghost layers, so the inner region is set explicitly for both ghost layer widths
+        phi = np.zeros((30, 40, 3))
+        phi[:, 16:, 0] = 1
+        phi[:, :16, 1] = 1
+        phi[13:17, 32:36] = [0, 0, 1]
+        dh.cpu_arrays[sc.phi_field_name][ghost_layers:-ghost_layers, ghost_layers:-ghost_layers] = phi
+        sc.hydro_lbm_step.boundary_handling.set_boundary(NoSlip(), slice_from_direction('S', 2))
+        sc.set_pdf_fields_from_macroscopic_values()
+        sc.run(20)
+        return sc
+
+    reference = run(1)
+    for kwargs in ({}, {'fuse_kernels': True}):
+        sc = run(2, store_pressure_tensor=False, **kwargs)
+        assert sc.pressure_tensor_field_name not in sc.data_handling.array_names
+        # the wall is placed in the ghost layer next to the inner cells, like with a single ghost layer
+        flags = sc.data_handling.cpu_arrays[sc.flag_interface.flag_field_name]
+        domain_flag = sc.flag_interface.domain_flag
+        assert np.all(flags[2:-2, :2] & domain_flag == 0) and np.all(flags[2:-2, 2] & domain_flag != 0)
+        for name in ('phi', 'velocity', 'force'):
+            np.testing.assert_allclose(getattr(sc, name)[:, :, :], getattr(reference, name)[:, :, :], atol=1e-13)
+
+    with pytest.raises(ValueError):
+        PhaseFieldStep(free_energy_functional_n_phases_penalty_term(sp.symbols("c_:2"), 1, (0.01, 0.01)),
+                       sp.symbols("c_:2"), domain_size=(10, 10), store_pressure_tensor=False,
+                       data_handling=create_data_handling((10, 10)))
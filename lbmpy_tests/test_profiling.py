@@ -0,0 +1,77 @@
+import json
+
+import numpy as np
+import pytest
+
+from lbmpy.boundaries import NoSlip, UBB
+from lbmpy.lbstep import LatticeBoltzmannStep
+from lbmpy.profiling import Profiler
+from pystencils.slicing import slice_from_direction
+
+
+def create_cavity(**kwargs):
+    step = LatticeBoltzmannStep((16, 12, 8), stencil='D3Q19', method='srt', relaxation_rate=1.8, **kwargs)
+    for direction in ('W', 'E', 'S', 'T', 'B'):
+        step.boundary_handling.set_boundary(NoSlip(), slice_from_direction(direction, 3))
+    step.boundary_handling.set_boundary(UBB((0.05, 0, 0)), slice_from_direction('N', 3))
+    return step
+
+
+@pytest.mark.parametrize('kwargs, kernel_phases', [
+    ({}, ['stream_collide']),
+    ({'streaming_pattern': 'aa'}, ['stream_collide even', 'stream_collide odd']),
+    ({'time_step_order': 'collide_stream'}, ['collide', 'stream']),
+    ({'overlap_communication': True}, ['stream_collide frame', 'stream_collide interior']),
+    ({'ghost_layers': 2}, ['stream_collide sub step 0', 'stream_collide sub step 1']),
+    ({'temporal_blocking': 2}, ['wavefront sweep']),
+])
+def test_profiled_time_steps(kwargs, kernel_phases):
+    reference = create_cavity(**kwargs)
+    reference.run(4)
+
+    step = create_cavity(**kwargs)
+    profiler = step.enable_profiling()
+    assert step.profiler is profiler
+    step.run(4)  # fixed steps of the time loop only
+    np.testing.assert_allclose(step.velocity[:, :, :], reference.velocity[:, :, :], atol=1e-14)
+
+    profile = profiler.to_dict()
+    assert sorted(n for n, p in profile.items() if p['category'] == 'kernel') == kernel_phases
+    assert sum(p['fraction'] for p in profile.values()) == pytest.approx(1)
+    assert all(p['time'] > 0 and p['mlups'] > 0 for p in profile.values())
+    if 'temporal_blocking' not in kwargs:
+        assert {'boundary NoSlip', 'boundary UBB', 'ghost layer sync'} <= set(profile)
+        assert all(profile[name]['bandwidth'] > 0 for name in kernel_phases + ['boundary UBB', 'ghost layer sync'])
+
+    step.disable_profiling()
+    step.run(4)
+    assert step.profiler is None and profiler.to_dict() == profile
+
+
+def test_profiler_output(tmp_path):
+    step = create_cavity()
+    profiler = step.enable_profiling()
+    step.run_old(3)  # single time steps
+    profile = profiler.to_dict()
+    assert profile['stream_collide']['calls'] == profile['swap']['calls'] == 3
+    assert profile['stream_collide']['bytes_per_call'] == 16 * 12 * 8 * 19 * 8 * 3
+    assert profile['boundary UBB']['calls'] == 3
+    assert 'stream_collide' in str(profiler)
+
+    trace = profiler.to_chrome_trace(str(tmp_path / 'trace.json'))
+    with open(str(tmp_path / 'trace.json')) as f:
+        assert json.load(f) == trace
+    events = trace['traceEvents']
+    assert len(events) == sum(p['calls'] for p in profile.values())
+    assert all(e['ph'] == 'X' and e['dur'] >= 0 for e in events)
+    assert [e['ts'] for e in events] == sorted(e['ts'] for e in events)
+
+    profiler.reset()
+    assert profiler.to_dict() == {} and profiler.events == []
+
+    profiler = Profiler(cells_per_time_step=1000, max_trace_events=1)
+    f = profiler.timed('f', lambda a: a + 1, 'kernel', bytes_per_call=8)
+    assert f(1) == 2 and f(2) == 3
+    assert len(profiler.events) == 1
+    assert profiler.phases['f'] == {'category': 'kernel', 'calls': 2, 'time': pytest.approx(profiler.total_time),
+                                    'cells': 2000, 'bytes': 16}
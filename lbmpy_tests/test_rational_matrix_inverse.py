@@ -0,0 +1,84 @@
+import time
+
+import pytest
+import sympy as sp
+from sympy.core.cache import clear_cache
+
+from lbmpy.creationfunctions import create_lb_method
+from lbmpy.maxwellian_equilibrium import get_weights
+from lbmpy.moments import (
+    _rational_matrix_inverse, extract_monomials, monomial_to_polynomial_transformation_matrix,
+    rational_matrix_inverse)
+
+method_parameters = [
+    {'stencil': 'D2Q9', 'method': 'trt', 'compressible': True},
+    {'stencil': 'D2Q9', 'method': 'srt', 'force_model': 'guo', 'force': (1e-4, 0)},
+    {'stencil': 'D3Q19', 'method': 'mrt'},
+    {'stencil': 'D3Q19', 'method': 'mrt', 'weighted': False},
+    {'stencil': 'D3Q15', 'method': 'mrt_raw'},
+]
+
+
+def reference_collision_rule(method):
+    _, d = method._generate_relaxation_matrix(method.relaxation_matrix, True)
+    f = sp.Matrix(method.pre_collision_pdf_symbols)
+    m = method.moment_matrix
+    m_eq = sp.Matrix(method.moment_equilibrium_values)
+    return f + m.inv() * d * (m_eq - m * f)
+
+
+def test_inverse_of_moment_matrices():
+    for params in method_parameters:
+        method = create_lb_method(**params)
+        m = method.moment_matrix
+        reference = m.inv()
+        assert rational_matrix_inverse(m) == reference
+        assert rational_matrix_inverse(m, get_weights(method.stencil, sp.Rational(1, 3))) == reference
+
+
+def test_inverse_of_cumulant_transformation():
+    method = create_lb_method(stencil='D2Q9', method='srt', cumulant=True, compressible=True)
+    monomials = list(extract_monomials(method.cumulants, dim=2))
+    mon_to_poly = monomial_to_polynomial_transformation_matrix(monomials, method.cumulants)
+    assert rational_matrix_inverse(mon_to_poly) == mon_to_poly.inv()
+
+
+def test_inverse_of_rational_and_symbolic_matrices():
+    m = sp.Matrix([[sp.Rational(1, 2), 3, 0], [-1, sp.Rational(2, 3), 4], [0, 1, sp.Rational(-5, 7)]])
+    assert rational_matrix_inverse(m) == m.inv()
+
+    a = sp.Symbol("a")
+    m = sp.Matrix([[a, 1], [1, 2]])
+    assert rational_matrix_inverse(m) == m.inv()
+
+    with pytest.raises(ValueError):
+        rational_matrix_inverse(sp.Matrix([[1, 2], [2, 4]]))
+
+
+def test_collision_rule_matches_symbolic_inversion():
+    for params in method_parameters:
+        method = create_lb_method(**params)
+        collision_rule = method.get_collision_rule()
+        reference = reference_collision_rule(method)
+        result = [a.rhs for a in collision_rule.main_assignments]
+        if method.force_model is not None:
+            result = [r - s for r, s in zip(result, collision_rule.simplification_hints['force_terms'])]
+        assert result == list(reference)
+
+
+@pytest.mark.longrun
+def test_collision_rule_setup_benchmark():
+    print("{:<30}{:>12}{:>12}".format("Method", "sympy inv", "exact inv"))
+    for params in [{'stencil': 'D2Q9', 'method': 'mrt'},
+                   {'stencil': 'D3Q19', 'method': 'mrt'},
+                   {'stencil': 'D3Q27', 'method': 'mrt'},
+                   {'stencil': 'D3Q27', 'method': 'mrt_raw'}]:
+        timings = []
+        for create in (reference_collision_rule, lambda m: m.get_collision_rule()):
+            method = create_lb_method(**params)
+            clear_cache()
+            _rational_matrix_inverse.cache_clear()
+            start = time.perf_counter()
+            create(method)
+            timings.append(time.perf_counter() - start)
+        print("{:<30}{:>12.3f}{:>12.3f}".format(" ".join(params.values()), *timings))
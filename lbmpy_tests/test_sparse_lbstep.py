@@ -0,0 +1,130 @@
+import numpy as np
+import pytest
+
+from lbmpy.boundaries import UBB, NoSlip
+from lbmpy.lbstep import LatticeBoltzmannStep
+from lbmpy.scenarios import create_channel
+from lbmpy.sparse import SparseLatticeBoltzmannStep, choose_storage, select_storage, sparse_step_from_dense
+from lbmpy.sparse.storage_selection import _periodic_flag_array
+
+FLUID, NO_SLIP, UBB_FLAG = 1, 2, 4
+
+
+def porous_channel(domain_size, porosity, seed=0):
+    """Flag array of a channel with random obstacles, periodic in x, with no-slip walls and a moving lid."""
+    flag_arr = np.zeros(tuple(s + 2 for s in domain_size), dtype=np.uint16)
+    inner = (slice(1, -1),) * len(domain_size)
+    random_state = np.random.RandomState(seed)
+    flag_arr[inner] = np.where(random_state.rand(*domain_size) < porosity, FLUID, NO_SLIP)
+    flag_arr[(1,) + inner[1:]] = flag_arr[(-2,) + inner[1:]] = FLUID
+    flag_arr[:, 0] = NO_SLIP
+    flag_arr[:, -1] = UBB_FLAG
+    if len(domain_size) == 3:
+        flag_arr[:, 1:-1, 0] = NO_SLIP
+        flag_arr[:, 1:-1, -1] = NO_SLIP
+    return flag_arr
+
+
+def dense_reference(flag_arr, boundaries, **method_parameters):
+    dim = len(flag_arr.shape)
+    step = LatticeBoltzmannStep(domain_size=tuple(s - 2 for s in flag_arr.shape),
+                                periodicity=(True,) + (False,) * (dim - 1), **method_parameters)
+    for flag, boundary in boundaries.items():
+        def mask_callback(*midpoints, flag=flag):
+            return flag_arr[tuple(np.round(m + 0.5).astype(int) for m in midpoints)] == flag
+        step.boundary_handling.set_boundary(boundary, mask_callback=mask_callback)
+    return step
+
+
+@pytest.mark.parametrize('layout', ['SoA', 'AoS', 'AoSoA'])
+@pytest.mark.parametrize('stencil, domain_size', [('D2Q9', (20, 12)), ('D3Q19', (10, 8, 6))])
+def test_matches_dense_step(stencil, domain_size, layout):
+    flag_arr = porous_channel(domain_size, porosity=0.7)
+    boundaries = {NO_SLIP: NoSlip(), UBB_FLAG: UBB((0.05,) + (0,) * (len(domain_size) - 1))}
+    method_parameters = {'stencil': stencil, 'method': 'trt', 'relaxation_rate': 1.8, 'compressible': True}
+
+    sparse = SparseLatticeBoltzmannStep(flag_arr, boundaries, fluid_flag=FLUID, layout=layout, **method_parameters)
+    dense = dense_reference(flag_arr, boundaries, **method_parameters)
+    for step in (sparse, dense):
+        step.run(21)
+
+    fluid = flag_arr[(slice(1, -1),) * len(domain_size)] == FLUID
+    assert sparse.number_of_cells == np.count_nonzero(fluid)
+    assert sparse.time_steps_run == 21
+
+    whole_domain = (slice(None),) * len(domain_size)
+    sparse_velocity = sparse.velocity[whole_domain]
+    dense_velocity = dense.velocity[whole_domain]
+    assert np.all(sparse_velocity.mask[~fluid])
+    assert np.max(np.abs(dense_velocity[fluid])) > 1e-3
+    np.testing.assert_almost_equal(sparse_velocity[fluid], dense_velocity[fluid], decimal=12)
+    np.testing.assert_almost_equal(sparse.density[whole_domain][fluid], dense.density[whole_domain][fluid],
+                                   decimal=12)
+
+
+def test_set_macroscopic_values():
+    flag_arr = porous_channel((12, 9), porosity=0.5)
+    step = SparseLatticeBoltzmannStep(flag_arr, {NO_SLIP: NoSlip(), UBB_FLAG: NoSlip()}, layout='AoSoA',
+                                      compressible=True)
+    fluid = flag_arr[1:-1, 1:-1] == FLUID
+    velocity = np.random.RandomState(1).rand(12, 9, 2) * 0.01
+    step.set_pdf_fields_from_macroscopic_values(density=1.1, velocity=velocity)
+    step.run(0)
+    np.testing.assert_almost_equal(step.velocity[:, :][fluid], velocity[fluid])
+    np.testing.assert_almost_equal(step.density[:, :][fluid], 1.1)
+
+    with pytest.raises(NotImplementedError):
+        SparseLatticeBoltzmannStep(flag_arr, {UBB_FLAG: UBB(lambda *args: None, dim=2)})
+
+
+@pytest.mark.longrun
+def test_memory_and_performance_benchmark():
+    domain_size = (100, 100, 100)
+    boundaries = {NO_SLIP: NoSlip(), UBB_FLAG: UBB((0.05, 0, 0))}
+    method_parameters = {'stencil': 'D3Q19', 'method': 'srt', 'relaxation_rate': 1.8}
+    print("{:>10}{:>14}{:>14}{:>14}{:>14}".format("Porosity", "dense MB", "sparse MB", "dense s/step",
+                                                  "sparse s/step"))
+    for porosity in (0.15, 0.5, 0.9):
+        flag_arr = porous_channel(domain_size, porosity)
+        sparse = SparseLatticeBoltzmannStep(flag_arr, boundaries, **method_parameters)
+        dense = dense_reference(flag_arr, boundaries, **method_parameters)
+        dense_memory = sum(a.nbytes for a in dense.data_handling.cpu_arrays.values())
+        seconds_per_step = [step.number_of_cells / step.benchmark(time_for_benchmark=2) * 1e-6
+                            for step in (dense, sparse)]
+        print("{:>10}{:>14.1f}{:>14.1f}{:>14.4f}{:>14.4f}".format(
+            porosity, dense_memory / 1e6, sparse.memory_usage / 1e6, *seconds_per_step))
+
+
+@pytest.mark.parametrize('porosity, expected_storage', [(0.2, 'sparse'), (1.0, 'dense')])
+def test_select_storage(porosity, expected_storage):
+    domain_size = (30, 16)
+    dense = create_channel(domain_size, force=1e-5, duct=True, method='srt', relaxation_rate=1.6)
+    obstacles = np.random.RandomState(0).rand(*domain_size) > porosity
+    obstacles[:, (0, -1)] = False
+    obstacles[(0, -1), :] = False  # the dense step does not synchronize flags over the periodic border
+
+    def obstacle_mask(x, y):
+        return obstacles[x.astype(int), y.astype(int)]
+    dense.boundary_handling.set_boundary(NoSlip(), mask_callback=obstacle_mask, ghost_layers=False)
+    dense.run(5)
+
+    assert choose_storage(dense) == [expected_storage]
+    assert choose_storage(dense, criterion='memory') == [expected_storage]
+    selected = select_storage(dense)
+    assert isinstance(selected, SparseLatticeBoltzmannStep) == (expected_storage == 'sparse')
+
+    sparse = sparse_step_from_dense(dense, layout='AoS')
+    np.testing.assert_almost_equal(sparse.velocity[:, :][~obstacles], dense.velocity[:, :][~obstacles])
+    for step in (sparse, dense):
+        step.run(20)
+    np.testing.assert_almost_equal(sparse.velocity[:, :][~obstacles], dense.velocity[:, :][~obstacles], decimal=8)
+    assert np.max(np.abs(sparse.velocity[:, :])) > 1e-6
+
+
+def test_fluid_in_non_periodic_ghost_layer():
+    flag_arr = np.full((6, 5), 2, dtype=np.uint16)
+    flag_arr[1:-1, 1:-1] = 1
+    _periodic_flag_array(flag_arr, (True, False), fluid_flag=1, ghost_layers=1)
+    flag_arr[2, 0] = 1 | 4  # fluid cell with an additional flag bit
+    with pytest.raises(ValueError):
+        _periodic_flag_array(flag_arr, (True, False), fluid_flag=1, ghost_layers=1)
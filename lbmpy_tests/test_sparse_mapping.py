@@ -0,0 +1,283 @@
+import time
+
+import numpy as np
+import pytest
+
+import pystencils as ps
+from lbmpy.boundaries import UBB
+from lbmpy.creationfunctions import create_lb_method
+from lbmpy.sparse import (
+    SparseLbBoundaryMapper, SparseLbMapper, create_lb_update_rule_sparse,
+    create_macroscopic_value_getter_sparse, create_macroscopic_value_setter_sparse, create_symbolic_list)
+from lbmpy.stencils import get_stencil
+
+FLUID, NO_SLIP, UBB_FLAG = 1, 2, 4
+
+
+def reference_index_array(mapping, ghost_layers=1):
+    """Loop based implementation of SparseLbMapper.create_index_array, one cell_idx lookup per cell and direction."""
+    stencil = mapping.stencil
+    flag_arr = mapping.flag_array
+    fluid_boundary_mask = mapping.other_boundary_mask | mapping.fluid_flag
+
+    result = []
+    for direction_idx, direction in enumerate(stencil):
+        if all(d_i == 0 for d_i in direction):
+            continue
+        inverse_idx = stencil.index(tuple(-d_i for d_i in direction))
+        for own_cell_idx, cell in enumerate(mapping.fluid_coordinates):
+            inv_neighbor_cell = np.array([cell_i - dir_i for cell_i, dir_i in zip(cell, direction)])
+            if flag_arr[tuple(inv_neighbor_cell)] & fluid_boundary_mask:
+                result.append(mapping.cell_idx(tuple(inv_neighbor_cell)) + direction_idx * len(mapping))
+            elif flag_arr[tuple(inv_neighbor_cell)] & mapping.no_slip_flag:
+                result.append(own_cell_idx + inverse_idx * len(mapping))
+            else:
+                for i, x_i in enumerate(inv_neighbor_cell):
+                    if x_i == (ghost_layers - 1):
+                        inv_neighbor_cell[i] += flag_arr.shape[i] - (2 * ghost_layers)
+                    elif x_i == flag_arr.shape[i] - ghost_layers:
+                        inv_neighbor_cell[i] -= flag_arr.shape[i] - (2 * ghost_layers)
+                result.append(mapping.cell_idx(tuple(inv_neighbor_cell)) + direction_idx * len(mapping))
+
+    index_arr = np.array(result, dtype=np.uint32).reshape([len(stencil) - 1, mapping.num_fluid_cells])
+    return index_arr.swapaxes(0, 1)
+
+
+def porous_channel(domain_size, porosity=0.7, seed=0):
+    """Flag array of a channel filled with random obstacles, periodic in x, with a moving lid on top.
+
+    In 2D the lid is the upper wall in y, in 3D the channel has no-slip walls in y and the lid on top in z."""
+    flag_arr = np.zeros(tuple(s + 2 for s in domain_size), dtype=np.uint16)
+    inner = (slice(1, -1),) * len(domain_size)
+    random_state = np.random.RandomState(seed)
+    flag_arr[inner] = np.where(random_state.rand(*domain_size) < porosity, FLUID, NO_SLIP)
+    # obstacles must not touch the periodic border
+    flag_arr[(1,) + inner[1:]] = flag_arr[(-2,) + inner[1:]] = FLUID
+    flag_arr[:, 0] = NO_SLIP
+    flag_arr[:, -1] = NO_SLIP
+    if len(domain_size) == 2:
+        flag_arr[:, -1] = UBB_FLAG
+    else:
+        flag_arr[:, 1:-1, 0] = NO_SLIP
+        flag_arr[:, 1:-1, -1] = UBB_FLAG
+    return flag_arr
+
+
+def create_mapping(stencil, flag_arr, **kwargs):
+    return SparseLbMapper(get_stencil(stencil), flag_arr, FLUID, NO_SLIP, UBB_FLAG, **kwargs)
+
+
+class SparseLidDrivenChannel:
+    """Sparse LBM with pull-streaming through the index array and a moving lid, velocity scattered to full grid."""
+
+    def __init__(self, method, flag_arr, layout='SoA'):
+        q = len(method.stencil)
+        self.pdf_field = create_symbolic_list('f', None, q, np.float64, layout)
+        pdf_field_tmp = create_symbolic_list('d', None, q, np.float64, layout)
+        velocity_field = create_symbolic_list('u', None, method.dim, np.float64, layout)
+        index_field = create_symbolic_list('idx', None, q - 1, np.uint32, layout)
+        update_rule = create_lb_update_rule_sparse(method.get_collision_rule(), self.pdf_field, pdf_field_tmp,
+                                                   index_field, layout=layout)
+        self.stream_collide_kernel = ps.create_kernel(update_rule, ghost_layers=0).compile()
+        setter = create_macroscopic_value_setter_sparse(method, self.pdf_field, 1, (0,) * method.dim)
+        self.setter_kernel = ps.create_kernel(setter, ghost_layers=0).compile()
+        getter = create_macroscopic_value_getter_sparse(method, self.pdf_field, {'velocity': velocity_field})
+        self.getter_kernel = ps.create_kernel(getter, ghost_layers=0).compile()
+        self.ubb_mapper = SparseLbBoundaryMapper(UBB((0.01,) + (0,) * (method.dim - 1)), method, self.pdf_field)
+        self.ubb_kernel = ps.create_kernel(self.ubb_mapper.assignments(), ghost_layers=0).compile()
+        self.method = method
+        self.flag_arr = flag_arr
+
+    def set_mapping(self, mapping):
+        self.mapping = mapping
+        self.index_arr = mapping.create_index_array()
+        self.ubb_index_arr = self.ubb_mapper.create_index_arr(mapping, UBB_FLAG)
+        self.pdf_arr = mapping.create_list(len(mapping), len(self.method.stencil))
+        self.pdf_arr_tmp = mapping.create_list(len(mapping), len(self.method.stencil))
+        self.setter_kernel(f=self.pdf_arr)
+
+    def run(self, time_steps):
+        fluid_part = self.mapping.fluid_part
+        for t in range(time_steps):
+            self.ubb_kernel(indexField=self.ubb_index_arr, f=self.pdf_arr)
+            self.stream_collide_kernel(f=fluid_part(self.pdf_arr), d=fluid_part(self.pdf_arr_tmp),
+                                       idx=self.index_arr)
+            self.pdf_arr, self.pdf_arr_tmp = self.pdf_arr_tmp, self.pdf_arr
+
+    @property
+    def velocity(self):
+        mapping = self.mapping
+        velocity = mapping.create_list(mapping.num_fluid_cells, self.method.dim)
+        self.getter_kernel(f=mapping.fluid_part(self.pdf_arr), u=velocity)
+        result = np.zeros(self.flag_arr.shape + (self.method.dim,))
+        coordinates = mapping.fluid_coordinates
+        result[tuple(coordinates[name] for name in coordinates.dtype.names)] = mapping.list_values(
+            velocity, mapping.num_fluid_cells)
+        return result
+
+
+@pytest.mark.parametrize('lookup_table_size', ['1 MB', 0])
+@pytest.mark.parametrize('stencil, domain_size', [('D2Q9', (12, 7)), ('D3Q19', (7, 5, 6)), ('D3Q27', (5, 6, 4))])
+def test_index_array_matches_reference(stencil, domain_size, lookup_table_size):
+    mapping = create_mapping(stencil, porous_channel(domain_size), max_lookup_table_size=lookup_table_size)
+    reference = reference_index_array(mapping)
+    result = mapping.create_index_array()
+    assert result.dtype == reference.dtype
+    np.testing.assert_equal(result, reference)
+    np.testing.assert_equal(mapping.create_index_array(chunk_size=7), reference)
+
+
+def test_index_array_with_two_ghost_layers():
+    flag_arr = np.zeros((14, 9), dtype=np.uint16)
+    flag_arr[2:-2, 2:-2] = FLUID
+    flag_arr[2:-2, 1] = NO_SLIP
+    flag_arr[2:-2, -2] = NO_SLIP
+    mapping = create_mapping('D2Q9', flag_arr)
+    np.testing.assert_equal(mapping.create_index_array(ghost_layers=2), reference_index_array(mapping, 2))
+
+
+def test_missing_neighbor():
+    flag_arr = np.zeros((8, 8), dtype=np.uint16)
+    flag_arr[2:-2, 2:-2] = FLUID
+    with pytest.raises(ValueError):
+        create_mapping('D2Q9', flag_arr).create_index_array()
+
+
+@pytest.mark.parametrize('stencil, domain_size', [('D2Q9', (20, 12)), ('D3Q19', (10, 8, 6))])
+def test_cell_order(stencil, domain_size):
+    flag_arr = porous_channel(domain_size)
+    lbm = SparseLidDrivenChannel(create_lb_method(stencil=stencil, relaxation_rate=1.8), flag_arr)
+    velocities = []
+    for cell_order in SparseLbMapper.CELL_ORDERS:
+        mapping = create_mapping(stencil, flag_arr, cell_order=cell_order, block_size=4)
+        coordinates = mapping.coordinates
+        assert all(coordinates[i] == coordinates[mapping.cell_idx(tuple(coordinates[i]))] for i in range(len(mapping)))
+        lbm.set_mapping(mapping)
+        lbm.run(20)
+        velocities.append(lbm.velocity)
+    assert np.max(np.abs(velocities[0])) > 1e-4
+    for velocity in velocities[1:]:
+        np.testing.assert_almost_equal(velocity, velocities[0], decimal=14)
+
+    with pytest.raises(ValueError):
+        create_mapping(stencil, flag_arr, cell_order='random')
+
+
+@pytest.mark.parametrize('stencil, domain_size', [('D2Q9', (20, 12)), ('D3Q19', (10, 8, 7))])
+def test_layouts(stencil, domain_size):
+    flag_arr = porous_channel(domain_size)
+    method = create_lb_method(stencil=stencil, relaxation_rate=1.8)
+    velocities = []
+    for layout in SparseLbMapper.LAYOUTS:
+        mapping = create_mapping(stencil, flag_arr, layout=layout, block_width=4)
+        assert mapping.num_fluid_cells % 4 != 0  # check padding of last block
+        lbm = SparseLidDrivenChannel(method, flag_arr, layout)
+        lbm.set_mapping(mapping)
+        lbm.run(20)
+        velocities.append(lbm.velocity)
+    assert np.max(np.abs(velocities[0])) > 1e-4
+    for velocity in velocities[1:]:
+        np.testing.assert_almost_equal(velocity, velocities[0], decimal=14)
+
+
+@pytest.mark.parametrize('layout', SparseLbMapper.LAYOUTS)
+def test_symbolic_list_matches_allocated_list(layout):
+    mapping = create_mapping('D2Q9', porous_channel((9, 7)), layout=layout, block_width=4)
+    for values_per_cell in (1, 9):
+        arr = mapping.create_list(len(mapping), values_per_cell)
+        field = create_symbolic_list('f', len(mapping), values_per_cell, arr.dtype, layout, block_width=4)
+        assert field.shape == arr.shape
+        assert field.strides == tuple(s // arr.itemsize for s in arr.strides)
+
+    pdfs = mapping.create_list(len(mapping), 9)
+    pdfs[...] = np.random.rand(*pdfs.shape)
+    positions = mapping.pdf_offset(np.arange(len(mapping))[:, np.newaxis], np.arange(9))
+    np.testing.assert_equal(pdfs.ravel(order='K')[positions], mapping.list_values(pdfs, len(mapping)))
+
+
+def test_default_layouts_match():
+    mapping = create_mapping('D2Q9', porous_channel((9, 7)))
+    arr = mapping.create_list(len(mapping), 9)
+    field = create_symbolic_list('f', len(mapping), 9, arr.dtype)
+    assert field.strides == tuple(s // arr.itemsize for s in arr.strides)
+
+
+@pytest.mark.longrun
+def test_index_array_scaling_benchmark():
+    print("{:<16}{:>12}{:>12}{:>12}".format("Fluid cells", "loops", "vectorized", "speedup"))
+    for edge_length in (8, 16, 32):
+        mapping = create_mapping('D3Q19', porous_channel((edge_length,) * 3), max_lookup_table_size=0)
+        timings = []
+        for create in (reference_index_array, SparseLbMapper.create_index_array):
+            start = time.perf_counter()
+            create(mapping)
+            timings.append(time.perf_counter() - start)
+        speedup = timings[0] / timings[1]
+        print("{:<16}{:>12.3f}{:>12.3f}{:>12.1f}".format(mapping.num_fluid_cells, *timings, speedup))
+
+
+def test_cell_idx_lookup_backends():
+    flag_arr = porous_channel((6, 5, 4))
+    table_mapping = create_mapping('D3Q19', flag_arr)
+    search_mapping = create_mapping('D3Q19', flag_arr, max_lookup_table_size=flag_arr.size * 4 - 1)
+    assert table_mapping.uses_lookup_table and not search_mapping.uses_lookup_table
+
+    coordinates = table_mapping.coordinates[::-1]
+    expected = [search_mapping.cell_idx(tuple(c)) for c in coordinates]
+    for mapping in (table_mapping, search_mapping):
+        assert [mapping.cell_idx(tuple(c)) for c in coordinates] == expected
+        np.testing.assert_equal(mapping.cell_idx_bulk(coordinates), expected)
+        with pytest.raises(IndexError):
+            mapping.cell_idx((0, 0, 0))
+
+    all_coordinates = np.array(list(np.ndindex(*flag_arr.shape)), dtype=np.int64)
+    all_coordinates = np.core.records.fromarrays(all_coordinates.T, names='x,y,z')
+    np.testing.assert_equal(table_mapping.cell_idx_bulk(all_coordinates),
+                            search_mapping.cell_idx_bulk(all_coordinates))
+
+
+@pytest.mark.longrun
+def test_lookup_backend_benchmark():
+    print("{:<16}{:>16}{:>16}".format("Fluid cells", "search", "table"))
+    for edge_length in (32, 64, 128):
+        flag_arr = porous_channel((edge_length,) * 3)
+        timings = []
+        for size in (0, '1 GB'):
+            mapping = create_mapping('D3Q19', flag_arr, max_lookup_table_size=size)
+            start = time.perf_counter()
+            coordinates = mapping.fluid_coordinates[::-1]
+            assembled = time.perf_counter()
+            mapping.cell_idx_bulk(coordinates)
+            timings.append("{:.3f} + {:.3f}".format(assembled - start, time.perf_counter() - assembled))
+        print("{:<16}{:>16}{:>16}".format(mapping.num_fluid_cells, *timings))
+
+
+@pytest.mark.longrun
+def test_cell_order_benchmark():
+    flag_arr = porous_channel((128, 128, 128))
+    lbm = SparseLidDrivenChannel(create_lb_method(stencil='D3Q19', relaxation_rate=1.8), flag_arr)
+    print("{:<16}{:>12}".format("Cell order", "MLUPS"))
+    for cell_order in SparseLbMapper.CELL_ORDERS:
+        lbm.set_mapping(create_mapping('D3Q19', flag_arr, cell_order=cell_order))
+        lbm.run(2)
+        time_steps = 10
+        start = time.perf_counter()
+        lbm.run(time_steps)
+        mlups = lbm.mapping.num_fluid_cells * time_steps / (time.perf_counter() - start) * 1e-6
+        print("{:<16}{:>12.1f}".format(cell_order, mlups))
+
+
+@pytest.mark.longrun
+def test_layout_benchmark():
+    flag_arr = porous_channel((96, 96, 96))
+    method = create_lb_method(stencil='D3Q19', relaxation_rate=1.8)
+    print("{:<16}{:>12}".format("Layout", "MLUPS"))
+    for layout in SparseLbMapper.LAYOUTS:
+        lbm = SparseLidDrivenChannel(method, flag_arr, layout)
+        lbm.set_mapping(create_mapping('D3Q19', flag_arr, layout=layout, block_width=8))
+        lbm.run(2)
+        time_steps = 10
+        start = time.perf_counter()
+        lbm.run(time_steps)
+        mlups = lbm.mapping.num_fluid_cells * time_steps / (time.perf_counter() - start) * 1e-6
+        print("{:<16}{:>12.1f}".format(layout, mlups))